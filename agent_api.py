@@ -1,11 +1,32 @@
 import os
-import time
-import google.generativeai as genai
-from flask import Flask, request, jsonify
+import json
+import math
+from collections.abc import Iterable, Mapping
+from flask import Flask, Response, g, request, jsonify, send_from_directory, stream_with_context
 from flask_cors import CORS
 from dotenv import load_dotenv
 from google.api_core import exceptions
 
+import album
+import audio_upload
+import batch
+import catalog
+import cover_art
+import ddex
+import dedupe
+import draft_state
+import draft_store
+import dsp_rules
+import llm_cache
+import metrics
+import nlu
+import normalize
+import prompt_budget
+import providers
+import rate_limit
+import sessions as session_store
+import streaming
+
 # 1. SETUP & AUTH
 # Load the 'creds.env' file specifically
 load_dotenv('creds.env')
@@ -14,7 +35,8 @@ api_key = os.getenv("GEMINI_API_KEY")
 if not api_key:
     raise ValueError("No API Key found. Please check your creds.env file.")
 
-genai.configure(api_key=api_key)
+# Shared, long-lived Gemini client for this key (configured once per process).
+providers.get_client("gemini", api_key)
 
 app = Flask(__name__)
 CORS(app)  # Enables the frontend to talk to this backend
@@ -31,7 +53,7 @@ release_tool = {
                     # Screen 1: Basic Info
                     "release_title": { "type": "STRING", "description": "Title of single/album. No 'feat.' here." },
                     "genre": { "type": "STRING", "description": "Standard DSP genre" },
-                    "version": { "type": "STRING", "description": "e.g., Live, Remix, Acoustic" },
+                    "version": { "type": "STRING", "enum": list(normalize.VERSIONS), "description": "e.g., Live, Remix, Acoustic" },
                     "release_date_mode": { "type": "STRING", "enum": ["ASAP", "SPECIFIC"] },
                     "specific_date": { "type": "STRING", "description": "YYYY-MM-DD" },
                     
@@ -42,8 +64,12 @@ release_tool = {
                         "description": "Full legal names (First Last) only."
                     },
                     "is_explicit": { "type": "BOOLEAN" },
-                    "language": { "type": "STRING" },
+                    "language": { "type": "STRING", "description": "Lyrics language in English (e.g. Spanish), or Instrumental" },
                     
+                    # Album/EP mode: per-track values (everything else is shared by all tracks)
+                    "track_number": { "type": "INTEGER", "description": "Album/EP only: 1-based track these fields apply to. Omit for values every track shares." },
+                    "track_title": { "type": "STRING", "description": "Album/EP only, with track_number: that track's title." },
+
                     # Screen 3: Assets (Flags only)
                     "artwork_uploaded": { "type": "BOOLEAN" },
                     "audio_uploaded": { "type": "BOOLEAN" }
@@ -56,28 +82,98 @@ release_tool = {
 
 # 3. INITIALIZE THE MODEL
 # We use gemini-2.5-flash because you confirmed it works and has quota.
-model = genai.GenerativeModel(
-    model_name="gemini-2.5-flash",
-    tools=[release_tool]
+MODEL_NAME = "gemini-2.5-flash"
+model = None  # a stand-in model (fake_llm) set here replaces the real one
+
+
+def agent_model():
+    # SYSTEM_INSTRUCTION + release_tool are the static prefix: registered once in Gemini's
+    # prompt cache (refreshed before it expires) instead of being resent with every message.
+    return model or providers.gemini_prefix_model(api_key, MODEL_NAME, SYSTEM_INSTRUCTION, tools=[release_tool])
+
+
+# Open the first connection now instead of on the first user's request.
+# LLM_WARM_UP=0 skips it (offline benchmarks swap in a fake model).
+if os.getenv("LLM_WARM_UP", "1") != "0":
+    providers.warm_up_in_background("gemini", api_key)
+
+PAYOUT_GATE_MESSAGE = "I see you don't have a payout method connected. You must connect Stripe or PayPal to proceed."
+
+# 4. RATE LIMITS
+# One shared bucket per API key keeps us under the provider quota. Synchronous
+# requests never sleep longer than SYNC_MAX_WAIT; anything longer is answered with
+# 429 + Retry-After, or handed to the background job pool when the client asks
+# for async mode ({"async": true} or "Prefer: respond-async").
+GEMINI_RPM = int(os.getenv("GEMINI_RPM", "10"))
+SYNC_MAX_WAIT = float(os.getenv("SYNC_MAX_WAIT", "2"))
+ASYNC_MAX_WAIT = float(os.getenv("ASYNC_MAX_WAIT", "120"))
+MAX_RETRIES = 3
+
+gemini_bucket = rate_limit.get_bucket(api_key, GEMINI_RPM)
+jobs = rate_limit.JobQueue(workers=int(os.getenv("CHAT_JOB_WORKERS", "4")))
+
+# Admission in front of every Gemini call: ADMISSION_CONCURRENCY in flight overall,
+# ADMISSION_PER_USER per user, up to ADMISSION_QUEUE waiting (fuller drafts first).
+# A synchronous request queues for at most ADMISSION_MAX_WAIT seconds before a 429.
+admission = rate_limit.Admission(
+    limit=int(os.getenv("ADMISSION_CONCURRENCY", "8")),
+    per_user=int(os.getenv("ADMISSION_PER_USER", "1")),
+    max_queue=int(os.getenv("ADMISSION_QUEUE", "64")),
 )
+ADMISSION_MAX_WAIT = float(os.getenv("ADMISSION_MAX_WAIT", "10"))
 
-@app.route('/chat', methods=['POST'])
-def chat_agent():
-    try:
-        # Get data from Frontend/Simulation
-        data = request.json
-        user_message = data.get('message')
-        history = data.get('history', [])
-        user_context = data.get('userContext', {})
+# Conversation sessions (SESSION_MAX / SESSION_MAX_BYTES / SESSION_TTL / SESSION_DIR / SESSION_DB)
+sessions = session_store.store_from_env()
+
+# LLM response cache (LLM_CACHE_MAX / LLM_CACHE_TTL / LLM_CACHE_DB / LLM_CACHE_BYPASS).
+# Requests can also skip it with {"noCache": true}.
+response_cache = llm_cache.get_cache()
+CACHE_TURNS = 2
+
+# Duplicate /chat turns: identical in-flight requests share one answer, and responses to
+# requests with an Idempotency-Key are replayed for IDEMPOTENCY_TTL seconds (IDEMPOTENCY_MAX keys).
+chat_flights = dedupe.SingleFlight("/chat")
+idempotency_keys = dedupe.store_from_env()
+
+# Prior releases for ISRC/UPC/duplicate checks (CATALOG_DB; None when not configured)
+catalog_index = catalog.get_catalog()
 
-        # 4. DYNAMIC SYSTEM INSTRUCTION (The Brain)
-        system_instruction = f"""
+
+def session_draft(session):
+    # Versioned view over the session's nested draft; draft.data is session["draft"] itself.
+    return draft_state.Draft(session["draft"], session.get("draft_version", 0), session.get("draft_log"))
+
+
+def audio_done(upload):
+    # Finished (and probed) tracks update their session's draft, so the agent sees
+    # assets.audio_status without waiting for a "[System: User uploaded ...]" message.
+    session = sessions.get(upload["sessionId"]) if upload["sessionId"] else None
+    if session is None:
+        return
+    tracks = [u for u in audio_uploads.session_uploads(session["id"]) if u["status"] in ("done", "error")]
+    draft = session_draft(session)
+    draft.apply([
+        {"op": "replace", "path": "assets.audio_files", "value": [{"filename": u["filename"], "ok": u["ok"], **(u["audio"] or {})} for u in tracks]},
+        {"op": "replace", "path": "assets.audio_status", "value": bool(tracks) and all(u["ok"] for u in audio_uploads.session_uploads(session["id"]))},
+    ])
+    session.update(draft.state())
+    sessions.save(session)
+
+
+# Resumable audio uploads (AUDIO_UPLOAD_DIR / AUDIO_MAX_BYTES / AUDIO_PROBE_WORKERS)
+audio_uploads = audio_upload.UploadStore(workers=int(os.getenv("AUDIO_PROBE_WORKERS", "4")), on_complete=audio_done)
+
+
+# 5. SYSTEM INSTRUCTION (The Brain)
+# Static, so the provider can cache it. What changes per turn (payout status, the saved
+# draft) is sent as a CURRENT CONTEXT block in front of the user's message.
+SYSTEM_INSTRUCTION = """
         ROLE: You are the BandLab Release Assistant.
-        
-        CURRENT CONTEXT:
-        - Main Artist Name: "xboggdan" (LOCKED).
-        - Payout Connected: {user_context.get('hasPayoutMethod', True)}
-        
+        The Main Artist Name is "xboggdan" (LOCKED).
+
+        Every user message starts with a CURRENT CONTEXT block (payout status and the draft
+        saved so far). The user's own words follow "USER MESSAGE:".
+
         CRITICAL RULES (Follow Strictly):
         1. **PAYOUT GATE**: If 'Payout Connected' is False, STOP IMMEDIATELY. 
            Say: "I see you don't have a payout method connected. You must connect Stripe or PayPal to proceed."
@@ -95,62 +191,558 @@ def chat_agent():
            
         5. **ARTWORK CHECK**: Ask user to confirm the art has no text, URLs, or brands.
 
+        6. **ALBUM / EP**: When the context lists a Release Type with tracks, credits are shared by
+           every track. Ask each shared question once ("Who composed the songs?"), then only ask
+           about tracks that differ, and pass track_number only for those per-track values.
+
         YOUR GOAL: 
         Ask one question at a time. Call 'update_release_draft' tool to save data.
         """
 
-        # 5. FORMAT HISTORY
+
+def build_turn_context(user_context):
+    return f"""CURRENT CONTEXT:
+- Payout Connected: {user_context.get('hasPayoutMethod', True)}
+- Current Draft (already saved, don't ask again): {{current_state}}"""
+
+
+def extract_function_call(response):
+    # Check for Function Calls (Form Updates)
+    function_call_data = None
+    if response.parts:
+        for part in response.parts:
+            if fn := part.function_call:
+                function_call_data = {
+                    "name": fn.name,
+                    "args": to_plain(fn.args)
+                }
+    return function_call_data
+
+
+def to_plain(value):
+    # Gemini returns proto map/repeated wrappers; sessions and jsonify need plain dicts/lists.
+    if isinstance(value, Mapping):
+        return {k: to_plain(v) for k, v in value.items()}
+    if isinstance(value, Iterable) and not isinstance(value, (str, bytes)):
+        return [to_plain(v) for v in value]
+    return value
+
+
+def format_history(history):
+    # 6. FORMAT HISTORY (client shape -> Gemini contents, only once per session)
+    with metrics.span("history.format"):
         formatted_history = []
         for msg in history:
             role = "user" if msg['role'] == 'user' else "model"
             formatted_history.append({"role": role, "parts": [msg['text']]})
+    return formatted_history
 
-        # 6. START CHAT
-        chat = model.start_chat(history=formatted_history)
-        
-        # Combine System Instruction + User Message
-        full_prompt = f"SYSTEM INSTRUCTION: {system_instruction}\n\nUSER MESSAGE: {user_message}"
 
-        # 7. RETRY LOGIC (The Fix for 'Try again in 1 min')
-        max_retries = 3
-        for attempt in range(max_retries):
+def start_turn(user_message, contents, user_context, draft):
+    # Compact draft state goes into the turn context; old turns are trimmed to the token budget.
+    with metrics.span("prompt.build"):
+        context, kept, report = prompt_budget.build(
+            build_turn_context(user_context), contents, draft,
+            text_of=lambda m: m['parts'][0], role_of=lambda m: m['role'], prefix=SYSTEM_INSTRUCTION,
+        )
+        context += catalog.note_for(catalog_index, draft) + album.note_for(draft)
+    metrics.inc("prompt_tokens_total", report['input_tokens'], part="input")
+    metrics.inc("prompt_tokens_total", report['prefix_tokens'], part="static_prefix")
+    metrics.inc("prompt_trimmed_messages_total", report['dropped_messages'])
+
+    # 7. START CHAT (session history is already stored in Gemini format, so every earlier
+    # turn is passed as real multi-turn history; the static prefix lives in the model)
+    chat = agent_model().start_chat(history=kept)
+
+    # Only the per-turn context travels with the message; history keeps the user's own words.
+    full_prompt = f"{context}\n\nUSER MESSAGE: {user_message}"
+    return chat, full_prompt
+
+
+def send_with_retries(chat, full_prompt, max_wait, stream=False):
+    # 8. RETRY LOGIC (jittered backoff behind the shared bucket)
+    def send():
+        with metrics.span("llm.request", provider="gemini"):
+            return chat.send_message(full_prompt, stream=stream)
+
+    return rate_limit.call_with_retries(
+        send,
+        bucket=gemini_bucket,
+        retry_on=(exceptions.ResourceExhausted,),
+        max_attempts=MAX_RETRIES,
+        max_wait=max_wait,
+        provider="gemini",
+    )
+
+
+def record_usage(response):
+    # Per-call token report: how much of the input came out of the provider's prompt cache.
+    if usage := metrics.usage_tokens(response):
+        metrics.record_tokens("gemini", *usage, cached=metrics.cached_tokens(response))
+
+
+def parse_response(response):
+    # Gemini response -> the {"text", "functionCall"} reply shape used by every route.
+    record_usage(response)
+    with metrics.span("response.parse"):
+        text = response.text
+    with metrics.span("function_call.extract"):
+        function_call = extract_function_call(response)
+    return {"text": text, "functionCall": function_call}
+
+
+def run_chat_turn(user_message, contents, user_context, draft, max_wait):
+    chat, full_prompt = start_turn(user_message, contents, user_context, draft)
+    response = send_with_retries(chat, full_prompt, max_wait)
+    return parse_response(response)
+
+
+def busy_body(retry_after):
+    seconds = max(1, math.ceil(retry_after))
+    return {"error": "Server is busy. Please try again in a moment.", "retryAfter": seconds}, 429, {"Retry-After": str(seconds)}
+
+
+def wants_async(data):
+    return bool(data.get('async')) or 'respond-async' in request.headers.get('Prefer', '')
+
+
+def resolve_session(data):
+    # Known session: use the server-side history. Otherwise start one, seeded with any
+    # client-supplied history so older clients keep working.
+    session = sessions.get(data.get('sessionId'))
+    if session is None:
+        session = sessions.create(history=format_history(data.get('history', [])))
+    return session
+
+
+def admission_ticket(session, user_context):
+    # (user, priority) for the admission queue: a client-supplied userId, else the session;
+    # users further into their submission rank above new conversations.
+    return user_context.get('userId') or session["id"], dsp_rules.completeness(session["draft"])
+
+
+def turn_fingerprint(data, is_async):
+    # What makes two /chat bodies "the same turn". History only matters without a session.
+    return dedupe.fingerprint(data.get('sessionId'), data.get('message'), data.get('userContext', {}),
+                              None if data.get('sessionId') else data.get('history'), is_async)
+
+
+def flight_key(data, key, fingerprint):
+    # Key for chat_flights, or None when the turn must run on its own. A sessionless first turn
+    # has nothing tying it to one client, so two anonymous "hi"s are only merged when they
+    # carry the same Idempotency-Key.
+    if not key and not data.get('sessionId'):
+        return None
+    return key, fingerprint
+
+
+def idempotent_replay(key, fingerprint):
+    # (body, status, headers) stored for this Idempotency-Key, a 422 if the key was used
+    # for a different request, or None if there's nothing to replay.
+    try:
+        saved = idempotency_keys.get(key, fingerprint)
+    except dedupe.KeyReused:
+        return {"error": "This Idempotency-Key was already used for a different request."}, 422, {}
+    if saved is None:
+        return None
+    body, status, headers = saved
+    return body, status, dict(headers, **{"Idempotent-Replayed": "true"})
+
+
+def last_model_text(contents):
+    for msg in reversed(contents):
+        if msg['role'] != 'user':
+            return msg['parts'][0]
+    return None
+
+
+def record_turn(session, user_message, reply):
+    # The reply was computed against session's draft version. Merge its fields into the
+    # latest stored draft as a delta, so an upload finishing (or another tab's turn)
+    # mid-request isn't overwritten; only fields changed on both sides keep the newer value.
+    base_version = session.get("draft_version", 0)
+    session = sessions.get(session["id"]) or session
+    if reply.get("functionCall"):
+        with metrics.span("draft.merge"):
+            draft = session_draft(session)
             try:
-                response = chat.send_message(full_prompt)
-                
-                # Check for Function Calls (Form Updates)
-                function_call_data = None
-                if response.parts:
-                    for part in response.parts:
-                        if fn := part.function_call:
-                            function_call_data = {
-                                "name": fn.name,
-                                "args": dict(fn.args) 
-                            }
-                
-                # Success! Return data.
-                return jsonify({
-                    "text": response.text,
-                    "functionCall": function_call_data
-                })
-
-            except exceptions.ResourceExhausted:
-                # This catches the 429 Rate Limit error
-                wait_time = 30
-                print(f"⚠️ Rate limit hit. Waiting {wait_time} seconds... (Attempt {attempt+1}/{max_retries})")
-                time.sleep(wait_time)
-                continue  # Loop back and try again
-
-            except Exception as e:
-                # Other errors fail immediately
-                print(f"❌ Error: {e}")
-                return jsonify({"error": str(e)}), 500
-
-        # If all retries fail
-        return jsonify({"error": "Server is busy. Please try again in a moment."}), 429
+                ops = album.fields_to_ops(reply["functionCall"]["args"], draft.data)
+                try:
+                    draft.apply(ops, base_version)
+                except draft_state.DraftConflict as e:
+                    print(f"⚠️ {e}")
+                    draft.apply(e.clean_ops)
+            except draft_state.InvalidPatch as e:
+                # Not saved: answer with the problem instead, like a local rule rejection.
+                print(f"⚠️ {e}")
+                reply = {"text": f"I couldn't save that: {e} Could you check it and send it again?", "functionCall": None}
+            session.update(draft.state())
+    session["history"] += [
+        {"role": "user", "parts": [user_message]},
+        {"role": "model", "parts": [reply["text"]]},
+    ]
+    sessions.save(session)
+    return dict(reply, sessionId=session["id"])
+
+
+def turn_cache_key(session, user_message, user_context):
+    recent = [{"role": m['role'], "text": m['parts'][0]} for m in session["history"][-CACHE_TURNS:]]
+    return llm_cache.make_key(SYSTEM_INSTRUCTION + build_turn_context(user_context), session["draft"], recent, user_message)
+
+
+def local_reply(session, user_message, user_context):
+    # The payout gate is deterministic, so answer it before any validation or LLM call.
+    if not user_context.get('hasPayoutMethod', True):
+        return {"text": PAYOUT_GATE_MESSAGE, "functionCall": None}
+
+    # Local DSP rules reject invalid replies without a round trip to Gemini.
+    last_question = last_model_text(session["history"])
+    with metrics.span("rules.precheck"):
+        rejected = dsp_rules.precheck(last_question, user_message) or catalog.precheck(catalog_index, user_message, session["draft"])
+    if rejected:
+        return {"text": rejected["response"], "functionCall": None}
+
+    # Confident slot-filling turns skip the LLM; the slots become a regular tool call.
+    if (fast := nlu.fast_reply(last_question, user_message, session["draft"], catalog_index)) is not None:
+        return {"text": fast["response"], "functionCall": {"name": "update_release_draft", "args": nlu.to_fields(fast["updates"])}}
+    return None
+
+
+@app.before_request
+def start_timer():
+    g.started = metrics.span("http.request", route=request.url_rule.rule if request.url_rule else "unmatched")
+    g.started.__enter__()
+
+
+@app.after_request
+def stop_timer(response):
+    # Streamed bodies (SSE, NDJSON) are timed up to the first byte.
+    if started := g.pop('started', None):
+        started.__exit__(None, None, None)
+        metrics.inc("http_requests_total", route=request.url_rule.rule if request.url_rule else "unmatched", status=response.status_code)
+    return response
+
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    # Prometheus text exposition (METRICS_ENABLED=0 leaves it empty).
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+def chat_turn(data, is_async):
+    # One /chat turn as (body, status, headers), so it can be shared and replayed.
+    user_message = data.get('message')
+    user_context = data.get('userContext', {})
+    session = resolve_session(data)
+
+    if (reply := local_reply(session, user_message, user_context)) is not None:
+        return record_turn(session, user_message, reply), 200, {}
+
+    # Response cache: identical question from the same state is answered from memory/disk.
+    bypass = bool(data.get('noCache')) or llm_cache.bypass_from_env()
+    cache_key = turn_cache_key(session, user_message, user_context)
+    if (cached := response_cache.get(cache_key, bypass)) is not None:
+        return record_turn(session, user_message, cached), 200, {}
+
+    def answer(max_wait, queue_wait):
+        with admission.slot(*admission_ticket(session, user_context), timeout=queue_wait):
+            reply = run_chat_turn(user_message, session["history"], user_context, session["draft"], max_wait)
+        response_cache.put(cache_key, reply, bypass)
+        return record_turn(session, user_message, reply)
+
+    if is_async:
+        job_id = jobs.submit(lambda: answer(ASYNC_MAX_WAIT, ASYNC_MAX_WAIT))
+        return {"jobId": job_id, "status": "pending", "sessionId": session["id"]}, 202, {"Location": f"/chat/jobs/{job_id}"}
+
+    try:
+        return answer(SYNC_MAX_WAIT, ADMISSION_MAX_WAIT), 200, {}
+    except rate_limit.RateLimited as e:
+        return busy_body(e.retry_after)
+    except Exception as e:
+        # Other errors fail immediately
+        print(f"❌ Error: {e}")
+        return {"error": str(e)}, 500, {}
+
+
+@app.route('/chat', methods=['POST'])
+def chat_agent():
+    try:
+        # Get data from Frontend/Simulation
+        data = request.json
+        is_async = wants_async(data)
+        key = request.headers.get('Idempotency-Key')
+        fingerprint = turn_fingerprint(data, is_async)
+        if key and (saved := idempotent_replay(key, fingerprint)) is not None:
+            return jsonify(saved[0]), saved[1], saved[2]
+
+        def turn():
+            result = chat_turn(data, is_async)
+            if key and result[1] < 300:
+                idempotency_keys.put(key, fingerprint, result)
+            return result
+
+        # Same turn already in flight (double-click, client retry): wait for it and share its answer.
+        flight = flight_key(data, key, fingerprint)
+        body, status, headers = chat_flights.do(flight, turn)[0] if flight else turn()
+        return jsonify(body), status, headers
 
     except Exception as e:
         print(f"Server Error: {e}")
         return jsonify({"error": str(e)}), 500
 
+
+@app.route('/chat/stream', methods=['POST'])
+def chat_stream():
+    # Same request body as /chat. Replies as Server-Sent Events:
+    #   event: token        {"text": "..."}        (repeated as Gemini streams)
+    #   event: functionCall {"name", "args"}       (once, if the draft was updated)
+    #   event: done         {"sessionId", "text"}
+    #   event: error        {"error", "retryAfter"?}
+    data = request.json
+    user_message = data.get('message')
+    user_context = data.get('userContext', {})
+    session = resolve_session(data)
+    bypass = bool(data.get('noCache')) or llm_cache.bypass_from_env()
+    cache_key = turn_cache_key(session, user_message, user_context)
+
+    reply = local_reply(session, user_message, user_context)
+    if reply is None:
+        reply = response_cache.get(cache_key, bypass)
+
+    def finish(reply):
+        result = record_turn(session, user_message, reply)
+        if result.get("functionCall"):
+            yield streaming.sse_event("functionCall", result["functionCall"])
+        yield streaming.sse_event("done", {"sessionId": result["sessionId"], "text": result["text"]})
+
+    def events():
+        if reply is not None:
+            yield streaming.sse_event("token", {"text": reply["text"]})
+            yield from finish(reply)
+            return
+
+        chat, full_prompt = start_turn(user_message, session["history"], user_context, session["draft"])
+        text_parts = []
+        function_call_data = None
+        last_chunk = None
+        try:
+            # The admission slot is held until the stream ends (or the client goes away).
+            with admission.slot(*admission_ticket(session, user_context), timeout=ADMISSION_MAX_WAIT):
+                for chunk in send_with_retries(chat, full_prompt, SYNC_MAX_WAIT, stream=True):
+                    for part in chunk.parts:
+                        if part.text:
+                            text_parts.append(part.text)
+                            yield streaming.sse_event("token", {"text": part.text})
+                    function_call_data = extract_function_call(chunk) or function_call_data
+                    if metrics.usage_tokens(chunk):
+                        last_chunk = chunk
+        except rate_limit.RateLimited as e:
+            yield streaming.sse_event("error", {"error": "Server is busy. Please try again in a moment.", "retryAfter": max(1, math.ceil(e.retry_after))})
+            return
+        except exceptions.ResourceExhausted as e:
+            # 429 after the stream already started: no retry, just tell the client when to come back.
+            gemini_bucket.pause(rate_limit.retry_hint(e) or 30)
+            yield streaming.sse_event("error", {"error": "Server is busy. Please try again in a moment.", "retryAfter": math.ceil(rate_limit.retry_hint(e) or 30)})
+            return
+        except Exception as e:
+            print(f"❌ Error: {e}")
+            yield streaming.sse_event("error", {"error": str(e)})
+            return
+
+        if last_chunk is not None:
+            record_usage(last_chunk)
+        streamed = {"text": "".join(text_parts), "functionCall": function_call_data}
+        response_cache.put(cache_key, streamed, bypass)
+        yield from finish(streamed)
+
+    return Response(events(), mimetype='text/event-stream', headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.route('/releases/batch', methods=['POST'])
+def releases_batch():
+    # Body: CSV (text/csv) or JSONL (application/x-ndjson), or ?format=csv|jsonl.
+    # Rows are read and validated as they stream in; results stream back as NDJSON.
+    # Rows that need clarification get an agent session opened on their first issue.
+    fmt = request.args.get('format') or batch.detect_format(request.mimetype)
+    lines = (line.decode('utf-8') for line in request.stream)
+
+    def routed(results):
+        for result in results:
+            if result["status"] == "needs_agent":
+                question = result["issues"][0]["message"]
+                session = sessions.create(history=[{"role": "model", "parts": [question]}], draft=result["draft"])
+                result["sessionId"] = session["id"]
+            yield result
+
+    results = routed(batch.validate_stream(batch.iter_rows(lines, fmt)))
+    return Response(stream_with_context(batch.to_ndjson(results)), mimetype='application/x-ndjson')
+
+
+@app.route('/cover-art', methods=['POST'])
+def cover_art_upload():
+    # Body: the raw image, or multipart/form-data with a "file" field.
+    # DSP checks run on a worker pool; results are cached by content hash.
+    source = request.files['file'].stream if 'file' in request.files else request.stream
+    result = cover_art.analyze_upload(source)
+    return jsonify(result), 413 if result.get("too_large") else 200
+
+
+@app.route('/cover-art/<digest>/<int:size>.jpg', methods=['GET'])
+def cover_art_thumbnail(digest, size):
+    return send_from_directory(cover_art.ART_DIR, f"{digest}_{size}.jpg", mimetype='image/jpeg', max_age=86400)
+
+
+@app.route('/uploads/audio', methods=['POST'])
+def audio_upload_create():
+    # Body: {"filename", "size", "sha256"?, "sessionId"?}, or {"files": [...], "sessionId"?} for an album.
+    # Then PATCH each upload with chunks (Upload-Offset header, optional Upload-Checksum: sha256 <hex>).
+    data = request.json or {}
+    files = data.get('files') or [data]
+    try:
+        uploads = [audio_uploads.create(f.get('filename'), f.get('size'), f.get('sha256'), data.get('sessionId')) for f in files]
+    except audio_upload.UploadError as e:
+        return jsonify({"error": str(e)}), e.status
+    body = [dict(audio_upload.public(u), chunkSize=audio_upload.CLIENT_CHUNK_SIZE) for u in uploads]
+    if 'files' in data:
+        return jsonify({"uploads": body}), 201
+    return jsonify(body[0]), 201, {"Location": f"/uploads/audio/{uploads[0]['id']}"}
+
+
+@app.route('/uploads/audio/<upload_id>', methods=['PATCH', 'PUT'])
+def audio_upload_chunk(upload_id):
+    checksum = request.headers.get('Upload-Checksum', '')
+    offset = request.headers.get('Upload-Offset', '0')
+    if not offset.isdigit():
+        return jsonify({"error": "Upload-Offset must be an integer."}), 400
+    try:
+        upload = audio_uploads.write_chunk(upload_id, int(offset), request.stream, checksum.split(' ')[-1] if checksum.startswith('sha256') else None)
+    except audio_upload.UploadError as e:
+        headers = {"Upload-Offset": str(e.offset)} if e.offset is not None else {}
+        return jsonify({"error": str(e), "offset": e.offset}), e.status, headers
+    return jsonify(audio_upload.public(upload)), 200, {"Upload-Offset": str(upload["offset"])}
+
+
+@app.route('/uploads/audio/<upload_id>', methods=['GET', 'HEAD'])
+def audio_upload_status(upload_id):
+    # HEAD: where to resume from. GET: progress, then the probe result once status is "done".
+    upload = audio_uploads.get(upload_id)
+    if upload is None:
+        return jsonify({"error": "Unknown upload."}), 404
+    headers = {"Upload-Offset": str(upload["offset"]), "Upload-Length": str(upload["size"]), "Cache-Control": "no-store"}
+    if request.method == 'HEAD':
+        return '', 200, headers
+    return jsonify(audio_upload.public(upload)), 200, headers
+
+
+@app.route('/catalog/lookup', methods=['GET'])
+def catalog_lookup():
+    # ?isrc=...&upc=...&title=...&artist=... -> prior releases that match any of them
+    if catalog_index is None:
+        return jsonify({"error": "No catalog configured (set CATALOG_DB)."}), 404
+    args = request.args
+    matches = catalog_index.by_isrc(args.get('isrc')) + catalog_index.by_upc(args.get('upc'))
+    if args.get('title'):
+        matches += catalog_index.duplicates(args['title'], args.get('artist') or catalog.MAIN_ARTIST)
+    return jsonify({"matches": matches})
+
+
+@app.route('/sessions/stats', methods=['GET'])
+def session_stats():
+    stats = dict(sessions.stats(), coalescing=chat_flights.stats(), idempotency=idempotency_keys.stats(), admission=admission.stats())
+    if sessions.drafts:
+        stats["drafts"] = sessions.drafts.stats()
+    return jsonify(stats)
+
+
+@app.route('/drafts/export', methods=['GET'])
+def drafts_export():
+    # NDJSON, one draft per line, streamed from SQLite in chunks.
+    # ?status=complete (default) | in_progress | all, ?since=<unix time of last update>
+    if not sessions.drafts:
+        return jsonify({"error": "No draft database configured (set SESSION_DB)."}), 404
+    status = request.args.get('status', 'complete')
+    drafts = sessions.drafts.export(None if status == 'all' else status, float(request.args.get('since', 0)))
+    return Response(stream_with_context(draft_store.to_ndjson(drafts)), mimetype='application/x-ndjson')
+
+
+@app.route('/drafts/<draft_id>/ddex', methods=['GET'])
+def draft_ddex(draft_id):
+    # DDEX ERN 4.3 NewReleaseMessage for one completed draft (catalogs: python ddex.py)
+    session = sessions.get(draft_id)
+    if session is None:
+        return jsonify({"error": "Unknown or expired draft."}), 404
+    issues = album.validate(session["draft"])
+    if issues:
+        return jsonify({"error": "Draft is not complete.", "issues": album.issue_list(issues, session["draft"])}), 409
+    ref = ddex.release_ref({"id": draft_id})
+    with metrics.span("ddex_render"):
+        body = ddex.render(session["draft"], ref)
+    return Response(body, mimetype='application/xml', headers={"Content-Disposition": f'attachment; filename="{ref}.xml"'})
+
+
+@app.route('/sessions/<session_id>/tracks', methods=['GET', 'POST'])
+def session_tracks(session_id):
+    # POST {"titles": [...]} turns the session's draft into an album/EP (credits so far become
+    # the shared ones). GET: release type, shared fields, per-track overrides and open issues.
+    session = sessions.get(session_id)
+    if session is None:
+        return jsonify({"error": "Unknown or expired session."}), 404
+    if request.method == 'POST':
+        titles = (request.json or {}).get('titles') or []
+        draft = session_draft(session)
+        try:
+            draft.apply(album.start(draft.data, titles))
+        except draft_state.InvalidPatch as e:
+            return jsonify({"error": str(e)}), 400
+        session.update(draft.state())
+        sessions.save(session)
+    with metrics.span("album.validate"):
+        return jsonify(album.summary(session["draft"]))
+
+
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    return jsonify(response_cache.stats())
+
+
+@app.route('/sessions/<session_id>', methods=['GET', 'DELETE'])
+def session_detail(session_id):
+    if request.method == 'DELETE':
+        sessions.delete(session_id)
+        return '', 204
+    session = sessions.get(session_id)
+    if session is None:
+        return jsonify({"error": "Unknown or expired session."}), 404
+    history = [{"role": m['role'], "text": m['parts'][0]} for m in session["history"]]
+    return jsonify({"sessionId": session["id"], "history": history, "draft": session["draft"], "draftVersion": session["draft_version"]})
+
+
+@app.route('/chat/jobs/<job_id>', methods=['GET'])
+def chat_job(job_id):
+    # Long-poll: ?wait=N blocks up to N seconds (max 25) for the job to finish.
+    wait = min(float(request.args.get('wait', 0)), 25.0)
+    job = jobs.wait(job_id, wait) if wait > 0 else jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job id."}), 404
+    return jsonify(rate_limit.job_view(job)), (202 if job["status"] == "pending" else 200)
+
+
+@app.route('/chat/jobs/<job_id>/stream', methods=['GET'])
+def chat_job_stream(job_id):
+    if jobs.get(job_id) is None:
+        return jsonify({"error": "Unknown job id."}), 404
+
+    def events():
+        # Heartbeat comments keep proxies from closing the connection while we wait.
+        while True:
+            job = jobs.wait(job_id, 15)
+            if job is None or job["status"] != "pending":
+                break
+            yield ": waiting\n\n"
+        payload = rate_limit.job_view(job) if job else {"id": job_id, "status": "expired"}
+        yield f"event: {payload['status']}\ndata: {json.dumps(payload)}\n\n"
+
+    return Response(events(), mimetype='text/event-stream', headers={"Cache-Control": "no-cache"})
+
 if __name__ == '__main__':
     app.run(port=5000, debug=True)
\ No newline at end of file
@@ -0,0 +1,167 @@
+import asyncio
+import os
+
+from a2wsgi import WSGIMiddleware
+from google.api_core import exceptions
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Mount, Route
+
+import agent_api as api
+import dedupe
+import llm_cache
+import metrics
+import rate_limit
+
+# --- ASYNC SERVING MODE ---
+# Same /chat contract as agent_api.py, but served from an event loop: a request that
+# is waiting on Gemini holds a coroutine, not a thread. Upstream calls are bounded by
+# UPSTREAM_CONCURRENCY, cut off after UPSTREAM_TIMEOUT seconds, and cancelled as soon
+# as the client disconnects (once no coalesced duplicate still waits for it). Idempotency-Key
+# replays share agent_api's store. Every other route is the Flask app, mounted as-is.
+#
+# Run: uvicorn agent_asgi:app --port 5000
+
+UPSTREAM_CONCURRENCY = int(os.getenv("UPSTREAM_CONCURRENCY", "64"))
+UPSTREAM_TIMEOUT = float(os.getenv("UPSTREAM_TIMEOUT", "60"))
+DISCONNECT_POLL = 0.5
+
+upstream_slots = asyncio.Semaphore(UPSTREAM_CONCURRENCY)
+chat_flights = dedupe.AsyncSingleFlight("/chat")
+
+
+class ClientDisconnected(Exception):
+    pass
+
+
+async def until_disconnected(request, coro):
+    # Run coro, but cancel it (and stop paying for the upstream call) if the client goes away.
+    task = asyncio.ensure_future(coro)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                raise ClientDisconnected()
+    finally:
+        if not task.done():
+            task.cancel()
+
+
+async def upstream_turn(user_message, session, user_context):
+    async with upstream_slots:
+        # May create or extend the provider's prefix cache (a network call), so off the loop.
+        chat, full_prompt = await asyncio.to_thread(api.start_turn, user_message, session["history"], user_context, session["draft"])
+        async def send():
+            with metrics.span("llm.request", provider="gemini"):
+                return await chat.send_message_async(full_prompt)
+
+        response = await rate_limit.acall_with_retries(
+            send,
+            bucket=api.gemini_bucket,
+            retry_on=(exceptions.ResourceExhausted,),
+            max_attempts=api.MAX_RETRIES,
+            max_wait=api.SYNC_MAX_WAIT,
+            provider="gemini",
+        )
+        return api.parse_response(response)
+
+
+async def upstream_answer(user_message, session, user_context, cache_key, bypass):
+    # Same admission queue as the Flask routes; waiting in it doesn't hold a thread.
+    async with api.admission.aslot(*api.admission_ticket(session, user_context), timeout=api.ADMISSION_MAX_WAIT):
+        reply = await asyncio.wait_for(upstream_turn(user_message, session, user_context), UPSTREAM_TIMEOUT)
+    await asyncio.to_thread(api.response_cache.put, cache_key, reply, bypass)
+    return await asyncio.to_thread(api.record_turn, session, user_message, reply)
+
+
+async def chat_turn(data, is_async):
+    # One /chat turn as (body, status, headers), shared by coalesced duplicates.
+    user_message = data.get('message')
+    user_context = data.get('userContext', {})
+    # Session/cache calls may touch disk or SQLite, so they run off the event loop.
+    session = await asyncio.to_thread(api.resolve_session, data)
+
+    if (reply := await asyncio.to_thread(api.local_reply, session, user_message, user_context)) is not None:
+        return await asyncio.to_thread(api.record_turn, session, user_message, reply), 200, {}
+
+    bypass = bool(data.get('noCache')) or llm_cache.bypass_from_env()
+    cache_key = api.turn_cache_key(session, user_message, user_context)
+    if (cached := await asyncio.to_thread(api.response_cache.get, cache_key, bypass)) is not None:
+        return await asyncio.to_thread(api.record_turn, session, user_message, cached), 200, {}
+
+    if is_async:
+        def answer():
+            with api.admission.slot(*api.admission_ticket(session, user_context), timeout=api.ASYNC_MAX_WAIT):
+                reply = api.run_chat_turn(user_message, session["history"], user_context, session["draft"], api.ASYNC_MAX_WAIT)
+            api.response_cache.put(cache_key, reply, bypass)
+            return api.record_turn(session, user_message, reply)
+        job_id = api.jobs.submit(answer)
+        return {"jobId": job_id, "status": "pending", "sessionId": session["id"]}, 202, {"Location": f"/chat/jobs/{job_id}"}
+
+    try:
+        return await upstream_answer(user_message, session, user_context, cache_key, bypass), 200, {}
+    except asyncio.TimeoutError:
+        return {"error": "The assistant took too long to answer. Please try again."}, 504, {}
+    except rate_limit.RateLimited as e:
+        return api.busy_body(e.retry_after)
+    except Exception as e:
+        # Other errors fail immediately
+        print(f"❌ Error: {e}")
+        return {"error": str(e)}, 500, {}
+
+
+async def chat_agent(request):
+    try:
+        data = await request.json()
+        is_async = bool(data.get('async')) or 'respond-async' in request.headers.get('prefer', '')
+        key = request.headers.get('idempotency-key')
+        fingerprint = api.turn_fingerprint(data, is_async)
+        if key and (saved := api.idempotent_replay(key, fingerprint)) is not None:
+            return JSONResponse(saved[0], status_code=saved[1], headers=saved[2])
+
+        async def turn():
+            result = await chat_turn(data, is_async)
+            if key and result[1] < 300:
+                api.idempotency_keys.put(key, fingerprint, result)
+            return result
+
+        async def alone():
+            return await turn(), False
+
+        flight = api.flight_key(data, key, fingerprint)
+        try:
+            (body, status, headers), _ = await until_disconnected(request, chat_flights.do(flight, turn) if flight else alone())
+        except ClientDisconnected:
+            print("🔌 Client disconnected; upstream call cancelled.")
+            return Response(status_code=499)
+        return JSONResponse(body, status_code=status, headers=headers)
+
+    except Exception as e:
+        print(f"Server Error: {e}")
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+
+async def timed_chat_agent(request):
+    # Same http.request span / request counter the Flask hooks record for mounted routes.
+    with metrics.span("http.request", route="/chat"):
+        response = await chat_agent(request)
+    metrics.inc("http_requests_total", route="/chat", status=response.status_code)
+    return response
+
+
+app = Starlette(
+    routes=[
+        Route('/chat', timed_chat_agent, methods=['POST']),
+        Mount('/', app=WSGIMiddleware(api.app)),
+    ],
+    # Same open CORS policy as flask_cors' CORS(app) default.
+    middleware=[Middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"], expose_headers=["Retry-After", "Location", "Idempotent-Replayed"])],
+)
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(app, port=5000)
@@ -0,0 +1,233 @@
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import draft_state
+import dsp_rules
+import normalize
+
+# --- ALBUM / EP MODE ---
+# A multi-track release is still one draft. It adds a "tracks" list:
+#   {"release": {..., "type": "EP"}, "track": {shared credits, lyrics, ...},
+#    "tracks": [{"title": "Intro", "lyrics": {"language": "Instrumental"}}, {"title": "Song 2"}, ...]}
+# "track" holds the track-level fields every track shares, and it is stored once. Each
+# "tracks" entry holds only that track's own title/ISRC plus any field that differs
+# (an override). track_view() builds a track's effective draft as an overlay. Sections
+# the track doesn't override are shared by reference, never copied, so a 20-track
+# album keeps one set of credits and not 20.
+#
+# Validation follows the same split. The shared credits are validated once. Tracks
+# with no overrides inherit that result. Each distinct set of overrides is validated
+# once, concurrently. Issues are then collapsed, so the agent asks a shared question
+# once and a per-track question only for the tracks where it actually differs.
+
+MAX_TRACKS = int(os.getenv("ALBUM_MAX_TRACKS", "40"))
+TRACK_OWN = ("title", "isrc")  # always per track, never inherited
+WORKERS = int(os.getenv("ALBUM_VALIDATION_WORKERS", "4"))
+
+
+def release_type(track_count):
+    # DSP convention: 1-3 tracks is a Single, 4-6 an EP, 7+ an Album.
+    return "Single" if track_count <= 3 else "EP" if track_count <= 6 else "Album"
+
+
+def is_album(draft):
+    return isinstance((draft or {}).get("tracks"), list)
+
+
+def overlay(shared, override):
+    """shared with override on top. Only dicts along overridden paths are new; everything else is shared."""
+    if not isinstance(shared, dict) or not isinstance(override, dict):
+        return override
+    if not override:
+        return shared
+    merged = dict(shared)
+    for key, value in override.items():
+        merged[key] = overlay(shared.get(key), value) if isinstance(value, dict) else value
+    return merged
+
+
+def track_view(draft, index):
+    """Single-track draft for track index (0-based): the release, the shared track fields and that track's overrides."""
+    view = {k: v for k, v in draft.items() if k != "tracks"}
+    view["track"] = overlay(draft.get("track") or {}, draft["tracks"][index])
+    return view
+
+
+def overridden_paths(override, prefix="track"):
+    paths = set()
+    for key, value in (override or {}).items():
+        path = f"{prefix}.{key}"
+        if isinstance(value, dict):
+            paths |= overridden_paths(value, path)
+        else:
+            paths.add(path)
+    return paths
+
+
+def _signature(override):
+    # Tracks whose overrides (besides title/ISRC) are equal validate the same way.
+    rest = {k: v for k, v in (override or {}).items() if k not in TRACK_OWN}
+    return json.dumps(rest, sort_keys=True, ensure_ascii=False, default=str) if rest else ""
+
+
+# --- DRAFT CHANGES ---
+
+def start(draft, titles):
+    """Ops that turn a single draft into an album with one entry per track title."""
+    if not 1 <= len(titles) <= MAX_TRACKS:
+        raise draft_state.InvalidPatch(f"An album needs 1-{MAX_TRACKS} tracks.")
+    tracks = [{"title": str(t).strip()} for t in titles]
+    ops = [{"op": "replace", "path": "tracks", "value": tracks},
+           {"op": "replace", "path": "release.type", "value": release_type(len(tracks))}]
+    if "title" in (draft.get("track") or {}):
+        ops.append({"op": "remove", "path": "track.title"})  # the Single's title lock doesn't apply
+    return ops
+
+
+def fields_to_ops(fields, current):
+    """
+    release_tool arguments -> ops. Singles are unchanged. On an album, track_number (1-based)
+    sends the track-level fields to that track's overrides. Without it, they go to the
+    shared fields every track inherits.
+    """
+    fields = dict(fields or {})
+    number = fields.pop("track_number", None)
+    track_title = fields.pop("track_title", None)
+    if not is_album(current):
+        return draft_state.fields_to_ops(fields, current)
+    if number is None:
+        return draft_state.fields_to_ops(fields, current)
+    index = int(number) - 1
+    if not 0 <= index < len(current["tracks"]):
+        raise draft_state.InvalidPatch(f"There is no track {number} (the release has {len(current['tracks'])}).")
+    if track_title:
+        fields["track_title"] = track_title
+    # Diff against this track's own overrides, then retarget track.* ops at tracks.<index>.
+    ops = draft_state.fields_to_ops(fields, {"release": current.get("release") or {}, "track": current["tracks"][index]})
+    for op in ops:
+        if op["path"].startswith("track."):
+            op["path"] = f"tracks.{index}." + op["path"][len("track."):]
+    return ops
+
+
+# --- CONCURRENT VALIDATION ---
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="album-validate")
+        return _pool
+
+
+def _track_own_issues(draft):
+    issues = []
+    seen = {}
+    for n, track in enumerate(draft["tracks"], start=1):
+        title = track.get("title")
+        if not title:
+            issues.append(("track.title", "The track title is missing.", n))
+        elif error := dsp_rules.validate_title(title, "track title"):
+            issues.append(("track.title", error, n))
+        isrc = (track.get("isrc") or "").replace("-", "").upper()
+        if isrc and isrc in seen:
+            issues.append(("track.isrc", f"ISRC {track['isrc']} is already used by track {seen[isrc]}. Each track needs its own ISRC.", n))
+        seen.setdefault(isrc, n)
+    return issues
+
+
+def validate(draft, pool=None):
+    """
+    Issues for a single or an album as [(path, message, tracks)], where tracks is None when
+    the issue is about the shared fields (ask once) or the 1-based track numbers it applies to.
+    """
+    if not is_album(draft):
+        return [(path, message, None) for path, message in dsp_rules.validate_draft(draft)]
+    tracks = draft["tracks"]
+    if not tracks:
+        return [("tracks", "The release has no tracks yet.", None)]
+
+    # Distinct override sets; identical ones (or none at all) are validated once.
+    groups = {}
+    for n, override in enumerate(tracks, start=1):
+        groups.setdefault(_signature(override), []).append(n)
+    views = {signature: track_view(draft, members[0] - 1) for signature, members in groups.items() if signature}
+    shared_view = {k: v for k, v in draft.items() if k != "tracks"}
+    # One batched fuzzy pass over every genre/language/version value before the checks fan out.
+    for path, kind in normalize.PATH_KINDS.items():
+        normalize.prewarm(kind, [dsp_rules.get_path(v, path) for v in (shared_view, *views.values())])
+
+    futures = {signature: (pool or get_pool()).submit(dsp_rules.validate_draft, view) for signature, view in views.items()}
+    shared = dsp_rules.validate_draft(shared_view)
+    results = {signature: future.result() for signature, future in futures.items()}
+
+    # An issue is per track only where that track overrides the field. Anything else is about
+    # the shared fields and is asked once, even when only an overriding track's view got far
+    # enough to report it (validate_draft stops at the first missing field). A shared issue
+    # that every track's override fixes is dropped.
+    reported = {}
+    per_track = {}
+    for signature, members in groups.items():
+        own = overridden_paths({k: v for k, v in tracks[members[0] - 1].items() if k not in TRACK_OWN})
+        for issue in results[signature] if signature else shared:
+            if any(issue[0] == p or issue[0].startswith(p + ".") for p in own):
+                per_track.setdefault(issue, []).extend(members)
+            else:
+                reported[issue] = None
+    issues = [(*issue, None) for issue in [i for i in shared if i in reported] + [i for i in reported if i not in shared]]
+    issues += [(path, message, sorted(numbers)) for (path, message), numbers in per_track.items()]
+    for path, message, n in _track_own_issues(draft):
+        issues.append((path, message, [n]))
+    return issues
+
+
+def issue_list(issues, draft):
+    # JSON shape for API responses: {"field", "message", "tracks"?}
+    out = []
+    for path, message, numbers in issues:
+        item = {"field": path, "message": message}
+        if numbers is not None:
+            item["tracks"] = [{"number": n, "title": draft["tracks"][n - 1].get("title")} for n in numbers]
+        out.append(item)
+    return out
+
+
+def _track_label(numbers, draft):
+    if len(numbers) == 1:
+        title = draft["tracks"][numbers[0] - 1].get("title")
+        return f"Track {numbers[0]}" + (f" ({title})" if title else "")
+    missing = [n for n in range(1, len(draft["tracks"]) + 1) if n not in numbers]
+    if len(missing) < len(numbers):
+        return "All tracks except " + ", ".join(str(n) for n in missing)
+    return "Tracks " + ", ".join(str(n) for n in numbers)
+
+
+def note_for(draft):
+    """Prompt note for an album: the open questions, already collapsed, so the agent asks each one once."""
+    if not is_album(draft):
+        return ""
+    issues = validate(draft)
+    lines = [f"\n- Release Type: {dsp_rules.get_path(draft, 'release.type') or release_type(len(draft['tracks']))} "
+             f"with {len(draft['tracks'])} tracks. Fields without track_number apply to every track; "
+             "only pass track_number for a value that differs on that track."]
+    if issues:
+        lines.append("- Open questions (ask in this order, shared ones once for all tracks):")
+        for path, message, numbers in issues[:8]:
+            lines.append(f"  * {_track_label(numbers, draft) + ': ' if numbers else ''}{message} [{path}]")
+    return "\n".join(lines)
+
+
+def summary(draft):
+    # GET /sessions/<id>/tracks: overrides as stored plus what each track differs in.
+    issues = validate(draft)
+    tracks = [{"number": n, "title": t.get("title"), "isrc": t.get("isrc"),
+               "overrides": sorted(overridden_paths({k: v for k, v in t.items() if k not in TRACK_OWN}))}
+              for n, t in enumerate(draft.get("tracks") or [], start=1)]
+    return {"releaseType": dsp_rules.get_path(draft, "release.type") or ("Single" if not tracks else release_type(len(tracks))),
+            "shared": draft.get("track") or {}, "tracks": tracks, "issues": issue_list(issues, draft)}
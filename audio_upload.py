@@ -0,0 +1,297 @@
+import hashlib
+import json
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+# --- RESUMABLE AUDIO UPLOADS ---
+# An upload is created with its filename and total size, then filled with chunks
+# sent at an explicit offset. Each chunk is streamed straight to disk while the
+# running SHA-256 is updated, so memory stays constant however large the master
+# is. When an upload drops, HEAD tells the client the offset to resume from.
+# Once the last byte lands, the file is probed on a worker pool (several tracks
+# of an album are probed in parallel). The probe reads WAV/FLAC headers through
+# mmap, so only the header pages are ever read from disk.
+#
+# Upload: {"id", "filename", "size", "offset", "sha256", "status": uploading | processing | done | error, "ok",
+#          "audio": {"format", "sample_rate", "bit_depth", "channels", "duration"}, "issues", "sessionId"}
+
+UPLOAD_DIR = os.getenv("AUDIO_UPLOAD_DIR") or os.path.join(tempfile.gettempdir(), "distro_audio")
+MAX_BYTES = int(os.getenv("AUDIO_MAX_BYTES", str(2 * 1024 * 1024 * 1024)))
+CHUNK_SIZE = 1024 * 1024  # bytes read from the request stream at a time
+CLIENT_CHUNK_SIZE = 8 * 1024 * 1024  # suggested size of each PATCH body
+
+MIN_SAMPLE_RATE = 44100
+BIT_DEPTHS = (16, 24, 32)
+MAX_CHANNELS = 2
+MIN_DURATION = 1.0
+MAX_DURATION = 4 * 60 * 60
+
+
+class UploadError(Exception):
+    def __init__(self, message, status=400, offset=None):
+        super().__init__(message)
+        self.status = status
+        self.offset = offset
+
+
+# --- HEADER PROBES (mmap) ---
+
+WAVE_FORMAT_PCM = 1
+WAVE_FORMAT_IEEE_FLOAT = 3
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+
+def probe_wav(buf):
+    if buf[:4] != b"RIFF" or buf[8:12] != b"WAVE":
+        raise ValueError("Not a RIFF/WAVE file.")
+    fmt = None
+    data_size = None
+    pos = 12
+    # Walk the chunk list; only the small header chunks are touched, never the samples.
+    while pos + 8 <= len(buf):
+        chunk_id, chunk_size = buf[pos:pos + 4], struct.unpack_from("<I", buf, pos + 4)[0]
+        body = pos + 8
+        if chunk_id == b"fmt ":
+            audio_format, channels, sample_rate, byte_rate, _, bits = struct.unpack_from("<HHIIHH", buf, body)
+            if audio_format == WAVE_FORMAT_EXTENSIBLE and chunk_size >= 40:
+                audio_format = struct.unpack_from("<H", buf, body + 24)[0]
+            fmt = (audio_format, channels, sample_rate, byte_rate, bits)
+        elif chunk_id == b"data":
+            data_size = min(chunk_size, len(buf) - body)
+        if fmt and data_size is not None:
+            break
+        pos = body + chunk_size + (chunk_size & 1)  # chunks are word aligned
+    if fmt is None or data_size is None:
+        raise ValueError("WAV file is missing its fmt or data chunk.")
+    audio_format, channels, sample_rate, byte_rate, bits = fmt
+    return {
+        "format": "WAV" if audio_format == WAVE_FORMAT_PCM else ("WAV (float)" if audio_format == WAVE_FORMAT_IEEE_FLOAT else f"WAV (codec {audio_format})"),
+        "pcm": audio_format in (WAVE_FORMAT_PCM, WAVE_FORMAT_IEEE_FLOAT),
+        "sample_rate": sample_rate,
+        "bit_depth": bits,
+        "channels": channels,
+        "duration": round(data_size / byte_rate, 3) if byte_rate else 0.0,
+    }
+
+
+def probe_flac(buf):
+    pos = 0
+    if buf[:3] == b"ID3":
+        # Skip a leading ID3v2 tag (syncsafe size).
+        size = buf[6] << 21 | buf[7] << 14 | buf[8] << 7 | buf[9]
+        pos = 10 + size
+    if buf[pos:pos + 4] != b"fLaC":
+        raise ValueError("Not a FLAC file.")
+    header = buf[pos + 4]
+    if header & 0x7F != 0:
+        raise ValueError("FLAC file does not start with STREAMINFO.")
+    info = buf[pos + 8:pos + 8 + 34]
+    # STREAMINFO bits: 20 sample rate | 3 channels-1 | 5 bits-1 | 36 total samples
+    packed = int.from_bytes(info[10:18], "big")
+    sample_rate = packed >> 44
+    channels = ((packed >> 41) & 0x7) + 1
+    bits = ((packed >> 36) & 0x1F) + 1
+    total_samples = packed & 0xFFFFFFFFF
+    return {
+        "format": "FLAC",
+        "pcm": True,
+        "sample_rate": sample_rate,
+        "bit_depth": bits,
+        "channels": channels,
+        "duration": round(total_samples / sample_rate, 3) if sample_rate else 0.0,
+    }
+
+
+def probe_file(path):
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        magic = buf[:4]
+        if magic == b"RIFF":
+            return probe_wav(buf)
+        if magic == b"fLaC" or magic[:3] == b"ID3":
+            return probe_flac(buf)
+        if magic == b"RF64":
+            raise ValueError("RF64 WAV files are not supported. Please export a standard WAV or FLAC.")
+    raise ValueError("Unsupported audio format. Please upload a WAV or FLAC master.")
+
+
+def check_audio(audio):
+    issues = []
+    if not audio["pcm"]:
+        issues.append({"check": "codec", "message": f"{audio['format']} is compressed. Please upload an uncompressed WAV or a FLAC master."})
+    if audio["sample_rate"] < MIN_SAMPLE_RATE:
+        issues.append({"check": "sample_rate", "message": f"Sample rate is {audio['sample_rate']} Hz; DSPs need at least {MIN_SAMPLE_RATE} Hz."})
+    if audio["bit_depth"] not in BIT_DEPTHS:
+        issues.append({"check": "bit_depth", "message": f"Bit depth is {audio['bit_depth']}-bit; please export {', '.join(map(str, BIT_DEPTHS[:-1]))} or {BIT_DEPTHS[-1]}-bit."})
+    if not 1 <= audio["channels"] <= MAX_CHANNELS:
+        issues.append({"check": "channels", "message": f"Audio has {audio['channels']} channels; only mono or stereo masters are accepted."})
+    if not MIN_DURATION <= audio["duration"] <= MAX_DURATION:
+        issues.append({"check": "duration", "message": f"Track length {audio['duration']:.1f}s is outside the accepted range."})
+    return issues
+
+
+# --- UPLOAD STORE ---
+
+class UploadStore:
+    def __init__(self, directory=UPLOAD_DIR, workers=4, on_complete=None):
+        self.directory = directory
+        self.uploads = {}
+        self.hashers = {}
+        self.locks = {}
+        self.lock = threading.Lock()
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="audio-probe")
+        self.on_complete = on_complete
+        os.makedirs(directory, exist_ok=True)
+
+    # --- disk ---
+
+    def _path(self, upload_id, ext=".part"):
+        # Upload ids are generated hex strings; anything else never touches the filesystem.
+        if not upload_id or not upload_id.isalnum():
+            return None
+        return os.path.join(self.directory, upload_id + ext)
+
+    def _write_meta(self, upload):
+        path = self._path(upload["id"], ".json")
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(upload, f)
+        os.replace(tmp, path)
+
+    def _load(self, upload_id):
+        # After a restart: the metadata is on disk, the offset is the partial file's size
+        # and the running hash is rebuilt by streaming what has already arrived.
+        # Called without self.lock: rehashing a large partial file must not stall other uploads.
+        meta = self._path(upload_id, ".json")
+        if not meta or not os.path.exists(meta):
+            return None
+        with open(meta) as f:
+            upload = json.load(f)
+        hasher = hashlib.sha256()
+        part = self._path(upload_id)
+        if os.path.exists(part):
+            with open(part, "rb") as f:
+                while chunk := f.read(CHUNK_SIZE):
+                    hasher.update(chunk)
+            upload["offset"] = os.path.getsize(part)
+        with self.lock:
+            if upload_id in self.uploads:
+                return self.uploads[upload_id]  # another request loaded it meanwhile
+            self.uploads[upload_id] = upload
+            self.hashers[upload_id] = hasher
+            self.locks[upload_id] = threading.Lock()
+        if upload["status"] == "processing":
+            # Interrupted mid-probe: run it again.
+            self.pool.submit(self._finish, upload)
+        return upload
+
+    # --- public API ---
+
+    def create(self, filename, size, sha256=None, session_id=None):
+        if not isinstance(size, int) or size <= 0:
+            raise UploadError("size must be the total file size in bytes.")
+        if size > MAX_BYTES:
+            raise UploadError(f"File is larger than {MAX_BYTES // (1024 * 1024)} MB.", status=413)
+        upload = {
+            "id": uuid.uuid4().hex, "filename": os.path.basename(filename or "audio"), "size": size, "offset": 0,
+            "expected_sha256": (sha256 or "").lower() or None, "sha256": None, "status": "uploading",
+            "audio": None, "issues": [], "ok": None, "sessionId": session_id, "created": time.time(),
+        }
+        open(self._path(upload["id"]), "wb").close()
+        with self.lock:
+            self.uploads[upload["id"]] = upload
+            self.hashers[upload["id"]] = hashlib.sha256()
+            self.locks[upload["id"]] = threading.Lock()
+        self._write_meta(upload)
+        return upload
+
+    def get(self, upload_id):
+        with self.lock:
+            upload = self.uploads.get(upload_id)
+        return upload or self._load(upload_id)
+
+    def session_uploads(self, session_id):
+        with self.lock:
+            return [u for u in self.uploads.values() if u["sessionId"] == session_id]
+
+    def write_chunk(self, upload_id, offset, stream, chunk_sha256=None):
+        """Append one chunk read from stream at offset. Returns the upload (probing starts after the last byte)."""
+        upload = self.get(upload_id)
+        if upload is None:
+            raise UploadError("Unknown upload.", status=404)
+        with self.locks[upload_id]:
+            if upload["status"] != "uploading":
+                raise UploadError("Upload is already complete.", status=409, offset=upload["offset"])
+            if offset != upload["offset"]:
+                raise UploadError("Offset does not match the bytes received so far.", status=409, offset=upload["offset"])
+
+            hasher = self.hashers[upload_id]
+            before = hasher.copy()
+            chunk_hasher = hashlib.sha256() if chunk_sha256 else None
+            written = 0
+            with open(self._path(upload_id), "r+b") as f, metrics.span("audio.chunk"):
+                f.seek(offset)
+                try:
+                    while piece := stream.read(CHUNK_SIZE):
+                        written += len(piece)
+                        if offset + written > upload["size"]:
+                            raise UploadError("Chunk runs past the declared file size.", status=413, offset=offset)
+                        hasher.update(piece)
+                        if chunk_hasher:
+                            chunk_hasher.update(piece)
+                        f.write(piece)
+                    if chunk_hasher and chunk_hasher.hexdigest() != chunk_sha256.lower():
+                        # Corrupted in transit: drop the chunk so the client can resend it.
+                        raise UploadError("Chunk checksum mismatch. Please resend this chunk.", status=400, offset=offset)
+                except BaseException:
+                    # Rejected or cut off mid-chunk (client disconnect): roll the file and the running
+                    # checksum back to offset, so a resume from HEAD starts from consistent state.
+                    f.truncate(offset)
+                    self.hashers[upload_id] = before
+                    raise
+
+            upload["offset"] = offset + written
+            if upload["offset"] == upload["size"]:
+                upload["sha256"] = hasher.hexdigest()
+                upload["status"] = "processing"
+                self.pool.submit(self._finish, upload)
+            self._write_meta(upload)
+        return upload
+
+    def _finish(self, upload):
+        path = self._path(upload["id"])
+        try:
+            if upload["expected_sha256"] and upload["expected_sha256"] != upload["sha256"]:
+                upload["issues"] = [{"check": "checksum", "message": "File checksum does not match. Please upload it again."}]
+            else:
+                with metrics.span("audio.probe"):
+                    upload["audio"] = probe_file(path)
+                upload["issues"] = check_audio(upload["audio"])
+            upload["status"] = "done"
+        except (ValueError, struct.error, IndexError) as e:
+            upload["issues"] = [{"check": "format", "message": str(e) if isinstance(e, ValueError) else "Audio header is damaged."}]
+            upload["status"] = "done"
+        except Exception as e:
+            upload["issues"] = [{"check": "server", "message": str(e)}]
+            upload["status"] = "error"
+        try:
+            # Keep the finished master under its final name; the probe result travels with it.
+            os.replace(path, self._path(upload["id"], os.path.splitext(upload["filename"])[1].lower() or ".audio"))
+        except OSError as e:
+            upload["issues"] = [{"check": "server", "message": str(e)}]
+            upload["status"] = "error"
+        upload["ok"] = upload["status"] == "done" and not upload["issues"]
+        self._write_meta(upload)
+        if self.on_complete:
+            self.on_complete(upload)
+
+
+def public(upload):
+    return {k: upload[k] for k in ("id", "filename", "size", "offset", "sha256", "status", "ok", "audio", "issues", "sessionId")}
@@ -0,0 +1,253 @@
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import dsp_rules
+import normalize
+
+# --- BULK RELEASE INGESTION ---
+# Label catalogs arrive as CSV or JSONL, one release per row. Rows are mapped onto the
+# draft schema from AGENT_SYSTEM_PROMPT, validated across a process pool with the
+# same DSP rules as the chat agent, and written back as NDJSON in input order.
+# Input is read lazily and only a bounded window of rows is in flight at once, so
+# memory stays flat no matter how large the file is.
+#
+# Result per row: {"row": n, "status": "ok" | "needs_agent" | "error", "issues": [...], "draft": {...}}
+# Only "needs_agent" rows need a human, and /releases/batch opens an agent session for each.
+
+# Column (CSV header / JSONL key, case-insensitive) -> draft schema path.
+# Includes the release_tool argument names used by agent_api.py.
+COLUMN_MAP = {
+    "title": "release.title",
+    "release_title": "release.title",
+    "track_title": "track.title",
+    "genre": "release.genre",
+    "version": "release.version.type",
+    "version_type": "release.version.type",
+    "version_text": "release.version.custom_text",
+    "remaster_year": "release.version.remaster_year",
+    "remix_confirmed": "release.version.remix_confirmed",
+    "artist": "release.artist",
+    "date": "release.date",
+    "release_date": "release.date",
+    "specific_date": "release.date",
+    "label": "release.label",
+    "upc": "release.upc",
+    "is_cover": "track.is_cover",
+    "released_before": "track.released_before.status",
+    "original_year": "track.released_before.original_year",
+    "composers": "track.credits.composers",
+    "performers": "track.credits.performers",
+    "production": "track.credits.production",
+    "producers": "track.credits.production",
+    "contributors": "track.credits.contributors",
+    "language": "track.lyrics.language",
+    "explicit_rating": "track.lyrics.explicit_rating",
+    "is_explicit": "track.lyrics.explicit_rating",
+    "lyricist": "track.lyrics.lyricist",
+    "lyricists": "track.lyrics.lyricist",
+    "isrc": "track.isrc",
+    "publisher": "track.publisher",
+}
+LIST_PATHS = {
+    "track.credits.composers", "track.credits.performers", "track.credits.production",
+    "track.credits.contributors", "track.lyrics.lyricist",
+}
+BOOL_PATHS = {"release.version.remix_confirmed", "track.is_cover", "track.released_before.status"}
+INT_PATHS = {"release.version.remaster_year", "track.released_before.original_year"}
+LIST_SEPARATORS = ("|", ";")
+
+CHUNK_SIZE = 64       # rows per task sent to a worker
+WINDOW_CHUNKS = 4     # chunks in flight per worker
+
+
+def convert_value(path, value):
+    if isinstance(value, str):
+        value = value.strip()
+        if value == "":
+            return None
+    if path in LIST_PATHS and isinstance(value, str):
+        for sep in LIST_SEPARATORS:
+            if sep in value:
+                return [v.strip() for v in value.split(sep) if v.strip()]
+        return [value]
+    if path in BOOL_PATHS and isinstance(value, str):
+        return value.lower() in ("1", "true", "yes", "y")
+    if path in normalize.PATH_KINDS and isinstance(value, str):
+        # "hiphop" -> "Hip Hop", "espanol" -> "Spanish"; unsure matches are left for validation to flag.
+        return normalize.canonical(normalize.PATH_KINDS[path], value)
+    if path in INT_PATHS and isinstance(value, str):
+        return int(value) if value.isdigit() else value
+    if path == "track.lyrics.explicit_rating" and isinstance(value, bool):
+        # release_tool sends is_explicit as a boolean
+        return "Explicit" if value else "Clean"
+    return value
+
+
+def _merge(base, extra):
+    for k, v in extra.items():
+        if isinstance(v, dict) and isinstance(base.get(k), dict):
+            _merge(base[k], v)
+        else:
+            base[k] = v
+    return base
+
+
+def row_to_draft(row):
+    draft = {"release": {"artist": "xboggdan", "version": {"type": "Original"}, "date": "ASAP"}}
+    # JSONL rows may already be nested drafts ({"release": {...}, "track": {...}}).
+    nested = {k: row.pop(k) for k in ("release", "track", "assets") if isinstance(row.get(k), dict)}
+    _merge(draft, normalize.normalize_updates(nested))
+    for column, value in row.items():
+        path = COLUMN_MAP.get((column or "").strip().lower())
+        if path is None:
+            continue
+        value = convert_value(path, value)
+        if value is None:
+            continue
+        node = draft
+        keys = path.split(".")
+        for key in keys[:-1]:
+            node = node.setdefault(key, {})
+        node[keys[-1]] = value
+    # For a Single, the track title is locked to the release title.
+    if title := dsp_rules.get_path(draft, "release.title"):
+        draft.setdefault("track", {})["title"] = title
+    return draft
+
+
+def validate_row(item):
+    row_number, row = item
+    if "__error__" in row:
+        return {"row": row_number, "status": "error", "issues": [{"field": None, "message": row["__error__"]}], "draft": None}
+    try:
+        draft = row_to_draft(row)
+        issues = dsp_rules.validate_draft(draft)
+    except Exception as e:
+        return {"row": row_number, "status": "error", "issues": [{"field": None, "message": str(e)}], "draft": None}
+    return {
+        "row": row_number,
+        "status": "needs_agent" if issues else "ok",
+        "issues": [{"field": path, "message": message} for path, message in issues],
+        "draft": draft,
+    }
+
+
+def _prewarm(chunk):
+    # One batched fuzzy call per field for the whole chunk; row_to_draft then only hits the cache.
+    values = {kind: [] for kind in normalize.PATH_KINDS.values()}
+    for _, row in chunk:
+        if not isinstance(row, dict) or "__error__" in row:
+            continue  # validate_row reports these as error rows
+        for column, value in row.items():
+            path = COLUMN_MAP.get((column or "").strip().lower())
+            if path in normalize.PATH_KINDS:
+                values[normalize.PATH_KINDS[path]].append(value)
+        for path, kind in normalize.PATH_KINDS.items():
+            if isinstance(row.get(path.split(".")[0]), dict):
+                values[kind].append(dsp_rules.get_path(row, path))
+    for kind, found in values.items():
+        normalize.prewarm(kind, found)
+
+
+def _validate_chunk(chunk):
+    _prewarm(chunk)
+    return [validate_row(item) for item in chunk]
+
+
+# --- READERS (lazy, line by line) ---
+
+def iter_rows(text_stream, fmt):
+    if fmt == "csv":
+        for n, row in enumerate(csv.DictReader(text_stream), start=1):
+            yield n, row
+        return
+    for n, line in enumerate(text_stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except json.JSONDecodeError as e:
+            # Bad lines become error results instead of aborting the whole catalog.
+            yield n, {"__error__": f"Invalid JSON: {e}"}
+            continue
+        yield n, row if isinstance(row, dict) else {"__error__": "Row must be a JSON object."}
+
+
+def detect_format(name_or_type):
+    value = (name_or_type or "").lower()
+    return "csv" if "csv" in value else "jsonl"
+
+
+# --- PARALLEL VALIDATION ---
+
+_pool = None
+
+def get_pool(workers=None):
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=workers or os.cpu_count())
+    return _pool
+
+
+def _chunks(rows):
+    chunk = []
+    for item in rows:
+        chunk.append(item)
+        if len(chunk) >= CHUNK_SIZE:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def validate_stream(rows, pool=None):
+    """Validate (row_number, row) pairs in parallel; yields results in input order with bounded memory."""
+    pool = pool or get_pool()
+    max_in_flight = max(1, getattr(pool, "_max_workers", 1)) * WINDOW_CHUNKS
+    in_flight = deque()
+    for chunk in _chunks(rows):
+        in_flight.append(pool.submit(_validate_chunk, chunk))
+        while len(in_flight) >= max_in_flight:
+            yield from _results(in_flight.popleft())
+    while in_flight:
+        yield from _results(in_flight.popleft())
+
+
+def _results(future):
+    return future.result()
+
+
+def to_ndjson(results):
+    for result in results:
+        yield json.dumps(result, ensure_ascii=False) + "\n"
+
+
+# --- CLI ---
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Validate a release catalog (CSV or JSONL) and print NDJSON results.")
+    parser.add_argument("path", help="catalog file, or - for stdin")
+    parser.add_argument("--format", choices=("csv", "jsonl"), help="input format (default: from file extension)")
+    parser.add_argument("--workers", type=int, default=None, help="validation processes (default: CPU count)")
+    parser.add_argument("--summary", action="store_true", help="print a status count to stderr at the end")
+    args = parser.parse_args(argv)
+
+    fmt = args.format or detect_format(args.path)
+    stream = io.TextIOWrapper(sys.stdin.buffer, encoding="utf-8", newline="") if args.path == "-" else open(args.path, encoding="utf-8", newline="")
+    counts = {}
+    with stream, ProcessPoolExecutor(max_workers=args.workers or os.cpu_count()) as pool:
+        for result in validate_stream(iter_rows(stream, fmt), pool):
+            counts[result["status"]] = counts.get(result["status"], 0) + 1
+            sys.stdout.write(json.dumps(result, ensure_ascii=False) + "\n")
+    if args.summary:
+        print(f"✅ {json.dumps(counts)}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
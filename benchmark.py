@@ -0,0 +1,416 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import threading
+import time
+import urllib.request
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+# --- LOAD TEST & LATENCY BENCHMARK ---
+# Drives /chat with many concurrent scripted conversations (the run_demo scenarios
+# from distrov2.py plus any recorded transcripts) and reports req/s and p50/p95/p99
+# per stage. By default /chat runs in-process against fake_llm.FakeGeminiModel, so
+# no network or API key is needed; --url points it at a live server instead.
+# Results are written as JSON so two runs can be compared with --compare.
+#
+#   python benchmark.py --conversations 200 --concurrency 32 --latency 0.05,0.3 --rate-limit 0.02
+#   python benchmark.py --out new.json --compare old.json
+
+# Same scenarios as run_demo() in distrov2.py: (seed history, user turns).
+DEMO_SCENARIOS = {
+    "one_shot": ([], ["I'm releasing a Hip Hop single called 'Empire' by xboggdan dropping ASAP."]),
+    "solo_artist": (
+        [{"role": "model", "text": "Title: Neon. Genre: Pop. Who worked on this?"}],
+        ["I did everything myself."],
+    ),
+    "education": (
+        [{"role": "model", "text": "What is the Release Title?"}],
+        ["Wait, what is an ISRC? Do I need one?"],
+    ),
+    "chaos": ([], ["yo song is 'Pizza' genre hyperpop i wrote it with mom but produced alone dropping friday"]),
+    "version_logic": (
+        [{"role": "model", "text": "Title set. Is this the Original version?"}],
+        ["No, it's Remastered.", "1999"],
+    ),
+    "composer_correction": (
+        [{"role": "model", "text": "Who wrote the song? I need **Legal First and Last Names** for publishing rights."}],
+        ["Spitfire", "Bogdan Hershall"],
+    ),
+}
+
+
+def load_transcripts(path):
+    # JSONL: {"name": ..., "turns": ["..."]} or {"messages": [{"role", "content"|"text"}]}
+    scenarios = {}
+    with open(path) as f:
+        for n, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if "turns" in record:
+                turns = record["turns"]
+            else:
+                turns = [m.get("content", m.get("text")) for m in record.get("messages", []) if m.get("role") == "user"]
+            scenarios[record.get("name", f"{os.path.basename(path)}:{n}")] = ([], turns)
+    return scenarios
+
+
+def load_turn_pairs(path):
+    # (last assistant message, user reply) pairs from {"messages": [...]} transcripts, for the NLU stage.
+    pairs = []
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            question = None
+            for m in json.loads(line).get("messages", []):
+                text = m.get("content", m.get("text"))
+                if m.get("role") == "user":
+                    pairs.append((question, text))
+                else:
+                    question = text
+    return pairs
+
+
+# --- TIMINGS ---
+
+class Recorder:
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.statuses = defaultdict(int)
+        self.notes = {}  # extra per-stage results for the report's meta (e.g. NLU hit rate)
+        self.lock = threading.Lock()
+
+    def add(self, stage, seconds, error=False):
+        with self.lock:
+            self.samples[stage].append(seconds)
+            if error:
+                self.errors[stage] += 1
+
+    def status(self, code):
+        with self.lock:
+            self.statuses[str(code)] += 1
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, int(round(q * len(values) + 0.5)) - 1))]
+
+
+def summarize(samples, errors, wall):
+    out = {}
+    for stage, values in samples.items():
+        out[stage] = {
+            "count": len(values),
+            "errors": errors.get(stage, 0),
+            "rps": round(len(values) / wall, 2) if wall else None,
+            "mean_ms": round(statistics.fmean(values) * 1000, 3),
+            "p50_ms": round(percentile(values, 0.50) * 1000, 3),
+            "p95_ms": round(percentile(values, 0.95) * 1000, 3),
+            "p99_ms": round(percentile(values, 0.99) * 1000, 3),
+        }
+    return out
+
+
+# --- /chat DRIVERS ---
+
+def in_process_client(args):
+    # Configure agent_api for an offline run before it is imported.
+    os.environ.setdefault("GEMINI_API_KEY", "offline-benchmark")
+    os.environ.setdefault("GEMINI_RPM", str(args.rpm))
+    os.environ["LLM_WARM_UP"] = "0"
+    import agent_api
+    import fake_llm
+
+    fake = fake_llm.FakeGeminiModel(latency=args.latency, rate_limit_rate=args.rate_limit, error_rate=args.error_rate)
+    agent_api.model = fake
+    local = threading.local()
+
+    def post(payload):
+        # One Flask test client per worker thread.
+        if not hasattr(local, "client"):
+            local.client = agent_api.app.test_client()
+        res = local.client.post("/chat", json=payload)
+        return res.status_code, res.get_json()
+
+    return post, fake
+
+
+def http_client(url):
+    def post(payload):
+        req = urllib.request.Request(url, data=json.dumps(payload).encode(), headers={"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(req, timeout=120) as res:
+                return res.status, json.loads(res.read())
+        except urllib.error.HTTPError as e:
+            return e.code, json.loads(e.read() or b"{}")
+    return post
+
+
+def run_conversation(post, scenario, recorder, no_cache):
+    seed, turns = scenario
+    session_id = None
+    for i, turn in enumerate(turns):
+        payload = {"message": turn, "sessionId": session_id, "userContext": {"artistName": "xboggdan", "hasPayoutMethod": True}}
+        if i == 0 and seed:
+            payload["history"] = seed
+        if no_cache:
+            payload["noCache"] = True
+        start = time.perf_counter()
+        try:
+            status, body = post(payload)
+        except Exception:
+            recorder.add("chat.request", time.perf_counter() - start, error=True)
+            recorder.status("exception")
+            return
+        recorder.add("chat.request", time.perf_counter() - start, error=status >= 400)
+        recorder.status(status)
+        if status >= 400 or not body:
+            return
+        session_id = body.get("sessionId", session_id)
+
+
+def bench_chat(args, scenarios, recorder):
+    fake = None
+    if args.url:
+        post = http_client(args.url)
+    else:
+        post, fake = in_process_client(args)
+    names = list(scenarios)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        for i in range(args.conversations):
+            pool.submit(run_conversation, post, scenarios[names[i % len(names)]], recorder, args.no_cache)
+    wall = time.perf_counter() - start
+    if fake is not None:
+        for seconds in fake.upstream_seconds:
+            recorder.add("chat.upstream", seconds)
+    return wall
+
+
+# --- PURE PIPELINE STAGES (rules / prompt build) ---
+
+def bench_pipeline(scenarios, recorder, repeat):
+    import dsp_rules
+    import prompt_budget
+    turns = [(seed[-1]["text"] if seed else None, t) for seed, ts in scenarios.values() for t in ts]
+    messages = [{"role": "user" if i % 2 == 0 else "assistant", "content": t} for i, (_, t) in enumerate(turns * 10)]
+    draft = {"release": {"title": "Empire", "genre": "Hip Hop", "version": {"type": "Original"}}, "track": {"credits": {"composers": []}}}
+    template = "SYSTEM PROMPT\n" * 400 + "{current_state}"
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for question, text in turns:
+            t = time.perf_counter()
+            dsp_rules.precheck(question, text)
+            recorder.add("rules.precheck", time.perf_counter() - t)
+        t = time.perf_counter()
+        prompt_budget.build(template, messages, draft, lambda m: m["content"], lambda m: m["role"])
+        recorder.add("prompt.build", time.perf_counter() - t)
+    return time.perf_counter() - start
+
+
+# --- LOCAL NLU FAST PATH (hit rate + latency) ---
+
+def bench_nlu(scenarios, pairs, recorder, repeat):
+    import dsp_rules
+    import nlu
+    # Scenarios replay as conversations: a locally answered turn's reply is the next
+    # question, an escalated one leaves it unknown (the LLM would have asked something).
+    turns = [(q, t, {}) for q, t in pairs]
+    for seed, ts in scenarios.values():
+        question, draft = (seed[-1]["text"] if seed else None), {}
+        for text in ts:
+            turns.append((question, text, draft))
+            if rejected := dsp_rules.precheck(question, text):
+                question = rejected["response"]
+            elif result := nlu.fast_reply(question, text, draft):
+                question, draft = result["response"], nlu.merge_updates(draft, result["updates"])
+            else:
+                question = None
+
+    outcomes = defaultdict(int)
+    for question, text, draft in turns:
+        if dsp_rules.precheck(question, text) is not None:
+            outcomes["rules"] += 1
+        elif result := nlu.fast_reply(question, text, draft):
+            outcomes[f"nlu:{result['intent']}"] += 1
+        else:
+            outcomes["llm"] += 1
+    routable = len(turns) - outcomes["rules"]
+    answered = sum(v for k, v in outcomes.items() if k.startswith("nlu:"))
+    recorder.notes["nlu"] = {
+        "turns": len(turns),
+        "outcomes": dict(outcomes),
+        "hit_rate": round(answered / routable, 3) if routable else None,
+    }
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for question, text, draft in turns:
+            t = time.perf_counter()
+            nlu.fast_reply(question, text, draft)
+            recorder.add("nlu.route", time.perf_counter() - t)
+    return time.perf_counter() - start
+
+
+# --- STREAMLIT TURN COST (demo mode, no keys) ---
+
+def bench_streamlit(scenarios, recorder, repeat):
+    try:
+        from streamlit.testing.v1 import AppTest
+    except ImportError:
+        print("⚠️ streamlit not installed; skipping streamlit.turn", file=sys.stderr)
+        return None
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for _, turns in scenarios.values():
+            at = AppTest.from_file("distrov2.py", default_timeout=60)
+            at.run()
+            for turn in turns:
+                t = time.perf_counter()
+                at.chat_input[0].set_value(turn).run()
+                recorder.add("streamlit.turn", time.perf_counter() - t, error=bool(at.exception))
+    return time.perf_counter() - start
+
+
+# --- DDEX CATALOG EXPORT (time + peak memory at catalog scale) ---
+
+def synthetic_drafts(count, changed=()):
+    for i in range(count):
+        yield {"id": f"bench-{i:06d}", "draft": {
+            "release": {"title": f"Song {i}{' (edit)' if i in changed else ''}", "artist": "xboggdan", "genre": "Hip Hop",
+                        "date": "ASAP", "version": {"type": "Remix" if i % 5 == 0 else "Original"}, "upc": f"{i:012d}"},
+            "track": {"isrc": f"QZ-AB1-26-{i % 100000:05d}", "is_cover": False, "released_before": {"status": False},
+                      "credits": {"composers": ["Jane Doe"], "performers": ["Jane Doe (Vocals)", f"Guest {i % 97} Player (Guitar)"],
+                                  "production": ["Bob Ray - mixing"], "contributors": []},
+                      "lyrics": {"language": "English", "explicit_rating": "Clean", "lyricist": ["Jane Doe"]}},
+        }}
+
+
+def bench_ddex(args, recorder):
+    import resource
+    import tempfile
+    from concurrent.futures import ProcessPoolExecutor
+    import ddex
+    changed = set(range(0, args.releases, 100))  # 1% edited between the full and incremental runs
+    start = time.perf_counter()
+    with tempfile.TemporaryDirectory() as out, ProcessPoolExecutor(max_workers=args.workers) as pool:
+        for stage, items, incremental in (("ddex.full", synthetic_drafts(args.releases), False),
+                                          ("ddex.incremental", synthetic_drafts(args.releases, changed), True)):
+            rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            t = time.perf_counter()
+            counts = defaultdict(int)
+            for result in ddex.export_stream(items, out, pool, incremental):
+                counts[result["status"]] += 1
+                if "seconds" in result:
+                    recorder.add("ddex.release", result["seconds"], error=result["status"] == "error")
+            recorder.add(stage, time.perf_counter() - t, error=bool(counts["error"]))
+            # Peak RSS growth of this process (ru_maxrss is KiB on Linux); flat when streaming works
+            recorder.notes[stage] = {"releases": args.releases, "counts": dict(counts),
+                                     "seconds": round(time.perf_counter() - t, 3),
+                                     "peak_rss_growth_mb": round((resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before) / 1024, 1)}
+        recorder.notes["ddex.full"]["peak_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    recorder.notes["ddex.full"]["worker_peak_rss_mb"] = round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1)
+    return time.perf_counter() - start
+
+
+def compare(current, previous_path):
+    with open(previous_path) as f:
+        previous = json.load(f)["stages"]
+    print(f"\n{'stage':<18}{'p50 ms':>12}{'Δ p50':>10}{'p95 ms':>12}{'Δ p95':>10}")
+    for stage, now in current.items():
+        before = previous.get(stage)
+        def delta(key):
+            if not before or not before.get(key):
+                return "n/a"
+            return f"{(now[key] - before[key]) / before[key] * 100:+.1f}%"
+        print(f"{stage:<18}{now['p50_ms']:>12}{delta('p50_ms'):>10}{now['p95_ms']:>12}{delta('p95_ms'):>10}")
+
+
+def parse_latency(value):
+    parts = [float(v) for v in value.split(",")]
+    return (parts[0], parts[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test /chat and time the agent pipeline with an offline fake LLM.")
+    parser.add_argument("--url", help="live /chat URL (default: in-process Flask app + fake LLM)")
+    parser.add_argument("--conversations", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--latency", type=parse_latency, default=(0.05, 0.2), help="fake LLM latency seconds: 'x' or 'low,high'")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="fraction of fake calls answering 429")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of fake calls failing")
+    parser.add_argument("--rpm", type=int, default=1_000_000, help="GEMINI_RPM for the in-process bucket")
+    parser.add_argument("--no-cache", action="store_true", help="send noCache so every turn reaches the (fake) LLM")
+    parser.add_argument("--transcripts", action="append", default=[], help="recorded transcripts JSONL (repeatable)")
+    parser.add_argument("--stages", default="chat,pipeline", help="comma list of: chat, pipeline, nlu, streamlit, ddex")
+    parser.add_argument("--repeat", type=int, default=20, help="repetitions for pipeline/streamlit stages")
+    parser.add_argument("--releases", type=int, default=5000, help="synthetic catalog size for the ddex stage")
+    parser.add_argument("--workers", type=int, default=None, help="export processes for the ddex stage (default: CPU count)")
+    parser.add_argument("--out", default="bench_results.json")
+    parser.add_argument("--compare", help="previous results JSON to diff against")
+    args = parser.parse_args(argv)
+
+    scenarios = dict(DEMO_SCENARIOS)
+    pairs = []
+    for path in args.transcripts:
+        scenarios.update(load_transcripts(path))
+        pairs += load_turn_pairs(path)
+
+    stages = {s.strip() for s in args.stages.split(",")}
+    results = {}
+    statuses = {}
+    notes = {}
+    for stage, runner in (("chat", lambda r: bench_chat(args, scenarios, r)),
+                          ("pipeline", lambda r: bench_pipeline(scenarios, r, args.repeat)),
+                          ("nlu", lambda r: bench_nlu(scenarios, pairs, r, args.repeat)),
+                          ("streamlit", lambda r: bench_streamlit(scenarios, r, args.repeat)),
+                          ("ddex", lambda r: bench_ddex(args, r))):
+        if stage not in stages:
+            continue
+        recorder = Recorder()
+        wall = runner(recorder)
+        if wall is None:
+            continue
+        results.update(summarize(recorder.samples, recorder.errors, wall))
+        statuses.update(recorder.statuses)
+        notes.update(recorder.notes)
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "target": args.url or "in-process",
+            "conversations": args.conversations,
+            "concurrency": args.concurrency,
+            "latency": args.latency,
+            "rate_limit": args.rate_limit,
+            "error_rate": args.error_rate,
+            "scenarios": sorted(scenarios),
+            "statuses": statuses,
+            **notes,
+        },
+        "stages": results,
+    }
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print(f"{'stage':<18}{'count':>8}{'err':>6}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for stage, s in results.items():
+        print(f"{stage:<18}{s['count']:>8}{s['errors']:>6}{s['rps']:>10}{s['p50_ms']:>10}{s['p95_ms']:>10}{s['p99_ms']:>10}")
+    if nlu_notes := notes.get("nlu"):
+        print(f"🧭 NLU fast path: {nlu_notes['hit_rate']} hit rate over {nlu_notes['turns']} turns {nlu_notes['outcomes']}")
+    print(f"📄 Results written to {args.out}")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
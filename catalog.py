@@ -0,0 +1,323 @@
+import argparse
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+import unicodedata
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import dsp_rules
+
+# --- LOCAL CATALOG INDEX ---
+# Prior releases in one SQLite file. ISRC, UPC and (normalized title, normalized
+# artist) are all indexed, so every check is a single index probe however big the
+# catalog is. The agent consults it before asking the user:
+#   * note_for(draft) puts matching prior releases into the prompt, so the agent can
+#     ask "is this a re-release of X (2021, ISRC ...)?" instead of asking blind
+#   * precheck(reply, draft) rejects a typed ISRC/UPC that already belongs to another
+#     release without a provider call
+# rebuild() streams a JSONL export into a fresh file (indexes are built after the
+# load) and swaps it in, so millions of rows never sit in memory.
+#
+#   python catalog.py rebuild releases.jsonl --db catalog.sqlite
+#   python catalog.py lookup --isrc USRC17607839 --db catalog.sqlite
+
+MAIN_ARTIST = "xboggdan"  # locked main artist (same as the draft default)
+BATCH_ROWS = 20000
+MAX_MATCHES = 5
+
+_FEAT_RE = re.compile(r"\s*[\(\[]?\b(?:feat|ft|featuring|with)\b\.?.*$", re.I)
+_NON_WORD_RE = re.compile(r"[^\w]+")
+_LEADING_THE_RE = re.compile(r"^the\s+")
+_ISRC_RE = re.compile(r"\b([A-Z]{2}-?[A-Z0-9]{3}-?\d{2}-?\d{5})\b", re.I)
+_UPC_RE = re.compile(r"(?<!\d)(\d{12,13})(?!\d)")
+
+
+# --- NORMALIZATION ---
+
+def _fold(text):
+    text = text or ""
+    if not text.isascii():
+        text = unicodedata.normalize("NFKD", text)
+        text = "".join(c for c in text if not unicodedata.combining(c))
+    return _NON_WORD_RE.sub(" ", text.casefold()).strip()
+
+
+def normalize_title(title):
+    # "Empire (feat. Drake)" / "EMPIRE!" / "Émpire" all index the same.
+    return _LEADING_THE_RE.sub("", _fold(_FEAT_RE.sub("", title or "")))
+
+
+def normalize_artist(artist):
+    return _LEADING_THE_RE.sub("", _fold(artist))
+
+
+def normalize_isrc(isrc):
+    return re.sub(r"[^A-Z0-9]", "", (isrc or "").upper()) or None
+
+
+def normalize_upc(upc):
+    # UPC-A (12) and EAN-13 (13) spell the same code; store both as 13 digits.
+    digits = re.sub(r"\D", "", str(upc or ""))
+    return digits.zfill(13) if digits else None
+
+
+def _row(record):
+    # Accepts flat export rows or nested drafts ({"release": {...}, "track": {...}}).
+    def pick(*paths):
+        for path in paths:
+            value = dsp_rules.get_path(record, path) if "." in path else record.get(path)
+            if value not in (None, ""):
+                return value
+        return None
+
+    title = pick("title", "release_title", "track.title", "release.title")
+    artist = pick("artist", "release.artist") or MAIN_ARTIST
+    date = pick("release_date", "date", "release.date")
+    year = pick("year", "original_year", "track.released_before.original_year")
+    if year is None and isinstance(date, str) and date[:4].isdigit():
+        year = int(date[:4])
+    return (
+        normalize_isrc(pick("isrc", "track.isrc")), normalize_upc(pick("upc", "release.upc")),
+        title, artist, normalize_title(title), normalize_artist(artist),
+        date if isinstance(date, str) else None, year if isinstance(year, int) else None,
+        pick("id", "release_id"),
+    )
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS releases (
+    isrc TEXT, upc TEXT, title TEXT, artist TEXT, title_key TEXT, artist_key TEXT,
+    release_date TEXT, year INTEGER, release_id TEXT
+)
+"""
+INDEXES = (
+    "CREATE INDEX IF NOT EXISTS releases_isrc ON releases (isrc)",
+    "CREATE INDEX IF NOT EXISTS releases_upc ON releases (upc)",
+    "CREATE INDEX IF NOT EXISTS releases_title_artist ON releases (title_key, artist_key)",
+)
+COLUMNS = "isrc, upc, title, artist, title_key, artist_key, release_date, year, release_id"
+
+
+class Catalog:
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+        with self._db() as db:
+            db.execute(SCHEMA)
+            for statement in INDEXES:
+                db.execute(statement)
+
+    def _file_id(self):
+        try:
+            st = os.stat(self.db_path)
+        except FileNotFoundError:
+            return None
+        return st.st_dev, st.st_ino
+
+    def _db(self):
+        # One connection per thread; reopened once a rebuild (this process or the CLI)
+        # has swapped a new file in, which shows up as a new inode.
+        local = self._local
+        file_id = self._file_id()
+        if getattr(local, "db", None) is None or local.file_id != file_id:
+            if getattr(local, "db", None) is not None:
+                local.db.close()
+            local.db = sqlite3.connect(self.db_path, timeout=5)
+            local.db.row_factory = sqlite3.Row
+            local.db.execute("PRAGMA journal_mode=WAL")
+            local.file_id = self._file_id()
+        return local.db
+
+    def _query(self, where, params, limit=MAX_MATCHES):
+        rows = self._db().execute(f"SELECT {COLUMNS} FROM releases WHERE {where} LIMIT ?", (*params, limit)).fetchall()
+        return [{k: row[k] for k in ("isrc", "upc", "title", "artist", "release_date", "year", "release_id")} for row in rows]
+
+    # --- lookups ---
+
+    def by_isrc(self, isrc):
+        return self._query("isrc = ?", (normalize_isrc(isrc),)) if normalize_isrc(isrc) else []
+
+    def by_upc(self, upc):
+        return self._query("upc = ?", (normalize_upc(upc),)) if normalize_upc(upc) else []
+
+    def duplicates(self, title, artist=MAIN_ARTIST):
+        key = normalize_title(title)
+        return self._query("title_key = ? AND artist_key = ?", (key, normalize_artist(artist))) if key else []
+
+    def check_draft(self, draft):
+        """Findings for a draft (nested or flat release_tool args): [{"field", "kind", "message", "matches"}]."""
+        findings = []
+        title = dsp_rules.get_path(draft, "release.title") or draft.get("release_title")
+        artist = dsp_rules.get_path(draft, "release.artist") or MAIN_ARTIST
+        if title and (matches := self.duplicates(title, artist)):
+            first = matches[0]
+            findings.append({
+                "field": "track.released_before.status", "kind": "duplicate", "matches": matches,
+                "message": f"'{first['title']}' by {first['artist']} is already in the catalog"
+                           f"{' (' + str(first['year']) + ')' if first['year'] else ''}"
+                           f"{', ISRC ' + first['isrc'] if first['isrc'] else ''}. Ask whether this is a re-release "
+                           "(released before = yes, reuse that ISRC) or a different song.",
+            })
+        for path, lookup, label in (("track.isrc", self.by_isrc, "ISRC"), ("release.upc", self.by_upc, "UPC")):
+            code = dsp_rules.get_path(draft, path) or draft.get(path.split(".")[-1])
+            if code and (matches := [m for m in lookup(code) if normalize_title(m["title"]) != normalize_title(title)]):
+                findings.append({
+                    "field": path, "kind": f"{label.lower()}_collision", "matches": matches,
+                    "message": f"{label} {code} already belongs to '{matches[0]['title']}' by {matches[0]['artist']}.",
+                })
+        return findings
+
+    def count(self):
+        return self._db().execute("SELECT COUNT(*) FROM releases").fetchone()[0]
+
+    # --- bulk rebuild ---
+
+    def rebuild(self, lines, workers=None):
+        """Replace the catalog with the rows of a JSONL export. Returns {"rows", "skipped", "seconds"}."""
+        start = time.monotonic()
+        tmp = self.db_path + ".rebuild"
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        db = sqlite3.connect(tmp)
+        # A throwaway file: no journal or fsync while loading, indexes once at the end.
+        db.execute("PRAGMA journal_mode=OFF")
+        db.execute("PRAGMA synchronous=OFF")
+        db.execute(SCHEMA)
+        insert = f"INSERT INTO releases ({COLUMNS}) VALUES ({', '.join('?' * 9)})"
+        counts = {"rows": 0, "skipped": 0}
+        for rows, skipped in _parsed(lines, workers or os.cpu_count() or 1):
+            db.executemany(insert, rows)
+            counts["rows"] += len(rows)
+            counts["skipped"] += skipped
+        for statement in INDEXES:
+            db.execute(statement)
+        db.commit()
+        db.execute("PRAGMA journal_mode=WAL")
+        db.close()
+
+        # Fold the live file's WAL back in first, so the new file never opens next to
+        # frames that belong to the old one. The -wal/-shm files stay: other processes
+        # may still have them open. Their readers reopen when they see the new inode.
+        live = sqlite3.connect(self.db_path, timeout=5)
+        live.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        live.close()
+        os.replace(tmp, self.db_path)
+        return dict(counts, seconds=round(time.monotonic() - start, 2))
+
+
+def _parse_chunk(lines):
+    rows, skipped = [], 0
+    for line in lines:
+        try:
+            rows.append(_row(json.loads(line)))
+        except (json.JSONDecodeError, AttributeError):
+            skipped += 1
+    return rows, skipped
+
+
+def _parsed(lines, workers):
+    # JSON parsing + normalization is the slow part, so it runs on a process pool;
+    # SQLite inserts stay on this thread. Only a small window of chunks is in flight.
+    def chunks():
+        chunk = []
+        for line in lines:
+            if line.strip():
+                chunk.append(line)
+            if len(chunk) >= BATCH_ROWS:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    if workers <= 1:
+        yield from map(_parse_chunk, chunks())
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        in_flight = deque()
+        for chunk in chunks():
+            in_flight.append(pool.submit(_parse_chunk, chunk))
+            if len(in_flight) >= workers * 2:
+                yield in_flight.popleft().result()
+        while in_flight:
+            yield in_flight.popleft().result()
+
+
+# --- AGENT HOOKS ---
+
+def note_for(catalog, draft):
+    """Prompt note listing catalog findings for the current draft ("" when nothing matches)."""
+    if catalog is None:
+        return ""
+    findings = catalog.check_draft(draft)
+    if not findings:
+        return ""
+    return "\n\nCATALOG MATCHES (from our release index; raise these before asking the user):\n" + "\n".join(f"- {f['message']}" for f in findings)
+
+
+def precheck(catalog, reply, draft):
+    """Reject an ISRC/UPC the user just typed if another release already owns it. Same shape as dsp_rules.precheck."""
+    if catalog is None or not reply:
+        return None
+    title = dsp_rules.get_path(draft, "release.title") or draft.get("release_title")
+    for pattern, lookup, label, path in ((_ISRC_RE, catalog.by_isrc, "ISRC", "track.isrc"), (_UPC_RE, catalog.by_upc, "UPC", "release.upc")):
+        if m := pattern.search(reply):
+            owners = [r for r in lookup(m.group(1)) if normalize_title(r["title"]) != normalize_title(title)]
+            if owners:
+                return {
+                    "response": f"The {label} **{m.group(1)}** is already registered to '{owners[0]['title']}' by {owners[0]['artist']}. "
+                                f"Each {label} can only be used once. Please double-check it, or leave it blank and we'll generate one.",
+                    "updates": {},
+                    "source": "catalog",
+                    "field": path,
+                }
+    return None
+
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+def get_catalog():
+    # Process-wide, only when CATALOG_DB is set; None means "no catalog, skip the checks".
+    global _catalog
+    with _catalog_lock:
+        if _catalog is None and os.getenv("CATALOG_DB"):
+            _catalog = Catalog(os.getenv("CATALOG_DB"))
+        return _catalog
+
+
+# --- CLI ---
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or query the local release catalog index.")
+    parser.add_argument("--db", default=os.getenv("CATALOG_DB", "catalog.sqlite"))
+    sub = parser.add_subparsers(dest="command", required=True)
+    rebuild = sub.add_parser("rebuild", help="replace the index with a JSONL export (path or -)")
+    rebuild.add_argument("path")
+    rebuild.add_argument("--workers", type=int, default=None, help="parser processes (default: CPU count)")
+    lookup = sub.add_parser("lookup", help="query the index")
+    lookup.add_argument("--isrc")
+    lookup.add_argument("--upc")
+    lookup.add_argument("--title")
+    lookup.add_argument("--artist", default=MAIN_ARTIST)
+    args = parser.parse_args(argv)
+
+    catalog = Catalog(args.db)
+    if args.command == "rebuild":
+        stream = sys.stdin if args.path == "-" else open(args.path, encoding="utf-8")
+        with stream:
+            print(f"✅ {json.dumps(catalog.rebuild(stream, args.workers))}", file=sys.stderr)
+        return
+    matches = (catalog.by_isrc(args.isrc) if args.isrc else []) + (catalog.by_upc(args.upc) if args.upc else [])
+    if args.title:
+        matches += catalog.duplicates(args.title, args.artist)
+    for match in matches:
+        print(json.dumps(match, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+import hashlib
+import os
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import llm_cache
+import metrics
+
+# --- COVER ART ANALYSIS ---
+# Uploads are streamed to disk in chunks while their SHA-256 is computed, so the
+# request never holds the whole image in memory. Analysis runs on a process pool:
+# format, dimensions and colour mode come from the image header alone, and pixels
+# are only decoded (at reduced scale for JPEG) to render thumbnails. Results are
+# cached by content hash, so a re-upload or retry of the same file is answered
+# without touching the pool. Pillow is imported by the worker, only when needed.
+#
+# Result: {"hash", "ok", "issues": [{"check", "message"}], "format", "width", "height",
+#          "mode", "bytes", "thumbnails": {size: url}, "cached"}
+
+MIN_DIMENSION = 3000
+MAX_BYTES = int(os.getenv("COVER_ART_MAX_BYTES", str(10 * 1024 * 1024)))
+FORMATS = ("JPEG", "PNG")
+COLOR_MODES = ("RGB",)
+THUMB_SIZES = (600, 200)
+CHUNK_SIZE = 64 * 1024
+
+ART_DIR = os.getenv("COVER_ART_DIR") or os.path.join(tempfile.gettempdir(), "distro_cover_art")
+
+MODE_MESSAGES = {
+    "CMYK": "Artwork is CMYK. DSPs require RGB colour; please export it as RGB.",
+    "RGBA": "Artwork has a transparent layer. Please flatten it to RGB (no transparency).",
+    "LA": "Artwork has a transparent layer. Please flatten it to RGB (no transparency).",
+    "P": "Artwork uses an indexed palette. Please export it as full RGB.",
+    "L": "Artwork is greyscale. Please export it in RGB colour mode.",
+}
+
+
+# --- UPLOAD (streamed + hashed) ---
+
+def receive(stream, directory=ART_DIR, max_bytes=MAX_BYTES):
+    """Copy stream to a temp file in chunks. Returns (path, sha256, size, too_large)."""
+    os.makedirs(directory, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    fd, path = tempfile.mkstemp(prefix="upload_", dir=directory)
+    with os.fdopen(fd, "wb") as out:
+        while chunk := stream.read(CHUNK_SIZE):
+            size += len(chunk)
+            if size > max_bytes:
+                return path, None, size, True
+            digest.update(chunk)
+            out.write(chunk)
+    return path, digest.hexdigest(), size, False
+
+
+# --- CHECKS (runs in a worker process) ---
+
+def thumb_path(digest, size, directory=ART_DIR):
+    return os.path.join(directory, f"{digest}_{size}.jpg")
+
+
+def analyze_file(path, digest, size_bytes, directory=ART_DIR):
+    from PIL import Image, UnidentifiedImageError
+
+    result = {"hash": digest, "bytes": size_bytes, "format": None, "width": None, "height": None, "mode": None, "issues": [], "thumbnails": {}}
+    issues = result["issues"]
+    try:
+        # Image.open only parses the header; no pixel data is decoded here.
+        img = Image.open(path)
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError):
+        issues.append({"check": "format", "message": "Could not read the image. Please upload a JPG or PNG."})
+        result["ok"] = False
+        return result
+
+    with img:
+        width, height = img.size
+        result.update(format=img.format, width=width, height=height, mode=img.mode)
+
+        if img.format not in FORMATS:
+            issues.append({"check": "format", "message": f"Artwork is {img.format}. Please upload a JPG or PNG."})
+        if width != height:
+            issues.append({"check": "aspect", "message": f"Artwork must be square (1:1); this one is {width}x{height}."})
+        if min(width, height) < MIN_DIMENSION:
+            issues.append({"check": "dimensions", "message": f"Artwork must be at least {MIN_DIMENSION}x{MIN_DIMENSION}px; this one is {width}x{height}."})
+        if img.mode not in COLOR_MODES:
+            issues.append({"check": "color_mode", "message": MODE_MESSAGES.get(img.mode, f"Artwork colour mode is {img.mode}. Please export it as RGB.")})
+
+        try:
+            # JPEG can be decoded straight at a reduced scale, so a 3000px image never
+            # expands to full size just to make a 600px preview.
+            largest = max(THUMB_SIZES)
+            img.draft("RGB", (largest, largest))
+            preview = img.convert("RGB")
+            for size in sorted(THUMB_SIZES, reverse=True):
+                preview.thumbnail((size, size))
+                preview.save(thumb_path(digest, size, directory), "JPEG", quality=85)
+                result["thumbnails"][str(size)] = f"/cover-art/{digest}/{size}.jpg"
+        except (OSError, ValueError) as e:
+            issues.append({"check": "decode", "message": f"The image data is damaged ({e}). Please re-export it."})
+
+    result["ok"] = not issues
+    return result
+
+
+# --- POOL + CACHE ---
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool(workers=None):
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=workers or int(os.getenv("COVER_ART_WORKERS", "2")))
+        return _pool
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_cache():
+    # Same two-tier cache as LLM responses, keyed by content hash and kept on disk next to the thumbnails.
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            os.makedirs(ART_DIR, exist_ok=True)
+            _cache = llm_cache.ResponseCache(
+                max_entries=int(os.getenv("COVER_ART_CACHE_MAX", "1000")),
+                ttl=float(os.getenv("COVER_ART_CACHE_TTL", str(30 * 86400))),
+                db_path=os.getenv("COVER_ART_DB") or os.path.join(ART_DIR, "analysis.sqlite"),
+            )
+        return _cache
+
+
+def analyze_upload(stream, pool=None, cache=None):
+    cache = cache or get_cache()
+    with metrics.span("cover_art.receive"):
+        path, digest, size, too_large = receive(stream)
+    try:
+        if too_large:
+            return {"hash": None, "ok": False, "bytes": size, "too_large": True, "thumbnails": {}, "cached": False,
+                    "issues": [{"check": "file_size", "message": f"Artwork must be under {MAX_BYTES // (1024 * 1024)} MB."}]}
+        cached = cache.get(digest)
+        if cached is not None and all(os.path.exists(thumb_path(digest, s)) for s in cached["thumbnails"]):
+            return dict(cached, cached=True)
+        with metrics.span("cover_art.analyze"):
+            result = (pool or get_pool()).submit(analyze_file, path, digest, size, ART_DIR).result()
+        cache.put(digest, result)
+        return dict(result, cached=False)
+    finally:
+        os.remove(path)
@@ -0,0 +1,424 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from datetime import date, datetime, timezone
+from xml.sax.saxutils import XMLGenerator
+
+import album
+import dsp_rules
+import normalize
+
+# --- DDEX ERN EXPORT ---
+# Completed drafts become DDEX ERN 4.3 NewReleaseMessages, one per release, written to
+# <out>/<release id>/<release id>.xml (the usual one-folder-per-release batch layout).
+# Each message is written element by element with the stdlib streaming XMLGenerator,
+# and never built as a tree. Catalogs stream through a process pool in bounded chunks,
+# with workers writing their own files. Memory stays flat however many releases
+# there are.
+# Incremental mode keeps a manifest (<out>/.ddex-manifest.sqlite) of each release's input
+# fingerprint and only re-renders releases whose draft (or this exporter) changed.
+#
+# Covers the draft schema: title + version, genre, dates, main artist, credits (composer,
+# lyricist, performers, production), language, parental warning, ISRC/UPC, label. Albums
+# and EPs get one SoundRecording per track, with the shared credits applied to each.
+# Values outside DDEX's allowed-value sets go out as UserDefined.
+#
+#   python ddex.py out/ --drafts drafts.sqlite              (complete drafts from draft_store)
+#   python ddex.py out/ --jsonl results.ndjson --incremental (batch.py output, status "ok")
+
+EXPORTER_VERSION = "1"  # bump when the XML layout changes so incremental runs re-render
+ERN_NS = "http://ddex.net/xml/ern/43"
+SCHEMA_LOCATION = "http://ddex.net/xml/ern/43 http://ddex.net/xml/ern/43/release-notification.xsd"
+SENDER = (os.getenv("DDEX_SENDER_DPID", "PADPIDA0000000000X"), os.getenv("DDEX_SENDER_NAME", "BandLab"))
+RECIPIENT = (os.getenv("DDEX_RECIPIENT_DPID", "PADPIDA0000000000Y"), os.getenv("DDEX_RECIPIENT_NAME", "DSP"))
+MAIN_ARTIST = "xboggdan"
+MANIFEST = ".ddex-manifest.sqlite"
+
+CHUNK_SIZE = 32     # releases per task sent to a worker
+WINDOW_CHUNKS = 4   # chunks in flight per worker
+
+VERSION_TYPES = {
+    "Acoustic": "AcousticVersion", "Alternate Take": "AlternativeVersion", "Demo": "DemoVersion",
+    "Extended": "ExtendedVersion", "Instrumental": "InstrumentalVersion", "Karaoke": "KaraokeVersion",
+    "Live": "LiveVersion", "Radio Edit": "RadioVersion", "Remix": "RemixVersion",
+    "Remastered": "RemasteredVersion", "Acapella": "ACappellaVersion",
+}
+PARENTAL_WARNINGS = {"explicit": "Explicit", "clean": "ExplicitContentEdited", "non-explicit": "NotExplicit"}
+PRODUCTION_ROLES = (("mix", "MixingEngineer"), ("master", "MasteringEngineer"), ("record", "RecordingEngineer"),
+                    ("engineer", "StudioPersonnel"), ("produc", "Producer"))
+VOCAL_RE = re.compile(r"vocal|sing|rap|voice|choir", re.I)
+_REF_RE = re.compile(r"[^A-Za-z0-9_-]+")
+_ROLE_WORDS_RE = re.compile(r"^\s*[(:\-–]?\s*(?:on|as|played|did)?\b", re.I)
+
+# English name -> ISO 639 code (two-letter codes preferred)
+LANGUAGE_ISO = {}
+for _code, _name in sorted(normalize.LANGUAGE_CODES.items(), key=lambda item: len(item[0])):
+    LANGUAGE_ISO.setdefault(_name, _code)
+LANGUAGE_ISO["Instrumental"] = "zxx"  # no linguistic content
+
+
+def fingerprint(draft):
+    blob = json.dumps(draft, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    return hashlib.sha256(f"{EXPORTER_VERSION}|{SENDER}|{RECIPIENT}|{blob}".encode("utf-8")).hexdigest()
+
+
+def release_ref(item):
+    # Stable id for file names and the manifest: draft id, UPC, or the batch row number.
+    raw = item.get("id") or dsp_rules.get_path(item.get("draft") or {}, "release.upc") or f"row-{item.get('row', 0)}"
+    return _REF_RE.sub("_", str(raw))[:64]
+
+
+# --- STREAMING WRITER ---
+
+class _Writer:
+    def __init__(self, out):
+        self.xml = XMLGenerator(out, encoding="utf-8", short_empty_elements=True)
+
+    @contextmanager
+    def el(self, name, **attrs):
+        self.xml.startElement(name, attrs)
+        yield
+        self.xml.endElement(name)
+
+    def leaf(self, name, text, **attrs):
+        if text is None or text == "":
+            return
+        self.xml.startElement(name, attrs)
+        self.xml.characters(str(text))
+        self.xml.endElement(name)
+
+
+def _name(entry):
+    # Credits are {"name", "role"} or free text like "Jane Doe (Guitar)".
+    if isinstance(entry, dict):
+        return entry.get("name")
+    return dsp_rules._ROLE_SUFFIX_RE.sub("", str(entry)).strip()
+
+
+def _role(entry):
+    if isinstance(entry, dict):
+        return entry.get("role") or ""
+    text = str(entry)
+    suffix = text[len(_name(text)):]
+    return _ROLE_WORDS_RE.sub("", suffix).strip(" ()-–:")
+
+
+def _production_role(text):
+    text = text.lower()
+    return next((role for key, role in PRODUCTION_ROLES if key in text), "Producer")
+
+
+def _contributors(draft):
+    # (name, ERN role, instrument) for every credit on the track, in draft order.
+    get = lambda path: dsp_rules.get_path(draft, path) or []
+    for name in get("track.credits.composers"):
+        yield _name(name), "Composer", None
+    for name in get("track.lyrics.lyricist"):
+        yield _name(name), "Lyricist", None
+    for entry in get("track.credits.performers"):
+        role = _role(entry)
+        if VOCAL_RE.search(role):
+            yield _name(entry), "Vocalist", None
+        else:
+            yield _name(entry), "AssociatedPerformer", role or None
+    for entry in get("track.credits.production"):
+        yield _name(entry), _production_role(_role(entry)), None
+    for entry in get("track.credits.contributors"):
+        yield _name(entry), "UserDefined", _role(entry) or None
+
+
+def _release_date(value, today):
+    if value and value != "ASAP" and re.match(r"^\d{4}-\d{2}-\d{2}$", str(value)):
+        return str(value)
+    return today.isoformat()
+
+
+def _warning(track_draft):
+    return PARENTAL_WARNINGS.get(str(dsp_rules.get_path(track_draft, "track.lyrics.explicit_rating") or "").lower(), "Unknown")
+
+
+def write_release(out, ref, draft, today=None, created=None):
+    """Write one NewReleaseMessage for draft (a single, or an album/EP with "tracks") to the binary stream out."""
+    today = today or date.today()
+    created = created or datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    get = lambda path, default=None: dsp_rules.get_path(draft, path, default)
+    title = get("release.title") or ""
+    artist = get("release.artist") or MAIN_ARTIST
+    version = get("release.version.type") or "Original"
+    version_text = get("release.version.custom_text") if version == "Other" else (None if version == "Original" else version)
+    release_date = _release_date(get("release.date"), today)
+    # One SoundRecording per track; an album's tracks are overlays on its shared credits.
+    if album.is_album(draft):
+        views = [album.track_view(draft, i) for i in range(len(draft["tracks"]))]
+        release_type = get("release.type") or album.release_type(len(views))
+    else:
+        views, release_type = [draft], "Single"
+    warnings = [_warning(view) for view in views]
+    release_warning = next((w for w in ("Explicit", "ExplicitContentEdited", "NotExplicit") if w in warnings), "Unknown")
+
+    # Parties: main artist first, then each distinct credited name (once for the whole release).
+    parties = {artist: "PArtist"}
+    contributors = []
+    for view in views:
+        credits = []
+        for name, role, instrument in _contributors(view):
+            if name:
+                credits.append((parties.setdefault(name, f"P{len(parties)}"), role, instrument))
+        contributors.append(credits)
+    label = get("release.label")
+    if label:
+        parties.setdefault(label, "PLabel")
+
+    w = _Writer(out)
+    w.xml.startDocument()
+    with w.el("ern:NewReleaseMessage", **{
+        "xmlns:ern": ERN_NS, "xmlns:xsi": "http://www.w3.org/2001/XMLSchema-instance",
+        "xsi:schemaLocation": SCHEMA_LOCATION, "ReleaseProfileVersionId": "Audio", "LanguageAndScriptCode": "en",
+        "AvsVersionId": "4",
+    }):
+        with w.el("MessageHeader"):
+            w.leaf("MessageThreadId", ref)
+            w.leaf("MessageId", f"{ref}-{fingerprint(draft)[:12]}")
+            for tag, (dpid, party_name) in (("MessageSender", SENDER), ("MessageRecipient", RECIPIENT)):
+                with w.el(tag):
+                    w.leaf("PartyId", dpid)
+                    with w.el("PartyName"):
+                        w.leaf("FullName", party_name)
+            w.leaf("MessageCreatedDateTime", created)
+            w.leaf("MessageControlType", "LiveMessage")
+
+        with w.el("PartyList"):
+            for name, party in parties.items():
+                with w.el("Party"):
+                    w.leaf("PartyReference", party)
+                    with w.el("PartyName"):
+                        w.leaf("FullName", name)
+
+        with w.el("ResourceList"):
+            for number, (view, credits, warning) in enumerate(zip(views, contributors, warnings), start=1):
+                track = lambda path: dsp_rules.get_path(view, path)
+                track_title = (track("track.title") if album.is_album(draft) else None) or title
+                with w.el("SoundRecording"):
+                    w.leaf("ResourceReference", f"A{number}")
+                    w.leaf("Type", "MusicalWorkSoundRecording")
+                    with w.el("SoundRecordingEdition"):
+                        with w.el("ResourceId"):
+                            w.leaf("ISRC", (track("track.isrc") or "").replace("-", "").upper() or None)
+                        if (year := track("track.released_before.original_year")) or (year := get("release.version.remaster_year")):
+                            with w.el("PLine"):
+                                w.leaf("Year", year)
+                                w.leaf("PLineText", f"{year} {label or artist}")
+                    w.leaf("DisplayTitleText", track_title)
+                    with w.el("DisplayTitle"):
+                        w.leaf("TitleText", track_title)
+                        w.leaf("SubTitle", version_text)
+                    if version != "Original":
+                        ern_version = VERSION_TYPES.get(version)
+                        if ern_version:
+                            w.leaf("VersionType", ern_version)
+                        else:
+                            w.leaf("VersionType", "UserDefined", UserDefinedValue=version_text or version)
+                    w.leaf("DisplayArtistName", artist)
+                    with w.el("DisplayArtist", SequenceNumber="1"):
+                        w.leaf("ArtistPartyReference", "PArtist")
+                        w.leaf("DisplayArtistRole", "MainArtist")
+                    for n, (party, role, instrument) in enumerate(credits, start=1):
+                        with w.el("Contributor", SequenceNumber=str(n)):
+                            w.leaf("ContributorPartyReference", party)
+                            if role == "UserDefined":
+                                w.leaf("Role", role, UserDefinedValue=instrument or "Contributor")
+                            else:
+                                w.leaf("Role", role)
+                                w.leaf("InstrumentType", instrument)
+                    w.leaf("ParentalWarningType", warning)
+                    w.leaf("LanguageOfPerformance", LANGUAGE_ISO.get(track("track.lyrics.language")))
+
+        with w.el("ReleaseList"):
+            with w.el("Release"):
+                w.leaf("ReleaseReference", "R0")
+                w.leaf("ReleaseType", release_type)
+                with w.el("ReleaseId"):
+                    w.leaf("ICPN", get("release.upc"))
+                w.leaf("DisplayTitleText", title)
+                with w.el("DisplayTitle"):
+                    w.leaf("TitleText", title)
+                    w.leaf("SubTitle", version_text)
+                w.leaf("DisplayArtistName", artist)
+                with w.el("DisplayArtist", SequenceNumber="1"):
+                    w.leaf("ArtistPartyReference", "PArtist")
+                    w.leaf("DisplayArtistRole", "MainArtist")
+                if label:
+                    with w.el("ReleaseLabelReference"):
+                        w.xml.characters(parties[label])
+                with w.el("Genre"):
+                    w.leaf("GenreText", get("release.genre"))
+                w.leaf("ParentalWarningType", release_warning)
+                with w.el("ResourceGroup"):
+                    for number in range(1, len(views) + 1):
+                        with w.el("ResourceGroupContentItem"):
+                            w.leaf("SequenceNumber", str(number))
+                            w.leaf("ReleaseResourceReference", f"A{number}")
+                w.leaf("OriginalReleaseDate", release_date)
+
+        with w.el("DealList"):
+            with w.el("ReleaseDeal"):
+                w.leaf("DealReleaseReference", "R0")
+                for model, use in (("SubscriptionModel", "Stream"), ("AdvertisementSupportedModel", "Stream"),
+                                   ("PayAsYouGoModel", "PermanentDownload")):
+                    with w.el("Deal"):
+                        with w.el("DealTerms"):
+                            w.leaf("TerritoryCode", "Worldwide")
+                            with w.el("ValidityPeriod"):
+                                w.leaf("StartDate", release_date)
+                            w.leaf("CommercialModelType", model)
+                            w.leaf("UseType", use)
+    w.xml.endDocument()
+
+
+def render(draft, ref="R0"):
+    """One release as XML bytes (for single-release downloads)."""
+    import io
+    out = io.BytesIO()
+    write_release(out, ref, draft)
+    return out.getvalue()
+
+
+# --- CATALOG EXPORT ---
+
+def _export_chunk(task):
+    # Runs in a worker: write each release's file, report back only small status dicts.
+    out_dir, chunk = task
+    results = []
+    for ref, draft_fingerprint, draft in chunk:
+        start = time.perf_counter()
+        path = os.path.join(out_dir, ref, f"{ref}.xml")
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path + ".tmp", "wb") as f:
+                write_release(f, ref, draft)
+            os.replace(path + ".tmp", path)
+            results.append({"id": ref, "status": "written", "path": path, "fingerprint": draft_fingerprint,
+                            "seconds": time.perf_counter() - start})
+        except (OSError, TypeError, ValueError) as e:
+            results.append({"id": ref, "status": "error", "error": str(e), "seconds": time.perf_counter() - start})
+    return results
+
+
+class Manifest:
+    # release id -> fingerprint of the draft its XML was rendered from
+    def __init__(self, out_dir):
+        self.db = sqlite3.connect(os.path.join(out_dir, MANIFEST))
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS releases (id TEXT PRIMARY KEY, fingerprint TEXT NOT NULL, path TEXT, exported REAL)")
+
+    def known(self, refs):
+        marks = ",".join("?" * len(refs))
+        return dict(self.db.execute(f"SELECT id, fingerprint FROM releases WHERE id IN ({marks})", refs).fetchall())
+
+    def record(self, results):
+        now = time.time()
+        with self.db:
+            self.db.executemany("INSERT OR REPLACE INTO releases (id, fingerprint, path, exported) VALUES (?, ?, ?, ?)",
+                                [(r["id"], r["fingerprint"], r["path"], now) for r in results if r["status"] == "written"])
+
+    def close(self):
+        self.db.close()
+
+
+def _chunks(items):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= CHUNK_SIZE:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def export_stream(items, out_dir, pool, incremental=False):
+    """
+    Export {"id"/"row", "draft"} items under out_dir. Yields one status dict per release
+    ("written", "unchanged" or "error") in input order; at most a window of chunks is held.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    manifest = Manifest(out_dir)
+    max_in_flight = max(1, getattr(pool, "_max_workers", 1)) * WINDOW_CHUNKS
+    in_flight = deque()
+    try:
+        for chunk in _chunks(items):
+            batch = [(release_ref(item), fingerprint(item["draft"]), item["draft"]) for item in chunk]
+            known = manifest.known([ref for ref, _, _ in batch]) if incremental else {}
+            todo = []
+            for ref, draft_fingerprint, draft in batch:
+                if known.get(ref) == draft_fingerprint and os.path.exists(os.path.join(out_dir, ref, f"{ref}.xml")):
+                    yield {"id": ref, "status": "unchanged"}
+                else:
+                    todo.append((ref, draft_fingerprint, draft))
+            if todo:
+                in_flight.append(pool.submit(_export_chunk, (out_dir, todo)))
+            while len(in_flight) >= max_in_flight:
+                yield from _finish(in_flight.popleft(), manifest)
+        while in_flight:
+            yield from _finish(in_flight.popleft(), manifest)
+    finally:
+        manifest.close()
+
+
+def _finish(future, manifest):
+    results = future.result()
+    manifest.record(results)
+    return results
+
+
+def export(items, out_dir, workers=None, incremental=False):
+    """Export a catalog; returns counts by status."""
+    counts = {}
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        for result in export_stream(items, out_dir, pool, incremental):
+            counts[result["status"]] = counts.get(result["status"], 0) + 1
+    return counts
+
+
+def iter_jsonl(path):
+    # batch.py results (only "ok" rows) or plain {"id", "draft"} lines.
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                item = json.loads(line)
+                if item.get("status", "ok") in ("ok", "complete") and isinstance(item.get("draft"), dict):
+                    yield item
+
+
+# --- CLI ---
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export completed release drafts as DDEX ERN 4.3 XML (one file per release).")
+    parser.add_argument("out", help="output directory")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--drafts", help="draft_store SQLite database (exports status=complete)")
+    source.add_argument("--jsonl", help="batch.py NDJSON results or {id, draft} lines")
+    parser.add_argument("--incremental", action="store_true", help="skip releases unchanged since the last export")
+    parser.add_argument("--workers", type=int, default=None, help="rendering processes (default: CPU count)")
+    args = parser.parse_args(argv)
+
+    if args.drafts:
+        import draft_store
+        items = draft_store.DraftStore(args.drafts).export("complete")
+    else:
+        items = iter_jsonl(args.jsonl)
+    start = time.perf_counter()
+    counts = export(items, args.out, args.workers, args.incremental)
+    print(f"✅ DDEX export: {json.dumps(counts)} in {time.perf_counter() - start:.1f}s -> {args.out}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+
+# --- REQUEST COALESCING + IDEMPOTENCY KEYS ---
+# Double-clicks and client retries send the same /chat turn more than once.
+# * SingleFlight: identical requests that arrive while one is in flight wait for it and
+#   share its response. That means one provider call and one draft update. The key is a
+#   fingerprint of the request (session, message, context) plus any Idempotency-Key.
+# * IdempotencyStore: a response to a request carrying an Idempotency-Key header is kept
+#   for a replay window (bounded LRU + TTL). A retry with the same key gets the stored
+#   response back (Idempotent-Replayed: true) without calling the provider again.
+#   Reusing a key for a different request raises KeyReused (422). Only successful
+#   responses are stored, so a retry after a 429 or 500 really is retried.
+
+
+class KeyReused(ValueError):
+    pass
+
+
+def fingerprint(*parts):
+    blob = json.dumps(parts, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self, name="chat"):
+        self.name = name
+        self.flights = {}
+        self.lock = threading.Lock()
+        self.counters = {"leaders": 0, "coalesced": 0}
+
+    def do(self, key, fn):
+        """Run fn() once per key at a time. Returns (result, shared); callers that joined re-raise the leader's error."""
+        with self.lock:
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.flights[key] = _Flight()
+                self.counters["leaders"] += 1
+            else:
+                self.counters["coalesced"] += 1
+        if not leader:
+            metrics.inc("requests_coalesced_total", route=self.name)
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, True
+        try:
+            flight.result = fn()
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.flights[key]
+            flight.done.set()
+        return flight.result, False
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters, in_flight=len(self.flights))
+
+
+class AsyncSingleFlight:
+    # Same as SingleFlight for one event loop. The shared task keeps running while anyone
+    # still waits on it, and is cancelled once every waiter (client) has gone.
+    def __init__(self, name="chat"):
+        self.name = name
+        self.flights = {}  # key -> [task, waiters]
+        self.counters = {"leaders": 0, "coalesced": 0}
+
+    async def do(self, key, factory):
+        entry = self.flights.get(key)
+        shared = entry is not None
+        if shared:
+            self.counters["coalesced"] += 1
+            metrics.inc("requests_coalesced_total", route=self.name)
+        else:
+            entry = self.flights[key] = [asyncio.ensure_future(factory()), 0]
+            self.counters["leaders"] += 1
+            entry[0].add_done_callback(lambda _: self.flights.get(key) is entry and self.flights.pop(key))
+        entry[1] += 1
+        try:
+            return await asyncio.shield(entry[0]), shared
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0 and not entry[0].done():
+                entry[0].cancel()
+
+    def stats(self):
+        return dict(self.counters, in_flight=len(self.flights))
+
+
+class IdempotencyStore:
+    def __init__(self, max_entries=10000, ttl=600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (fingerprint, expires, response)
+        self.lock = threading.Lock()
+        self.counters = {"stored": 0, "replayed": 0, "reused_keys": 0, "evictions": 0}
+
+    def get(self, key, request_fingerprint):
+        """Stored response for key, or None. Raises KeyReused if key belonged to a different request."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            stored_fingerprint, expires, response = entry
+            if time.time() > expires:
+                del self.entries[key]
+                return None
+            if stored_fingerprint != request_fingerprint:
+                self.counters["reused_keys"] += 1
+                raise KeyReused(key)
+            self.counters["replayed"] += 1
+        metrics.inc("idempotent_replays_total")
+        return response
+
+    def put(self, key, request_fingerprint, response):
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (request_fingerprint, time.time() + self.ttl, response)
+            self.counters["stored"] += 1
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.counters["evictions"] += 1
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters, entries=len(self.entries))
+
+
+def store_from_env():
+    return IdempotencyStore(
+        max_entries=int(os.getenv("IDEMPOTENCY_MAX", "10000")),
+        ttl=float(os.getenv("IDEMPOTENCY_TTL", "600")),
+    )
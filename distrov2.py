@@ -1,6 +1,23 @@
 import streamlit as st
+import functools
 import json
+import os
 import time
+import urllib.request
+import uuid
+
+import catalog
+import draft_state
+import draft_store
+import dsp_rules
+import llm_cache
+import metrics
+import normalize
+import nlu
+import prompt_budget
+import providers
+import router
+import streaming
 
 # --- 1. THE BRAIN (SYSTEM PROMPT) ---
 # This prompt is the single source of truth for the AI's behavior.
@@ -117,18 +134,73 @@ You are building this JSON object. Update it as you gather info.
 
 ### 5. OUTPUT INSTRUCTIONS
 Always reply with a JSON object containing `response` (text to user) and `updates` (data to merge).
+* Only include fields that changed. Names in credit lists (`composers`, `performers`, `production`) are ADDED to what is already there, so send just the new names.
+* To take a name out of a credit list, add `"patch": [{"op": "remove", "path": "track.credits.composers", "value": "Name"}]`.
+
+### 6. CURRENT DRAFT STATE
+Fields collected so far (empty fields omitted). Do not ask for these again unless the user changes them:
+{current_state}
 """
 
+# Everything before the draft state never changes, so it is sent as a separate static
+# prefix the providers can cache (Gemini cached content / system_instruction, OpenAI-style
+# automatic prefix caching). The state section is re-rendered for every turn.
+STATE_HEADING = "### 6. CURRENT DRAFT STATE"
+PROMPT_PREFIX, _, _state_section = AGENT_SYSTEM_PROMPT.partition(STATE_HEADING)
+PROMPT_STATE = STATE_HEADING + _state_section
+
 # --- 2. SETUP & IMPORTS ---
-try:
-    from groq import Groq
-    import google.generativeai as genai
-    from openai import OpenAI
-except ImportError:
-    pass
+# Provider SDKs are imported lazily by providers.py, only for the key that is configured.
 
 st.set_page_config(page_title="BandLab Distro Agent", page_icon="🔥", layout="wide")
 
+@st.cache_resource
+def warm_up_provider():
+    # Runs once per server process: import the SDKs and open pooled connections off the hot path.
+    for name, api_key in providers.configured_all(st.secrets):
+        providers.warm_up_in_background(name, api_key)
+    return True
+
+warm_up_provider()
+
+@st.cache_resource
+def get_router():
+    # One router per server process so latency/error stats survive reruns.
+    # LLM_HEDGE_AFTER: seconds before a hedged second request, "auto" (primary's p95) or unset (off).
+    hedge = os.getenv("LLM_HEDGE_AFTER") or None
+    if hedge and hedge != "auto":
+        hedge = float(hedge)
+    return router.ProviderRouter(
+        [router.Provider(name, providers.PROVIDERS[name]["model"], functools.partial(call_provider, name, api_key))
+         for name, api_key in providers.configured_all(st.secrets)],
+        hedge_after=hedge,
+    )
+
+# --- RENDER MODE ---
+# STREAMLIT_FRAGMENTS=1 (default): the chat transcript + input run as a fragment, so a new
+# message reruns just that panel. The whole script (CSS, sidebar) only reruns when the
+# turn changed something the sidebar shows. =0 keeps the classic full rerun per message.
+FRAGMENTS = os.getenv("STREAMLIT_FRAGMENTS", "1") != "0" and hasattr(st, "fragment")
+fragment = st.fragment if FRAGMENTS else (lambda f: f)
+TRANSCRIPT_BLOCK = 20  # finished messages per pre-rendered transcript block
+RESUBMIT_WINDOW = 3.0  # seconds in which the same chat_input text again is a re-submit, not a new turn
+LOGO_URL = "https://upload.wikimedia.org/wikipedia/commons/thumb/c/ca/BandLab_Technologies_logo.svg/2560px-BandLab_Technologies_logo.svg.png"
+
+@st.cache_resource
+def get_drafts():
+    # Durable drafts (DRAFT_DB, default in the temp dir): saved through a write-behind queue
+    # after every turn and resumed from the ?draft=<id> in the URL after a refresh.
+    return draft_store.get_store()
+
+@st.cache_resource(show_spinner=False)
+def load_logo():
+    # Fetched once per server process instead of on every rerun; falls back to the URL.
+    try:
+        with urllib.request.urlopen(LOGO_URL, timeout=5) as resp:
+            return resp.read()
+    except OSError:
+        return LOGO_URL
+
 st.markdown("""
 <style>
     /* BANDLAB STYLE OVERRIDES */
@@ -145,39 +217,98 @@ st.markdown("""
 
 # --- 3. AGENT LOGIC ---
 
-def call_llm(messages, current_data):
-    # INJECT STATE INTO THE GOD PROMPT
-    final_prompt = AGENT_SYSTEM_PROMPT.replace("{current_state}", json.dumps(current_data, indent=2))
-    
-    try:
-        # 1. GROQ
-        if "GROQ_API_KEY" in st.secrets:
-            client = Groq(api_key=st.secrets["GROQ_API_KEY"])
-            msgs = [{"role": "system", "content": final_prompt}] + [{"role": m["role"], "content": m["content"]} for m in messages]
-            res = client.chat.completions.create(model="llama-3.3-70b-versatile", messages=msgs, response_format={"type": "json_object"})
-            return json.loads(res.choices[0].message.content)
-            
-        # 2. GEMINI
-        elif "GEMINI_API_KEY" in st.secrets:
-            genai.configure(api_key=st.secrets["GEMINI_API_KEY"])
-            model = genai.GenerativeModel('gemini-1.5-flash', generation_config={"response_mime_type": "application/json"})
-            chat = model.start_chat(history=[])
-            prompt_payload = final_prompt + f"\n\nLATEST USER MESSAGE: {messages[-1]['content']}"
-            res = chat.send_message(prompt_payload)
-            return json.loads(res.text)
-
-        # 3. OPENAI
-        elif "OPENAI_API_KEY" in st.secrets:
-            client = OpenAI(api_key=st.secrets["OPENAI_API_KEY"])
-            msgs = [{"role": "system", "content": final_prompt}] + [{"role": m["role"], "content": m["content"]} for m in messages]
-            res = client.chat.completions.create(model="gpt-4o", messages=msgs, response_format={"type": "json_object"})
-            return json.loads(res.choices[0].message.content)
+# How many prior turns (besides the latest message) go into the response-cache key.
+CACHE_TURNS = 2
+
+def call_llm(messages, current_data, on_text=None):
+    # INJECT STATE INTO THE GOD PROMPT (compact) + TRIM OLD TURNS TO THE TOKEN BUDGET
+    with metrics.span("prompt.build"):
+        # Draft.compact() re-serializes only the sections changed since the last turn.
+        state_text, prompt_messages, report = prompt_budget.build(
+            PROMPT_STATE, messages, st.session_state.draft.compact(),
+            text_of=lambda m: m["content"], role_of=lambda m: m["role"], prefix=PROMPT_PREFIX,
+        )
+        # Prior releases matching this draft (duplicate title, ISRC/UPC already used)
+        state_text += catalog.note_for(catalog.get_catalog(), current_data)
+        final_prompt = PROMPT_PREFIX + state_text
+    st.session_state.prompt_report = report
+
+    # RESPONSE CACHE: same prompt + state + recent turns + message => no provider call
+    cache = llm_cache.get_cache()
+    bypass = llm_cache.bypass_from_env()
+    cache_key = llm_cache.make_key(final_prompt, current_data, messages[-(CACHE_TURNS + 1):-1], messages[-1]['content'])
+    if (cached := cache.get(cache_key, bypass)) is not None:
+        return cached
+
+    # STREAMING: on_text gets each new piece of the "response" text as tokens arrive;
+    # "updates" are only read from the full JSON once the stream is complete.
+    streamer = streaming.JsonFieldStreamer("response")
+    def _on_chunk(piece):
+        if delta := streamer.feed(piece):
+            on_text(delta)
+    on_chunk = _on_chunk if on_text is not None else None
+
+    llm_router = get_router()
+    if not llm_router.providers:
+        # Fallback for Demo Mode (No Keys)
+        return mock_logic(messages[-1]['content'])
 
+    try:
+        # Fastest healthy provider first, failing over (and optionally hedging) to the others.
+        result = llm_router.call(final_prompt, prompt_messages, on_chunk)
     except Exception as e:
         return {"response": f"❌ Agent Error: {str(e)}", "updates": {}}
 
-    # Fallback for Demo Mode (No Keys)
-    return mock_logic(messages[-1]['content'])
+    cache.put(cache_key, result, bypass)
+    return result
+
+def split_prompt(final_prompt):
+    # (static prefix, this turn's state/notes); a prompt built elsewhere is all prefix.
+    if final_prompt.startswith(PROMPT_PREFIX):
+        return PROMPT_PREFIX, final_prompt[len(PROMPT_PREFIX):].strip()
+    return final_prompt, ""
+
+def call_provider(name, api_key, final_prompt, messages, on_chunk=None):
+    # One provider call; the router decides which provider runs and in what order.
+    # Every provider gets the static prefix first, then the real multi-turn history, then
+    # this turn's draft state right before the latest message, so the cacheable prefix
+    # is byte-identical from call to call.
+    stream = on_chunk is not None
+    model_name = providers.PROVIDERS[name]["model"]
+    prefix, context = split_prompt(final_prompt)
+
+    # 1. GROQ / 3. OPENAI (same chat.completions API)
+    if name in ("groq", "openai"):
+        client = providers.get_client(name, api_key)
+        with metrics.span("history.format", provider=name):
+            msgs = [{"role": "system", "content": prefix}] + [{"role": m["role"], "content": m["content"]} for m in messages[:-1]]
+            if context:
+                msgs.append({"role": "system", "content": context})
+            msgs.append({"role": "user", "content": messages[-1]["content"]})
+        with metrics.span("llm.request", provider=name):
+            res = client.chat.completions.create(model=model_name, messages=msgs, response_format={"type": "json_object"}, stream=stream)
+            text = streaming.collect(res, lambda c: c.choices[0].delta.content if c.choices else None, on_chunk) if stream else res.choices[0].message.content
+        prompt_text = "\n".join(m["content"] for m in msgs)
+    else:
+        # 2. GEMINI: prefix in the model (cached content when the API allows it)
+        model = providers.gemini_prefix_model(api_key, model_name, prefix, generation_config={"response_mime_type": "application/json"})
+        with metrics.span("history.format", provider=name):
+            history = [{"role": "model" if m["role"] == "assistant" else "user", "parts": [m["content"]]} for m in messages[:-1]]
+        chat = model.start_chat(history=history)
+        message = f"{context}\n\nLATEST USER MESSAGE: {messages[-1]['content']}" if context else messages[-1]["content"]
+        with metrics.span("llm.request", provider=name):
+            res = chat.send_message(message, stream=stream)
+            text = streaming.collect(res, lambda c: c.text, on_chunk) if stream else res.text
+        prompt_text = "\n".join([prefix] + [m["content"] for m in messages[:-1]] + [message])
+
+    # Gemini streams report usage once consumed; chat.completions streams don't, so those
+    # fall back to the local estimate.
+    if usage := metrics.usage_tokens(res):
+        metrics.record_tokens(name, *usage, cached=metrics.cached_tokens(res))
+    else:
+        metrics.record_tokens(name, prompt_budget.estimate_tokens(prompt_text), prompt_budget.estimate_tokens(text))
+    with metrics.span("response.parse", provider=name):
+        return json.loads(text)
 
 def mock_logic(text):
     text = text.lower()
@@ -235,6 +366,13 @@ def mock_logic(text):
 # --- 4. APP LOGIC ---
 
 def init_state():
+    if "messages" not in st.session_state:
+        draft_id = st.query_params.get("draft")
+        if draft_id and (saved := get_drafts().load(draft_id)):
+            st.session_state.update({"messages": saved["transcript"], "data": saved["draft"], "draft_id": draft_id})
+            st.session_state.draft = draft_state.Draft(saved["draft"], saved["version"], saved["log"])
+        st.session_state.setdefault("draft_id", uuid.uuid4().hex)
+        st.query_params["draft"] = st.session_state.draft_id
     if "messages" not in st.session_state:
         st.session_state.update({
             "messages": [],
@@ -251,26 +389,77 @@ def init_state():
                 "assets": {"cover_status": False, "audio_status": False}
             }
         })
-
-def process_input(user_txt):
+    if "draft" not in st.session_state:
+        # Versioned view over the same dict: all changes go through draft.apply(ops).
+        st.session_state.draft = draft_state.Draft(st.session_state.data)
+
+def save_draft():
+    draft = st.session_state.draft
+    get_drafts().save(st.session_state.draft_id, draft.data, st.session_state.messages, draft.version, draft.state()["draft_log"])
+
+def queue_input(user_txt):
+    # Inputs are processed in the main chat area on the next run, so the reply can
+    # stream into its own bubble instead of waiting behind a spinner.
+    if not user_txt:
+        return
+    # A double Enter / re-submit would otherwise run (and pay for) the same turn twice.
+    last_txt, last_at = st.session_state.get("last_submit", (None, 0.0))
+    if user_txt == last_txt and time.time() - last_at < RESUBMIT_WINDOW:
+        return
+    st.session_state.last_submit = (user_txt, time.time())
+    st.session_state.pending = user_txt
+
+def process_input(user_txt, stream_to=None):
     if not user_txt: return
     st.session_state.messages.append({"role": "user", "content": user_txt})
-    
-    with st.spinner("🤖 Agent Thinking..."):
-        result = call_llm(st.session_state.messages, st.session_state.data)
-        
-        # Recursive Update Function
-        def update_nested(d, u):
-            for k, v in u.items():
-                if isinstance(v, dict):
-                    d[k] = update_nested(d.get(k, {}), v)
-                else:
-                    d[k] = v
-            return d
-
-        update_nested(st.session_state.data, result.get("updates", {}))
-                    
-        st.session_state.messages.append({"role": "assistant", "content": result.get("response")})
+    draft = st.session_state.draft
+    base_version = draft.version
+    welcome = len(st.session_state.messages) == 1
+    st.session_state.changed = []
+
+    shown = []
+    def _on_text(delta):
+        shown.append(delta)
+        stream_to.markdown(f"<div class='bot-msg'>{''.join(shown)}</div>", unsafe_allow_html=True)
+    on_text = _on_text if stream_to is not None else None
+
+    # Per-turn timings for the sidebar panel (only collected while it's switched on).
+    with metrics.collect(st.session_state.get("show_timings", False)) as timings:
+        # Local DSP rules answer invalid replies instantly; only valid input reaches the LLM.
+        question = dsp_rules.last_assistant_message(st.session_state.messages[:-1])
+        with metrics.span("rules.precheck"):
+            result = dsp_rules.precheck(question, user_txt) or catalog.precheck(catalog.get_catalog(), user_txt, st.session_state.data)
+        # Plain slot-filling turns (title/genre/date/version/years/"I did everything") are answered locally.
+        if result is None:
+            result = nlu.fast_reply(question, user_txt, st.session_state.data, catalog.get_catalog())
+
+        with st.spinner("🤖 Agent Thinking..."):
+            if result is None:
+                result = call_llm(st.session_state.messages, st.session_state.data, on_text)
+
+            # Delta against the version this turn started from: scalars replace,
+            # credit names append, and "patch" carries explicit removals.
+            with metrics.span("draft.merge"):
+                updates = normalize.normalize_updates(result.get("updates", {}))  # "hiphop" -> "Hip Hop"
+                ops = draft_state.updates_to_ops(updates, draft.data) + list(result.get("patch") or [])
+                try:
+                    try:
+                        draft.apply(ops, base_version)
+                    except draft_state.DraftConflict as e:
+                        draft.apply(e.clean_ops)
+                except draft_state.InvalidPatch as e:
+                    print(f"⚠️ Ignoring patch: {e}")
+                st.session_state.changed = draft.dirty_since(base_version) or []
+
+            st.session_state.messages.append({"role": "assistant", "content": result.get("response")})
+    st.session_state.timings = timings
+    save_draft()
+    # The welcome screen, the 🆕 markers and the timings panel live outside the chat fragment.
+    rerun_turn(full=welcome or bool(st.session_state.changed) or st.session_state.get("show_timings", False))
+
+def rerun_turn(full):
+    if FRAGMENTS and not full:
+        st.rerun(scope="fragment")
     st.rerun()
 
 # --- 5. RENDER UI ---
@@ -279,28 +468,40 @@ init_state()
 
 # SIDEBAR DASHBOARD
 with st.sidebar:
-    st.image("https://upload.wikimedia.org/wikipedia/commons/thumb/c/ca/BandLab_Technologies_logo.svg/2560px-BandLab_Technologies_logo.svg.png", width=140)
+    st.image(load_logo(), width=140)
     d = st.session_state.data
     
     st.markdown("### 💿 Live Metadata Draft")
     
-    # Helper to render row
-    def row(lbl, val, req=True):
+    # Helper to render row (🆕 = changed by the last turn)
+    changed = st.session_state.get("changed", [])
+    def row(lbl, val, req=True, path=None):
         status = "✅" if val else ("⭕ Req" if req else "Optional")
         if isinstance(val, list): status = f"✅ {len(val)}" if val else ("⭕ Req" if req else "Optional")
+        if path and any(c == path or c.startswith(path + ".") for c in changed): status = "🆕 " + status
         st.markdown(f"<div class='field-row'><b>{lbl}</b> <span>{status}</span></div>", unsafe_allow_html=True)
 
     st.caption("RELEASE")
     r = d.get('release', {})
-    row("Title", r.get('title')); row("Artist", r.get('artist')); row("Genre", r.get('genre'))
+    row("Title", r.get('title'), path="release.title"); row("Artist", r.get('artist'), path="release.artist"); row("Genre", r.get('genre'), path="release.genre")
     
     st.caption("CREDITS")
     t = d.get('track', {}).get('credits', {})
-    row("Composers", t.get('composers')); row("Producers", t.get('production'))
+    row("Composers", t.get('composers'), path="track.credits.composers"); row("Producers", t.get('production'), path="track.credits.production")
     
     st.caption("ASSETS")
     a = d.get('assets', {})
-    row("Cover Art", a.get('cover_status')); row("Audio", a.get('audio_status'))
+    row("Cover Art", a.get('cover_status'), path="assets.cover_status"); row("Audio", a.get('audio_status'), path="assets.audio_status")
+
+    if rep := st.session_state.get("prompt_report"):
+        st.caption(f"Last prompt: ~{rep['input_tokens']} input tokens ({rep['prefix_tokens']} in the cacheable prefix, {rep['dropped_messages']} older msgs trimmed)")
+
+    # TIMING PANEL (per-turn spans; off by default)
+    if st.checkbox("⏱️ Show timings", key="show_timings") and (tm := st.session_state.get("timings")):
+        for stage, seconds in tm["spans"]:
+            st.caption(f"{stage}: {seconds * 1000:.1f} ms")
+        for name, value in tm["counts"].items():
+            st.caption(f"{name}: {value:g}")
 
     st.divider()
     # DEMO BUTTONS
@@ -310,20 +511,21 @@ with st.sidebar:
         st.session_state.messages = []
         init_state()
         if scen_id == 1:
-            process_input("I'm releasing a Hip Hop single called 'Empire' by xboggdan dropping ASAP.")
+            queue_input("I'm releasing a Hip Hop single called 'Empire' by xboggdan dropping ASAP.")
         elif scen_id == 2:
-            st.session_state.data['release'].update({"title": "Neon", "genre": "Pop"})
+            st.session_state.draft.apply([{"op": "replace", "path": "release.title", "value": "Neon"},
+                                          {"op": "replace", "path": "release.genre", "value": "Pop"}])
             st.session_state.messages.append({"role": "assistant", "content": "Title: Neon. Genre: Pop. Who worked on this?"})
-            process_input("I did everything myself.")
+            queue_input("I did everything myself.")
         elif scen_id == 3: # Education
             st.session_state.messages.append({"role": "assistant", "content": "What is the Release Title?"})
-            process_input("Wait, what is an ISRC? Do I need one?")
+            queue_input("Wait, what is an ISRC? Do I need one?")
         elif scen_id == 4: # Chaos
-             process_input("yo song is 'Pizza' genre hyperpop i wrote it with mom but produced alone dropping friday")
+             queue_input("yo song is 'Pizza' genre hyperpop i wrote it with mom but produced alone dropping friday")
         elif scen_id == 5: # Version Logic
-             st.session_state.data['release'].update({"title": "Old Song"})
+             st.session_state.draft.apply([{"op": "replace", "path": "release.title", "value": "Old Song"}])
              st.session_state.messages.append({"role": "assistant", "content": "Title set. Is this the Original version?"})
-             process_input("No, it's Remastered.")
+             queue_input("No, it's Remastered.")
 
         st.rerun()
 
@@ -332,12 +534,44 @@ with st.sidebar:
     if st.button("3. Educational Pivot"): run_demo(3)
     if st.button("4. Chaos Input"): run_demo(4)
     if st.button("5. Version Logic Check"): run_demo(5)
-    if st.button("Reset"): st.session_state.clear(); st.rerun()
+    if st.button("Reset"): st.session_state.clear(); st.query_params.clear(); st.rerun()
+
+def bubble(msg):
+    cls = "user-msg" if msg['role'] == "user" else "bot-msg"
+    return f"<div class='{cls}'>{msg['content']}</div>"
+
+def render_transcript():
+    # Every TRANSCRIPT_BLOCK finished messages are joined into one HTML block once and
+    # reused, so a rerun sends a few unchanged blocks plus the newest bubbles instead of
+    # rebuilding one element per message. Keyed on the messages list, which demos/reset replace.
+    msgs = st.session_state.messages
+    cache = st.session_state.get("transcript")
+    if cache is None or cache["list"] is not msgs or cache["done"] > len(msgs):
+        cache = st.session_state.transcript = {"list": msgs, "blocks": [], "done": 0}
+    while len(msgs) - cache["done"] >= TRANSCRIPT_BLOCK:
+        cache["blocks"].append("".join(bubble(m) for m in msgs[cache["done"]:cache["done"] + TRANSCRIPT_BLOCK]))
+        cache["done"] += TRANSCRIPT_BLOCK
+    for block in cache["blocks"]:
+        st.markdown(block, unsafe_allow_html=True)
+    for msg in msgs[cache["done"]:]:
+        st.markdown(bubble(msg), unsafe_allow_html=True)
+
+@fragment
+def chat_panel():
+    render_transcript()
+
+    # PENDING INPUT: show it right away and stream the reply underneath
+    if pending := st.session_state.pop("pending", None):
+        st.markdown(bubble({"role": "user", "content": pending}), unsafe_allow_html=True)
+        process_input(pending, stream_to=st.empty())
+
+    # Submitting from inside the fragment reruns only this panel.
+    st.chat_input("Type here...", key="u_in", on_submit=lambda: queue_input(st.session_state.u_in))
 
 # MAIN SCREEN
 st.title("BandLab Distribution AI")
 
-if not st.session_state.messages:
+if not st.session_state.messages and not st.session_state.get("pending"):
     # WELCOME SCREEN
     st.markdown("""
     <div style="text-align:center; padding: 40px; background: #F9FAFB; border-radius: 12px; margin-bottom: 20px;">
@@ -351,15 +585,10 @@ if not st.session_state.messages:
         st.markdown('<div class="big-btn">', unsafe_allow_html=True)
         if st.button("Start New Release"):
             st.session_state.messages.append({"role": "assistant", "content": "Let's get started! What is the **Release Title**?"})
+            save_draft()
             st.rerun()
         st.markdown('</div>', unsafe_allow_html=True)
 
-else:
-    # CHAT SCREEN
-    for msg in st.session_state.messages:
-        cls = "user-msg" if msg['role'] == "user" else "bot-msg"
-        st.markdown(f"<div class='{cls}'>{msg['content']}</div>", unsafe_allow_html=True)
-
-# CHAT INPUT
-st.chat_input("Type here...", key="u_in", on_submit=lambda: process_input(st.session_state.u_in))
+# CHAT SCREEN + INPUT
+chat_panel()
 
@@ -0,0 +1,229 @@
+import copy
+import threading
+from collections import deque
+
+import batch
+import prompt_budget
+
+# --- VERSIONED DRAFT STATE ---
+# The release draft changes only through patch ops. Each apply() is one new version,
+# and every touched path goes into a bounded change log. That log gives us:
+#   * dirty_since(v): fields changed after version v (UI highlights, prompt re-render)
+#   * conflict detection: a delta computed against version v is refused if another
+#     update touched an overlapping path since v (two appends to a credits list commute)
+# Ops follow JSON Patch with dotted or /json/pointer paths:
+#   {"op": "add" | "replace", "path", "value"}   "add" on ".../-" appends to a list
+#   {"op": "remove", "path"}                     remove a key or list index
+#   {"op": "remove", "path", "value"}            remove a list entry by value (credits)
+# LLM "updates" dicts are turned into ops by updates_to_ops(): credit lists append the
+# entries that aren't there yet, instead of replacing the whole list.
+
+MAX_LOG = 500
+LIST_PATHS = batch.LIST_PATHS  # credits/lyricist lists: append/remove instead of replace
+# release_tool arguments that aren't catalog columns
+TOOL_FIELDS = {"artwork_uploaded": "assets.cover_status", "audio_uploaded": "assets.audio_status"}
+
+
+class DraftConflict(Exception):
+    def __init__(self, paths, clean_ops):
+        super().__init__(f"Draft changed concurrently at: {', '.join(sorted(paths))}")
+        self.paths = paths
+        self.clean_ops = clean_ops  # the ops that don't touch a conflicting path
+
+
+class InvalidPatch(ValueError):
+    pass
+
+
+def _split(path):
+    if path.startswith("/"):
+        return [p.replace("~1", "/").replace("~0", "~") for p in path[1:].split("/")]
+    return path.split(".")
+
+
+def _overlaps(a, b):
+    n = min(len(a), len(b))
+    return a[:n] == b[:n]
+
+
+def _same_entry(a, b):
+    if isinstance(a, str) and isinstance(b, str):
+        return a.strip().casefold() == b.strip().casefold()
+    return a == b
+
+
+def _op_target(op):
+    # (path segments, kind) for the log; list appends are logged against the list itself.
+    keys = _split(op["path"])
+    if op["op"] == "add" and keys[-1] == "-":
+        return keys[:-1], "append"
+    return keys, op["op"]
+
+
+class Draft:
+    def __init__(self, data=None, version=0, log=None):
+        self.data = data if data is not None else {}
+        self.version = version
+        self.log = deque((tuple(e) for e in (log or [])), maxlen=MAX_LOG)  # (version, dotted path, kind)
+        self.lock = threading.Lock()
+        self._rendered = {}  # top-level section -> compact JSON fragment
+        self._rendered_at = version
+
+    # --- patch application ---
+
+    def _apply_op(self, root, op):
+        kind = op.get("op")
+        keys = _split(op.get("path", ""))
+        if kind not in ("add", "replace", "remove") or not keys or keys == [""]:
+            raise InvalidPatch(f"Unsupported op: {op}")
+        try:
+            self._apply_at(root, keys, kind, op)
+        except (KeyError, IndexError, ValueError, TypeError, AttributeError) as e:
+            raise InvalidPatch(f"Can't apply {op}: {e}") from None
+
+    def _apply_at(self, root, keys, kind, op):
+        node = root
+        for key in keys[:-1]:
+            if isinstance(node, list):
+                node = node[int(key)]
+            else:
+                node = node.setdefault(key, {})
+        last = keys[-1]
+
+        if isinstance(node, list):
+            if kind == "remove":
+                del node[int(last)]
+            elif last == "-":
+                node.append(op["value"])
+            elif kind == "add":
+                node.insert(int(last), op["value"])
+            else:
+                node[int(last)] = op["value"]
+            return
+
+        if kind == "remove":
+            if "value" in op and isinstance(node.get(last), list):
+                node[last] = [v for v in node[last] if not _same_entry(v, op["value"])]
+            else:
+                node.pop(last, None)
+        elif last == "-":
+            raise InvalidPatch(f"{op['path']} is not a list.")
+        else:
+            node[last] = op["value"]
+
+    def _conflicts(self, ops, base_version):
+        if base_version is None or base_version >= self.version:
+            return set()
+        if self.log and self.log[0][0] > base_version + 1:
+            # Older than the change log: can't prove the delta is safe.
+            return {".".join(_op_target(op)[0]) for op in ops}
+        changed = [(path.split("."), kind) for version, path, kind in self.log if version > base_version]
+        conflicts = set()
+        for op in ops:
+            keys, kind = _op_target(op)
+            for other, other_kind in changed:
+                if _overlaps(keys, other) and not (kind == other_kind == "append"):
+                    conflicts.add(".".join(other))
+        return conflicts
+
+    def apply(self, ops, base_version=None):
+        """
+        Apply ops as one new version. With base_version, ops that overlap changes made
+        after that version raise DraftConflict and nothing is applied. A malformed op
+        raises InvalidPatch and nothing is applied either. Returns the version.
+        """
+        if not ops:
+            return self.version
+        with self.lock:
+            if conflicts := self._conflicts(ops, base_version):
+                clean = [op for op in ops if not any(_overlaps(_op_target(op)[0], c.split(".")) for c in conflicts)]
+                raise DraftConflict(conflicts, clean)
+            # Stage on copies of the sections the ops touch, so a bad op leaves the draft as it was.
+            staged = dict(self.data)
+            copied = set()
+            for op in ops:
+                section = _split(str(op.get("path", "")))[0]
+                if section in staged and section not in copied:
+                    staged[section] = copy.deepcopy(staged[section])
+                    copied.add(section)
+                self._apply_op(staged, op)
+            # Swap in place: self.data is the session's own dict.
+            self.data.clear()
+            self.data.update(staged)
+            self.version += 1
+            for op in ops:
+                keys, kind = _op_target(op)
+                self.log.append((self.version, ".".join(keys), kind))
+            return self.version
+
+    def dirty_since(self, version):
+        """Dotted paths changed after version (sorted), or None if the log no longer reaches back that far."""
+        with self.lock:
+            if version >= self.version:
+                return []
+            if not self.log or self.log[0][0] > version + 1:
+                return None
+            return sorted({path for v, path, _ in self.log if v > version})
+
+    # --- rendering ---
+
+    def compact(self):
+        """Same text as prompt_budget.compact_state(data), re-serializing only sections changed since the last call."""
+        dirty = self.dirty_since(self._rendered_at) if self._rendered else None
+        parts = []
+        for section, value in self.data.items():
+            if section not in self._rendered or dirty is None or any(p == section or p.startswith(section + ".") for p in dirty):
+                self._rendered[section] = prompt_budget.compact_state({section: value})[1:-1]
+            if self._rendered[section]:
+                parts.append(self._rendered[section])
+        self._rendered_at = self.version
+        return "{" + ",".join(parts) + "}"
+
+    def state(self):
+        # JSON-safe version + log for persisting next to the data (sessions).
+        return {"draft_version": self.version, "draft_log": [list(e) for e in self.log]}
+
+
+# --- DELTAS FROM LLM OUTPUT ---
+
+def _contains(entries, value):
+    return any(_same_entry(e, value) for e in entries)
+
+
+def updates_to_ops(updates, current, prefix=""):
+    """Nested LLM "updates" -> ops. Scalars replace; credit lists append only entries not already present."""
+    ops = []
+    for key, value in (updates or {}).items():
+        path = f"{prefix}{key}"
+        existing = current.get(key) if isinstance(current, dict) else None
+        if path in LIST_PATHS and isinstance(value, list):
+            have = list(existing) if isinstance(existing, list) else []
+            if not isinstance(existing, list):
+                ops.append({"op": "replace", "path": path, "value": []})
+            for entry in value:
+                if not _contains(have, entry):
+                    ops.append({"op": "add", "path": path + ".-", "value": entry})
+                    have.append(entry)
+        elif isinstance(value, dict):
+            ops += updates_to_ops(value, existing if isinstance(existing, dict) else {}, path + ".")
+        elif value != existing:
+            ops.append({"op": "replace", "path": path, "value": value})
+    return ops
+
+
+def fields_to_ops(fields, current):
+    """Flat release_tool arguments (release_title, composers, ...) -> ops on the nested draft schema."""
+    updates = {}
+    for name, value in (fields or {}).items():
+        if name == "release_date_mode":
+            # "SPECIFIC" only says a specific_date follows; "ASAP" is the date itself.
+            name = "release_date" if value == "ASAP" else None
+        path = batch.COLUMN_MAP.get(name) or TOOL_FIELDS.get(name)
+        if path is None:
+            continue
+        node = updates
+        keys = path.split(".")
+        for key in keys[:-1]:
+            node = node.setdefault(key, {})
+        node[keys[-1]] = batch.convert_value(path, value)
+    return updates_to_ops(updates, current)
@@ -0,0 +1,196 @@
+import atexit
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+import album
+
+# --- DURABLE DRAFTS (SQLite, write-behind) ---
+# Each draft snapshot (draft, version + change log, transcript) is serialized and queued.
+# The caller returns right away, and one writer thread flushes the queue to SQLite (WAL)
+# in a single transaction per batch. Snapshots are coalesced per draft id, so several
+# turns inside one flush window become one row write. load() checks the queue first,
+# so a resume right after a save sees it.
+# A draft is "complete" once album.validate() (singles and albums alike) finds no issues. That check
+# also runs on the writer, off the request path.
+#
+# Table drafts: id, draft, version, log, transcript (JSON), status, created, updated
+# Used by sessions.SessionStore (SESSION_DB) and the Streamlit app (DRAFT_DB).
+
+FLUSH_INTERVAL = float(os.getenv("DRAFT_FLUSH_INTERVAL", "0.25"))  # seconds a snapshot may wait
+MAX_BATCH = 500      # queued drafts that trigger an early flush
+EXPORT_CHUNK = 500   # rows fetched per round trip while exporting
+
+DEFAULT_DB = os.path.join(tempfile.gettempdir(), "distro_drafts.sqlite")
+
+_UPSERT = (
+    "INSERT INTO drafts (id, draft, version, log, transcript, status, created, updated) VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+    "ON CONFLICT(id) DO UPDATE SET draft = excluded.draft, version = excluded.version, log = excluded.log, "
+    "transcript = excluded.transcript, status = excluded.status, updated = excluded.updated "
+    "WHERE excluded.updated >= drafts.updated"
+)
+
+
+def _dumps(value):
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False, default=str)
+
+
+def _status(draft_json):
+    try:
+        return "in_progress" if album.validate(json.loads(draft_json)) else "complete"
+    except (TypeError, ValueError, AttributeError):
+        return "in_progress"
+
+
+class DraftStore:
+    def __init__(self, db_path, flush_interval=FLUSH_INTERVAL, max_batch=MAX_BATCH):
+        self.db_path = db_path
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.pending = OrderedDict()  # draft id -> snapshot row, newest wins
+        self.flushing = {}            # batch currently being written (still visible to load())
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.wake = threading.Event()
+        self.counters = {"saves": 0, "coalesced": 0, "flushes": 0, "rows_written": 0, "errors": 0}
+        self._db_local = threading.local()
+        self._writer = None
+        with self._db() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS drafts (id TEXT PRIMARY KEY, draft TEXT NOT NULL, version INTEGER NOT NULL, "
+                "log TEXT, transcript TEXT, status TEXT NOT NULL, created REAL NOT NULL, updated REAL NOT NULL)")
+            db.execute("CREATE INDEX IF NOT EXISTS drafts_status_updated ON drafts (status, updated)")
+        atexit.register(self.flush)
+
+    # --- sqlite (one connection per thread) ---
+
+    def _db(self):
+        db = getattr(self._db_local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.db_path, timeout=10)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._db_local.db = db
+        return db
+
+    # --- write-behind queue ---
+
+    def save(self, draft_id, draft, transcript=None, version=0, log=None):
+        """Queue a snapshot; never touches the disk on the caller's thread."""
+        now = time.time()
+        row = (draft_id, _dumps(draft), version, _dumps(log or []), _dumps(transcript or []), now)
+        with self.lock:
+            self.counters["saves"] += 1
+            if self.pending.pop(draft_id, None) is not None:
+                self.counters["coalesced"] += 1
+            self.pending[draft_id] = row
+            full = len(self.pending) >= self.max_batch
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._run, name="draft-writer", daemon=True)
+                self._writer.start()
+        if full:
+            self.wake.set()
+
+    def _run(self):
+        while True:
+            self.wake.wait(self.flush_interval)
+            self.wake.clear()
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                print(f"⚠️ Draft flush failed: {e}")
+
+    def flush(self):
+        """Write everything queued so far in one transaction. Safe to call from any thread."""
+        with self.flush_lock:
+            with self.lock:
+                if not self.pending:
+                    return 0
+                batch, self.pending = self.pending, OrderedDict()
+                self.flushing = batch
+            rows = [(i, d, v, log, t, _status(d), updated, updated) for i, d, v, log, t, updated in batch.values()]
+            try:
+                with self._db() as db:
+                    db.executemany(_UPSERT, rows)
+            except sqlite3.Error:
+                with self.lock:
+                    # Put the batch back under anything newer that arrived meanwhile.
+                    for draft_id, row in batch.items():
+                        self.pending.setdefault(draft_id, row)
+                    self.flushing = {}
+                    self.counters["errors"] += 1
+                raise
+            with self.lock:
+                self.flushing = {}
+                self.counters["flushes"] += 1
+                self.counters["rows_written"] += len(rows)
+            return len(rows)
+
+    # --- reads ---
+
+    def load(self, draft_id):
+        """Latest snapshot for draft_id (queued or on disk), or None."""
+        with self.lock:
+            row = self.pending.get(draft_id) or self.flushing.get(draft_id)
+        if row is not None:
+            _, draft, version, log, transcript, updated = row
+            status = None  # decided when it is written
+        else:
+            found = self._db().execute(
+                "SELECT draft, version, log, transcript, status, updated FROM drafts WHERE id = ?", (draft_id,)).fetchone()
+            if found is None:
+                return None
+            draft, version, log, transcript, status, updated = found
+        return {"id": draft_id, "draft": json.loads(draft), "version": version, "log": json.loads(log or "[]"),
+                "transcript": json.loads(transcript or "[]"), "status": status, "updated": updated}
+
+    def delete(self, draft_id):
+        # Under flush_lock, so a batch being written can't upsert the draft again after the DELETE.
+        with self.flush_lock:
+            with self.lock:
+                self.pending.pop(draft_id, None)
+            with self._db() as db:
+                db.execute("DELETE FROM drafts WHERE id = ?", (draft_id,))
+
+    def export(self, status="complete", since=0.0):
+        """Stream drafts with this status (None = all), oldest update first, a chunk of rows at a time."""
+        self.flush()
+        db = sqlite3.connect(self.db_path, timeout=10)  # own connection: the generator may outlive the request thread
+        try:
+            sql = "SELECT id, draft, version, transcript, status, updated FROM drafts WHERE updated >= ?"
+            params = [since]
+            if status:
+                sql += " AND status = ?"
+                params.append(status)
+            cursor = db.execute(sql + " ORDER BY updated", params)
+            while rows := cursor.fetchmany(EXPORT_CHUNK):
+                for draft_id, draft, version, transcript, row_status, updated in rows:
+                    yield {"id": draft_id, "status": row_status, "version": version, "updated": updated,
+                           "draft": json.loads(draft), "transcript": json.loads(transcript or "[]")}
+        finally:
+            db.close()
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters, pending=len(self.pending))
+
+
+def to_ndjson(drafts):
+    for draft in drafts:
+        yield json.dumps(draft, ensure_ascii=False) + "\n"
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+def get_store(db_path=None):
+    # One store (and writer thread) per database file per process.
+    db_path = db_path or os.getenv("DRAFT_DB") or DEFAULT_DB
+    with _stores_lock:
+        if db_path not in _stores:
+            _stores[db_path] = DraftStore(db_path)
+        return _stores[db_path]
@@ -0,0 +1,319 @@
+import re
+from datetime import date
+
+# --- 1. RULE TABLE ---
+# Local copy of section 3 ("VALIDATION RULES") of AGENT_SYSTEM_PROMPT in distrov2.py.
+# Anything these rules can reject for certain is answered here, without a provider call.
+# Anything ambiguous returns None so the caller escalates to the LLM as before.
+
+FORBIDDEN_NAME_CHARS = "(){}[]\\/!@#$%^&*+="
+FORBIDDEN_NAME_WORDS = ("feat", "prod", "artist", "unknown", "beats")
+FORBIDDEN_TITLE_WORDS = ("feat", "ft", "produced by", "prod", "official")
+FORBIDDEN_VERSION_WORDS = ("original", "album", "explicit")
+VERSION_TYPES = (
+    "Alternate Take", "Instrumental", "Radio Edit", "Extended", "Remastered", "Sped Up",
+    "Slowed Down", "Lo-Fi", "Acapella", "Acoustic", "Deluxe", "Demo", "Freestyle",
+    "Karaoke", "Live", "Remix", "Slowed and Reverb", "Other",
+)
+MIN_YEAR = 1900
+
+# Schema path -> (rule kind, label used in the reply)
+FIELD_RULES = {
+    "release.title": ("title", "release title"),
+    "release.version.custom_text": ("custom_version", "version"),
+    "release.version.remaster_year": ("remaster_year", "original release year"),
+    "track.released_before.original_year": ("released_year", "year of the original recording"),
+    "track.credits.composers": ("names", "composer"),
+    "track.credits.performers": ("names", "performer"),
+    "track.credits.production": ("names", "producer"),
+    "track.credits.contributors": ("names", "contributor"),
+    "track.lyrics.lyricist": ("names", "lyricist"),
+}
+
+# Last assistant question -> schema path it is asking for. Cues are only matched against
+# the final question sentence, and a question that cues more than one field is left to the LLM.
+QUESTION_CUES = [
+    (re.compile(r"year of (?:the )?original recording|released before.*\byear\b", re.I), "track.released_before.original_year"),
+    (re.compile(r"original release year|year of the original release|remaster", re.I), "release.version.remaster_year"),
+    (re.compile(r"type the version|custom version|name of the version", re.I), "release.version.custom_text"),
+    (re.compile(r"lyricist", re.I), "track.lyrics.lyricist"),
+    (re.compile(r"compos|who wrote", re.I), "track.credits.composers"),
+    (re.compile(r"perform|played instruments|who sang", re.I), "track.credits.performers"),
+    (re.compile(r"\b(?:produc\w*|mix(?:ed)?|mastered)\b", re.I), "track.credits.production"),  # \b keeps "Remastered" out
+    (re.compile(r"contributor", re.I), "track.credits.contributors"),
+    (re.compile(r"release title|name of (?:your|the) song|song title|what is the title", re.I), "release.title"),
+]
+
+# --- 2. PRECOMPILED PATTERNS ---
+
+_NAME_CHARS_RE = re.compile("[" + re.escape(FORBIDDEN_NAME_CHARS) + "]")
+_NAME_WORDS_RE = re.compile(r"\b(" + "|".join(FORBIDDEN_NAME_WORDS) + r")\b", re.I)
+_TITLE_WORDS_RE = re.compile(r"(?<!\w)(" + "|".join(re.escape(w) for w in FORBIDDEN_TITLE_WORDS) + r")(?!\w)\.?", re.I)
+_VERSION_WORDS_RE = re.compile(r"\b(" + "|".join(FORBIDDEN_VERSION_WORDS) + r")\b", re.I)
+_EMOJI_RE = re.compile("[\U0001F000-\U0001FAFF\u2600-\u27BF\u2B00-\u2BFF\uFE0F]")
+_YEAR_RE = re.compile(r"\b(\d{4})\b")
+_NAME_SPLIT_RE = re.compile(r"\s*(?:,|;|\band\b|\s&\s)\s*", re.I)
+_ROLE_SUFFIX_RE = re.compile(r"\s*(?:\(|:|\s[-–]\s|\bon\b|\bas\b|\bplayed\b|\bdid\b).*$", re.I)
+_LEAD_IN_RE = re.compile(
+    r"^(?:it'?s|it is|it was|that'?s|that is|the \w+ (?:is|was|are|were)|"
+    r"(?:written|composed|produced|performed|mixed|mastered) by|title:?|called)\s+", re.I)
+_QUOTES_RE = re.compile(r"^[\"'“”‘’]+|[\"'“”‘’.!]+$")
+# Conversational replies ("yes", "just me", "I did everything", questions) need the LLM.
+_ESCALATE_RE = re.compile(
+    r"\?|\b(?:i|i'm|im|me|my|myself|mine|we|us|our|yes|yeah|yep|no|nope|not|sure|ok|okay|"
+    r"correct|same|skip|none|nobody|instrumental|wait|what|why|how)\b", re.I)
+
+
+# --- 3. FIELD VALIDATORS ---
+# Each returns an error message (str) or None when the value passes.
+
+def validate_legal_name(name, label="composer"):
+    if _EMOJI_RE.search(name):
+        return f"'{name}' contains an emoji. The {label} must be a **Legal First and Last Name**."
+    if m := _NAME_CHARS_RE.search(name):
+        return f"'{name}' contains `{m.group(0)}`, which DSPs don't allow in credit names. Please send the {label}'s **Legal First and Last Name**."
+    if m := _NAME_WORDS_RE.search(name):
+        return f"'{name}' contains the word \"{m.group(1)}\". Credits must be a real person's **Legal First and Last Name**, not a role or alias."
+    if len(name.split()) < 2:
+        return f"I need the **Legal First and Last Name** for the {label} (e.g. 'John Doe'). Single names like '{name}' are not accepted for publishing."
+    return None
+
+
+def validate_title(title, label="release title"):
+    if _EMOJI_RE.search(title):
+        return f"Emojis aren't allowed in the {label} on Spotify/Apple. What is the title without them?"
+    if m := _TITLE_WORDS_RE.search(title):
+        word = m.group(1)
+        if word.lower() in ("feat", "ft"):
+            return f"The {label} can't contain \"{word}\". Featured artists go in the artist credits instead. What is the title on its own?"
+        return f"The {label} can't contain \"{word}\" (DSP rule). What is the title without it?"
+    return None
+
+
+def validate_custom_version(text):
+    if m := _VERSION_WORDS_RE.search(text):
+        return f"Custom versions can't use the word \"{m.group(1)}\". Try something descriptive like 'Club Mix'."
+    if _EMOJI_RE.search(text):
+        return "Emojis aren't allowed in the version text. Try something descriptive like 'Club Mix'."
+    return None
+
+
+def validate_year(year, max_year, label="year"):
+    if year < MIN_YEAR or year > max_year:
+        return f"The {label} must be between **{MIN_YEAR}** and **{max_year}**. Could you double-check it?"
+    return None
+
+
+# --- 4. REPLY CHECK ---
+
+def asked_question(message):
+    # "Great, composer saved! What is the primary genre?" -> "What is the primary genre?"
+    end = (message or "").rfind("?")
+    if end < 0:
+        return None
+    start = max(message.rfind(mark, 0, end) for mark in ".!?\n") + 1
+    return message[start:end + 1].strip()
+
+
+def field_for_question(question):
+    sentence = asked_question(question)
+    if not sentence:
+        return None
+    paths = {path for pattern, path in QUESTION_CUES if pattern.search(sentence)}
+    return paths.pop() if len(paths) == 1 else None
+
+
+def clean_reply(text):
+    # "It's called 'Empire'." -> "Empire"
+    return _QUOTES_RE.sub("", _LEAD_IN_RE.sub("", text.strip())).strip()
+
+
+def is_conversational(reply):
+    return bool(_ESCALATE_RE.search(reply))
+
+
+def split_names(reply):
+    # "John Doe, Jane Roe and Max Mustermann" -> ["John Doe", "Jane Roe", "Max Mustermann"]
+    return [part.strip() for part in _NAME_SPLIT_RE.split(clean_reply(reply)) if part.strip()]
+
+
+def check_field(path, reply):
+    """Validate a bare reply for one schema field. Returns an error message, or None if it passes/needs the LLM."""
+    kind, label = FIELD_RULES[path]
+    current_year = date.today().year
+
+    if kind in ("remaster_year", "released_year"):
+        m = _YEAR_RE.search(reply)
+        if not m:
+            return None
+        max_year = current_year if kind == "remaster_year" else current_year - 1
+        return validate_year(int(m.group(1)), max_year, label)
+
+    if is_conversational(reply):
+        return None
+
+    if kind == "title":
+        return validate_title(clean_reply(reply), label)
+
+    if kind == "custom_version":
+        return validate_custom_version(clean_reply(reply))
+
+    if kind == "names":
+        for part in split_names(reply):
+            name = _ROLE_SUFFIX_RE.sub("", part).strip() if path != "track.credits.composers" else part
+            if not name:
+                continue
+            if error := validate_legal_name(name, label):
+                return error
+    return None
+
+
+def precheck(question, reply):
+    """
+    Run the local rules against the user's reply to the last assistant question.
+    Returns a normalized {"response", "updates"} result when the reply is rejected,
+    or None when the reply passes and should be escalated to the LLM.
+    """
+    if not reply:
+        return None
+    path = field_for_question(question)
+    if path is None:
+        return None
+    error = check_field(path, reply)
+    if error is None:
+        return None
+    return {"response": error, "updates": {}, "source": "rules", "field": path}
+
+
+def last_assistant_message(messages, role_key="role", text_key="content", user_role="user"):
+    for msg in reversed(messages):
+        if msg.get(role_key) != user_role:
+            return msg.get(text_key)
+    return None
+
+
+# --- 5. WHOLE-DRAFT CHECK ---
+# Same rules applied to a complete draft (bulk ingestion, album tracks). Returns a list of
+# (schema path, message) issues; an empty list means the draft is ready to submit.
+
+_DATE_RE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+NAME_LIST_PATHS = (
+    ("track.credits.composers", True),
+    ("track.credits.performers", True),
+    ("track.credits.production", True),
+    ("track.credits.contributors", False),
+)
+
+
+def get_path(data, path, default=None):
+    for key in path.split("."):
+        if not isinstance(data, dict) or key not in data:
+            return default
+        data = data[key]
+    return data
+
+
+def _credit_name(entry):
+    return entry.get("name", "") if isinstance(entry, dict) else str(entry)
+
+
+def _did_you_mean(kind, value):
+    import normalize  # NumPy-backed index, only loaded once a whole draft is checked
+    suggestions = normalize.get_index(kind).lookup(value)["suggestions"]
+    return f" Did you mean **{' / '.join(suggestions)}**?" if suggestions else ""
+
+
+def _vocabulary_issue(kind, value, label):
+    # Genre/language must be one of the normalize.py vocabularies; suggest the closest.
+    import normalize
+    if value in normalize.get_index(kind).canonical:
+        return None
+    return f"'{value}' isn't a recognised {label}.{_did_you_mean(kind, value)}"
+
+
+def validate_draft(draft):
+    issues = []
+    current_year = date.today().year
+
+    title = get_path(draft, "release.title")
+    if not title:
+        issues.append(("release.title", "The release title is missing."))
+    elif error := validate_title(title):
+        issues.append(("release.title", error))
+
+    genre = get_path(draft, "release.genre")
+    if not genre:
+        issues.append(("release.genre", "The genre is missing."))
+    elif error := _vocabulary_issue("genre", genre, "DSP genre"):
+        issues.append(("release.genre", error))
+
+    release_date = get_path(draft, "release.date")
+    if release_date and release_date != "ASAP" and not _DATE_RE.match(str(release_date)):
+        issues.append(("release.date", "The release date must be 'ASAP' or YYYY-MM-DD."))
+
+    version = get_path(draft, "release.version.type") or "Original"
+    if version != "Original":
+        known = {v.lower(): v for v in VERSION_TYPES}
+        version = known.get(version.lower())
+        if version is None:
+            hint = _did_you_mean("version", get_path(draft, "release.version.type"))
+            issues.append(("release.version.type", "Please pick a version from the list: " + ", ".join(VERSION_TYPES) + "." + hint))
+        elif version == "Remastered":
+            year = get_path(draft, "release.version.remaster_year")
+            if not year:
+                issues.append(("release.version.remaster_year", "Remastered releases need the Original Release Year."))
+            elif error := validate_year(int(year), current_year, "original release year"):
+                issues.append(("release.version.remaster_year", error))
+        elif version == "Remix" and not get_path(draft, "release.version.remix_confirmed"):
+            issues.append(("release.version.remix_confirmed", "Please confirm you have the rights to remix this track."))
+        elif version == "Other":
+            text = get_path(draft, "release.version.custom_text")
+            if not text:
+                issues.append(("release.version.custom_text", "Please type the version (e.g. 'Club Mix')."))
+            elif error := validate_custom_version(text):
+                issues.append(("release.version.custom_text", error))
+
+    if get_path(draft, "track.released_before.status"):
+        year = get_path(draft, "track.released_before.original_year")
+        if not year:
+            issues.append(("track.released_before.original_year", "Released-before tracks need the Year of Original Recording."))
+        elif error := validate_year(int(year), current_year - 1, "year of the original recording"):
+            issues.append(("track.released_before.original_year", error))
+
+    for path, required in NAME_LIST_PATHS:
+        entries = get_path(draft, path) or []
+        label = FIELD_RULES[path][1]
+        if required and not entries:
+            issues.append((path, f"At least one {label} (Legal First and Last Name) is required."))
+        for entry in entries:
+            if error := validate_legal_name(_credit_name(entry), label):
+                issues.append((path, error))
+
+    language = get_path(draft, "track.lyrics.language")
+    if not language:
+        issues.append(("track.lyrics.language", "The lyrics language (or Instrumental) is missing."))
+    elif error := _vocabulary_issue("language", language, "lyrics language"):
+        issues.append(("track.lyrics.language", error))
+    elif language.lower() != "instrumental":
+        if not get_path(draft, "track.lyrics.explicit_rating"):
+            issues.append(("track.lyrics.explicit_rating", "Is the content Explicit, Clean, or Non-Explicit?"))
+        lyricists = get_path(draft, "track.lyrics.lyricist") or []
+        if not lyricists:
+            issues.append(("track.lyrics.lyricist", "At least one lyricist (Legal First and Last Name) is required."))
+        for entry in lyricists:
+            if error := validate_legal_name(_credit_name(entry), "lyricist"):
+                issues.append(("track.lyrics.lyricist", error))
+
+    return issues
+
+
+# Fields every single needs; completeness() says how far a submission has got.
+PROGRESS_PATHS = (
+    "release.title", "release.genre", "release.date", "track.credits.composers", "track.credits.performers",
+    "track.credits.production", "track.lyrics.language", "assets.cover_status", "assets.audio_status",
+)
+
+
+def completeness(draft):
+    """Share of PROGRESS_PATHS filled in, 0.0 (new conversation) to 1.0."""
+    return sum(1 for path in PROGRESS_PATHS if get_path(draft, path)) / len(PROGRESS_PATHS)
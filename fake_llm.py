@@ -0,0 +1,101 @@
+import asyncio
+import random
+import re
+import threading
+import time
+
+from google.api_core import exceptions
+
+# --- OFFLINE FAKE GEMINI MODEL ---
+# Drop-in stand-in for the genai.GenerativeModel used by agent_api.py (start_chat ->
+# send_message / send_message_async, plain or streamed). Latency, 429s and errors are
+# injected at configurable rates so /chat can be load tested without a network.
+# router.FakeProvider plays the same role for distrov2's call_llm path.
+
+_TITLE_RE = re.compile(r"(?:called|title is|song is)\s+['\"]?([^'\",.]+)", re.I)
+
+
+class FakeFunctionCall:
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+
+
+class FakePart:
+    def __init__(self, text="", function_call=None):
+        self.text = text
+        self.function_call = function_call
+
+
+class FakeResponse:
+    def __init__(self, parts):
+        self.parts = parts
+
+    @property
+    def text(self):
+        return "".join(p.text for p in self.parts)
+
+
+class FakeGeminiModel:
+    def __init__(self, latency=(0.05, 0.2), rate_limit_rate=0.0, error_rate=0.0, chunk_words=3):
+        self.latency = latency if isinstance(latency, tuple) else (latency, latency)
+        self.rate_limit_rate = rate_limit_rate
+        self.error_rate = error_rate
+        self.chunk_words = chunk_words
+        self.calls = 0
+        self.upstream_seconds = []
+        self.lock = threading.Lock()
+
+    def start_chat(self, history=None):
+        return FakeChat(self, history or [])
+
+    def _reply(self, prompt):
+        message = prompt.rsplit("USER MESSAGE:", 1)[-1].strip()
+        parts = [FakePart(f"Thanks! Noted: {message[:60]}. What is the primary genre?")]
+        if m := _TITLE_RE.search(message):
+            parts.append(FakePart(function_call=FakeFunctionCall("update_release_draft", {"release_title": m.group(1).strip()})))
+        return parts
+
+    def _roll(self):
+        # Same failure shapes as the real SDK: 429 -> ResourceExhausted with a retry hint.
+        roll = random.random()
+        if roll < self.rate_limit_rate:
+            raise exceptions.ResourceExhausted("Quota exceeded. Please retry in 1s.")
+        if roll < self.rate_limit_rate + self.error_rate:
+            raise exceptions.InternalServerError("Injected upstream error.")
+
+    def _record(self, seconds):
+        with self.lock:
+            self.calls += 1
+            self.upstream_seconds.append(seconds)
+
+
+class FakeChat:
+    def __init__(self, model, history):
+        self.model = model
+        self.history = history
+
+    def send_message(self, prompt, stream=False):
+        start = time.perf_counter()
+        time.sleep(random.uniform(*self.model.latency))
+        self.model._record(time.perf_counter() - start)
+        self.model._roll()
+        parts = self.model._reply(prompt)
+        if not stream:
+            return FakeResponse(parts)
+        return self._chunks(parts)
+
+    def _chunks(self, parts):
+        words = parts[0].text.split(" ")
+        n = self.model.chunk_words
+        for i in range(0, len(words), n):
+            yield FakeResponse([FakePart(" ".join(words[i:i + n]) + (" " if i + n < len(words) else ""))])
+        for part in parts[1:]:
+            yield FakeResponse([part])
+
+    async def send_message_async(self, prompt, stream=False):
+        start = time.perf_counter()
+        await asyncio.sleep(random.uniform(*self.model.latency))
+        self.model._record(time.perf_counter() - start)
+        self.model._roll()
+        return FakeResponse(self.model._reply(prompt))
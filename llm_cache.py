@@ -0,0 +1,173 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# --- LLM RESPONSE CACHE ---
+# Sits in front of every provider call. The key is a digest of the normalized
+# (system prompt hash, draft state, recent turns, user message), so the same
+# question asked from the same state is answered without a provider round trip.
+# Tier 1 is an in-memory LRU; tier 2 (optional) is a SQLite file shared across
+# processes and restarts. Both tiers honour the TTL and are size bounded.
+
+DB_TRIM_EVERY = 512  # puts between SQLite expiry/row-cap sweeps (the cap may overshoot by this much)
+
+_SPACE_RE = re.compile(r"\s+")
+_EDGE_PUNCT_RE = re.compile(r"^[\s\"'“”‘’.,!?]+|[\s\"'“”‘’.,!?]+$")
+
+def normalize_text(text):
+    return _EDGE_PUNCT_RE.sub("", _SPACE_RE.sub(" ", (text or "").lower()))
+
+
+def make_key(system_prompt, draft, recent_turns, user_message):
+    prompt_hash = hashlib.sha256((system_prompt or "").encode()).hexdigest()
+    turns = [[t.get("role"), normalize_text(t.get("content", t.get("text", "")))] for t in recent_turns]
+    material = json.dumps(
+        [prompt_hash, draft or {}, turns, normalize_text(user_message)],
+        sort_keys=True, separators=(",", ":"), default=str,
+    )
+    return hashlib.sha256(material.encode()).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, max_entries=2000, max_bytes=16 * 1024 * 1024, ttl=86400, db_path=None, max_db_rows=100000):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.max_db_rows = max_db_rows
+        self.entries = OrderedDict()  # key -> (expires_at, size, value)
+        self.bytes_held = 0
+        self.lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "memory_hits": 0, "disk_hits": 0, "evictions": 0, "bypassed": 0}
+        self.db_path = db_path
+        self._db_local = threading.local()
+        self._db_puts = 0  # since the last trim
+        if db_path:
+            with self._db() as db:
+                db.execute("CREATE TABLE IF NOT EXISTS llm_cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)")
+                db.execute("CREATE INDEX IF NOT EXISTS llm_cache_expires ON llm_cache (expires_at)")
+
+    # --- sqlite tier (one connection per thread) ---
+
+    def _db(self):
+        db = getattr(self._db_local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.db_path, timeout=5)
+            db.execute("PRAGMA journal_mode=WAL")
+            self._db_local.db = db
+        return db
+
+    def _db_get(self, key, now):
+        row = self._db().execute("SELECT value, expires_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+        if row is None or row[1] < now:
+            return None
+        return json.loads(row[0]), row[1]
+
+    def _db_put(self, key, value, expires_at):
+        with self._db() as db:
+            db.execute("INSERT OR REPLACE INTO llm_cache (key, value, expires_at) VALUES (?, ?, ?)", (key, value, expires_at))
+        with self.lock:
+            self._db_puts += 1
+            trim = self._db_puts >= DB_TRIM_EVERY
+            if trim:
+                self._db_puts = 0
+        if trim:
+            self._db_trim()
+
+    def _db_trim(self):
+        # The count(*) is O(rows), so this runs every DB_TRIM_EVERY puts, not on each one.
+        with self._db() as db:
+            db.execute("DELETE FROM llm_cache WHERE expires_at < ?", (time.time(),))
+            # Size bound: drop the entries closest to expiry once over the row cap.
+            db.execute(
+                "DELETE FROM llm_cache WHERE key IN (SELECT key FROM llm_cache ORDER BY expires_at LIMIT "
+                "max(0, (SELECT count(*) FROM llm_cache) - ?))", (self.max_db_rows,))
+
+    # --- memory tier ---
+
+    def _mem_put(self, key, value, size, expires_at):
+        if key in self.entries:
+            self.bytes_held -= self.entries.pop(key)[1]
+        self.entries[key] = (expires_at, size, value)
+        self.bytes_held += size
+        while len(self.entries) > self.max_entries or self.bytes_held > self.max_bytes:
+            _, (_, old_size, _) = self.entries.popitem(last=False)
+            self.bytes_held -= old_size
+            self.counters["evictions"] += 1
+
+    # --- public API ---
+
+    def get(self, key, bypass=False):
+        if bypass:
+            with self.lock:
+                self.counters["bypassed"] += 1
+            return None
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] >= now:
+                self.entries.move_to_end(key)
+                self.counters["hits"] += 1
+                self.counters["memory_hits"] += 1
+                return json.loads(entry[2])
+            if entry is not None:
+                self.bytes_held -= self.entries.pop(key)[1]
+        if self.db_path and (found := self._db_get(key, now)):
+            value, expires_at = found
+            raw = json.dumps(value)
+            with self.lock:
+                self._mem_put(key, raw, len(raw), expires_at)
+                self.counters["hits"] += 1
+                self.counters["disk_hits"] += 1
+            return value
+        with self.lock:
+            self.counters["misses"] += 1
+        return None
+
+    def put(self, key, value, bypass=False):
+        if bypass:
+            return
+        # Stored as JSON text so cached dicts can't be mutated by callers.
+        raw = json.dumps(value)
+        expires_at = time.time() + self.ttl
+        with self.lock:
+            self._mem_put(key, raw, len(raw), expires_at)
+        if self.db_path:
+            self._db_put(key, raw, expires_at)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes_held = 0
+        if self.db_path:
+            with self._db() as db:
+                db.execute("DELETE FROM llm_cache")
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters, entries=len(self.entries), bytes_held=self.bytes_held)
+
+
+def bypass_from_env():
+    return os.getenv("LLM_CACHE_BYPASS", "").lower() in ("1", "true", "yes")
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_cache():
+    # Process-wide singleton: survives Streamlit reruns and is shared by Flask threads.
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache(
+                max_entries=int(os.getenv("LLM_CACHE_MAX", "2000")),
+                max_bytes=int(os.getenv("LLM_CACHE_MAX_BYTES", str(16 * 1024 * 1024))),
+                ttl=float(os.getenv("LLM_CACHE_TTL", "86400")),
+                db_path=os.getenv("LLM_CACHE_DB") or None,
+            )
+        return _cache
@@ -0,0 +1,222 @@
+import contextvars
+import os
+import threading
+import time
+from bisect import bisect_left
+
+# --- TIMING SPANS & PROMETHEUS METRICS ---
+# span(stage, **labels) times one step of a turn (prompt build, provider call, parse,
+# draft merge, ...). Every span feeds the process-wide distro_stage_seconds histogram
+# (served as Prometheus text by /metrics) and, when collect() is active, the
+# per-request timing list shown in the Streamlit sidebar.
+#
+# METRICS_ENABLED=0 turns the process-wide registry off. span() then returns a shared
+# no-op object unless a collect() is running, so an instrumented call costs one flag
+# check and one context-var lookup.
+
+ENABLED = os.getenv("METRICS_ENABLED", "1") != "0"
+PREFIX = "distro_"
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+HELP = {
+    "stage_seconds": ("histogram", "Time spent per pipeline stage."),
+    "http_requests_total": ("counter", "HTTP requests by route and status."),
+    "llm_tokens_total": ("counter", "LLM tokens by provider and direction (input/output; cached_input is the part of input served from the provider's prompt cache)."),
+    "prompt_tokens_total": ("counter", "Estimated prompt tokens sent per turn (input; static_prefix is the part held in the model's cached prefix)."),
+    "prompt_trimmed_messages_total": ("counter", "Older history messages dropped to fit the prompt token budget."),
+    "llm_retries_total": ("counter", "Provider calls retried after a rate limit."),
+    "llm_backoff_seconds_total": ("counter", "Seconds slept in retry backoff."),
+    "rate_limit_wait_seconds_total": ("counter", "Seconds waited on the local token bucket."),
+    "admission_total": ("counter", "Provider calls by admission outcome (admitted, queued, shed, timeout)."),
+    "admission_wait_seconds": ("histogram", "Time spent queued for a provider slot."),
+    "admission_queue_depth": ("gauge", "Requests waiting for a provider slot."),
+    "admission_in_flight": ("gauge", "Provider calls currently admitted."),
+}
+
+_trace = contextvars.ContextVar("metrics_trace", default=None)
+
+
+class Registry:
+    def __init__(self):
+        self.histograms = {}  # (name, labels) -> [bucket counts..., sum, count]
+        self.counters = {}    # (name, labels) -> value
+        self.gauges = {}      # (name, labels) -> value
+        self.lock = threading.Lock()
+
+    def observe(self, name, value, labels):
+        key = (name, labels)
+        with self.lock:
+            h = self.histograms.get(key)
+            if h is None:
+                h = self.histograms[key] = [0] * len(BUCKETS) + [0.0, 0]
+            i = bisect_left(BUCKETS, value)
+            if i < len(BUCKETS):
+                h[i] += 1
+            h[-2] += value
+            h[-1] += 1
+
+    def inc(self, name, value, labels):
+        key = (name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, labels):
+        with self.lock:
+            self.gauges[(name, labels)] = value
+
+    def render(self):
+        with self.lock:
+            histograms = {k: list(v) for k, v in self.histograms.items()}
+            counters = dict(self.counters)
+            counters.update(self.gauges)
+        lines = []
+        for name in sorted({n for n, _ in histograms} | {n for n, _ in counters}):
+            kind, text = HELP.get(name, ("counter", name))
+            lines += [f"# HELP {PREFIX}{name} {text}", f"# TYPE {PREFIX}{name} {kind}"]
+            for (n, labels), h in sorted(histograms.items()):
+                if n != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(BUCKETS, h):
+                    cumulative += count
+                    lines.append(f"{PREFIX}{name}_bucket{_labels(labels + (('le', repr(bound)),))} {cumulative}")
+                lines.append(f"{PREFIX}{name}_bucket{_labels(labels + (('le', '+Inf'),))} {h[-1]}")
+                lines.append(f"{PREFIX}{name}_sum{_labels(labels)} {h[-2]:.6f}")
+                lines.append(f"{PREFIX}{name}_count{_labels(labels)} {h[-1]}")
+            for (n, labels), value in sorted(counters.items()):
+                if n == name:
+                    lines.append(f"{PREFIX}{name}{_labels(labels)} {value:g}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+
+registry = Registry()
+
+
+# --- SPANS ---
+
+class _Span:
+    __slots__ = ("stage", "labels", "start")
+
+    def __init__(self, stage, labels):
+        self.stage = stage
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self.start
+        if ENABLED:
+            registry.observe("stage_seconds", seconds, (("stage", self.stage),) + self.labels)
+        trace = _trace.get()
+        if trace is not None:
+            name = self.stage + "".join(f" [{v}]" for _, v in self.labels)
+            trace["spans"].append((name, seconds))
+        return False
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP = _NoopSpan()
+
+
+def span(stage, **labels):
+    if not ENABLED and _trace.get() is None:
+        return _NOOP
+    return _Span(stage, tuple(sorted(labels.items())))
+
+
+def inc(name, value=1, **labels):
+    if ENABLED:
+        registry.inc(name, value, tuple(sorted(labels.items())))
+    trace = _trace.get()
+    if trace is not None:
+        key = name + "".join(f" [{v}]" for _, v in sorted(labels.items()))
+        trace["counts"][key] = trace["counts"].get(key, 0) + value
+
+
+def observe(name, value, **labels):
+    # A value for a histogram other than stage_seconds (e.g. admission_wait_seconds).
+    if ENABLED:
+        registry.observe(name, value, tuple(sorted(labels.items())))
+
+
+def gauge(name, value, **labels):
+    if ENABLED:
+        registry.set(name, value, tuple(sorted(labels.items())))
+
+
+class collect:
+    """
+    with collect() as timings: ... -> timings == {"spans": [(stage, seconds)], "counts": {name: n}}
+    for every span/inc in this thread or task. collect(False) yields None and records nothing.
+    """
+
+    def __init__(self, active=True):
+        self.active = active
+
+    def __enter__(self):
+        if not self.active:
+            return None
+        self.trace = {"spans": [], "counts": {}}
+        self.token = _trace.set(self.trace)
+        return self.trace
+
+    def __exit__(self, *exc):
+        if self.active:
+            _trace.reset(self.token)
+        return False
+
+
+# --- TOKEN USAGE ---
+
+def usage_tokens(response):
+    """(input, output) token counts reported by the provider, or None if it didn't report any."""
+    # Gemini: usage_metadata.prompt_token_count / candidates_token_count
+    if usage := getattr(response, "usage_metadata", None):
+        return getattr(usage, "prompt_token_count", 0) or 0, getattr(usage, "candidates_token_count", 0) or 0
+    # OpenAI / Groq: usage.prompt_tokens / completion_tokens
+    if usage := getattr(response, "usage", None):
+        return getattr(usage, "prompt_tokens", 0) or 0, getattr(usage, "completion_tokens", 0) or 0
+    return None
+
+
+def cached_tokens(response):
+    """Input tokens the provider served from its prompt cache (0 if it didn't say)."""
+    # Gemini: usage_metadata.cached_content_token_count
+    if usage := getattr(response, "usage_metadata", None):
+        return getattr(usage, "cached_content_token_count", 0) or 0
+    # OpenAI / Groq: usage.prompt_tokens_details.cached_tokens
+    if usage := getattr(response, "usage", None):
+        return getattr(getattr(usage, "prompt_tokens_details", None), "cached_tokens", 0) or 0
+    return 0
+
+
+def record_tokens(provider, input_tokens, output_tokens, cached=0):
+    inc("llm_tokens_total", input_tokens, provider=provider, direction="input")
+    inc("llm_tokens_total", output_tokens, provider=provider, direction="output")
+    if cached:
+        inc("llm_tokens_total", cached, provider=provider, direction="cached_input")
+
+
+def render():
+    return registry.render()
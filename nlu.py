@@ -0,0 +1,451 @@
+import copy
+import os
+import re
+from datetime import date, timedelta
+
+import batch
+import catalog
+import dsp_rules
+import metrics
+import normalize
+
+# --- LOCAL NLU FAST PATH ---
+# Many turns are plain slot filling: "I'm releasing a Hip Hop single called 'Empire'
+# dropping ASAP", "Remastered", "1999", "I did everything myself". This stage sits
+# after dsp_rules.precheck and in front of the LLM. Precompiled matchers and
+# gazetteers pull slots out of the message, each with a confidence score.
+# A turn is answered locally only when:
+#   * every slot is at or above THRESHOLD, and
+#   * the slots (plus filler words) cover the message, so nothing the user said is dropped.
+# Anything else (questions, negations, free-form credits, "I wrote it with mom")
+# goes to the LLM exactly as before.
+#
+# fast_reply() -> {"response", "updates", "source": "nlu", "intent", "confidence", "slots"}
+# (same shape as dsp_rules.precheck), or None to escalate. NLU_FAST_PATH=0 turns it off,
+# NLU_THRESHOLD moves the bar. `python benchmark.py --stages nlu` reports hit rate and latency.
+
+ENABLED = os.getenv("NLU_FAST_PATH", "1") != "0"
+THRESHOLD = float(os.getenv("NLU_THRESHOLD", "0.8"))
+MIN_COVERAGE = 0.75
+MAIN_ARTIST_LEGAL_NAME = os.getenv("MAIN_ARTIST_LEGAL_NAME", "Bogdan Hershall")
+
+# --- 1. GAZETTEERS ---
+# Spoken forms of the normalize.py vocabularies, matched longest-first on word boundaries.
+# Aliases that are everyday words in a sentence ("chill", "club", "score", "none") only
+# count when they are the whole answer, through normalize.lookup().
+
+AMBIGUOUS_ALIASES = {
+    "alt", "chill", "club", "score", "dub", "swing", "kids", "children", "childrens", "traditional",
+    "none", "hardcore", "video game", "poetry", "meditation", "relaxation", "worship", "eng",
+}
+
+RATINGS = {
+    "Explicit": ("explicit", "dirty"),
+    "Clean": ("clean",),
+    "Non-Explicit": ("non-explicit", "non explicit", "not explicit"),
+}
+
+
+def _variants(value):
+    low = value.lower()
+    return {low, low.replace("-", " "), low.replace(" ", "-"), low.replace(" ", "").replace("-", "")}
+
+
+def _spoken(table):
+    return {canonical: tuple({v for alias in (canonical,) + tuple(aliases) for v in _variants(alias)} - AMBIGUOUS_ALIASES)
+            for canonical, aliases in table.items()}
+
+
+GENRES = _spoken(normalize.GENRES)
+LANGUAGES = _spoken(normalize.LANGUAGES)
+VERSIONS = _spoken(normalize.VERSIONS)
+
+
+def _gazetteer(table):
+    # One alternation per table, longest variant first, so "hip hop" beats "hop" and "k-pop" beats "pop".
+    lookup = {variant: canonical for canonical, variants in table.items() for variant in variants}
+    alternation = "|".join(re.escape(v) for v in sorted(lookup, key=len, reverse=True))
+    return re.compile(r"(?<![\w-])(" + alternation + r")(?![\w-])", re.I), lookup
+
+
+_GENRE_RE, _GENRE_LOOKUP = _gazetteer(GENRES)
+_LANGUAGE_RE, _LANGUAGE_LOOKUP = _gazetteer(LANGUAGES)
+_RATING_RE, _RATING_LOOKUP = _gazetteer(RATINGS)
+_VERSION_RE, _VERSION_LOOKUP = _gazetteer(VERSIONS)
+
+# --- 2. PRECOMPILED PATTERNS ---
+
+_WEEKDAYS = ("monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday")
+_ASAP_RE = re.compile(r"\b(?:asap|a\.s\.a\.p\.?|as soon as possible|right away|right now|immediately)(?!\w)", re.I)
+_ISO_DATE_RE = re.compile(r"\b(\d{4}-\d{2}-\d{2})\b")
+_WEEKDAY_RE = re.compile(r"\b(?:(?:next|this|on)\s+)?(" + "|".join(_WEEKDAYS) + r")\b", re.I)
+_TOMORROW_RE = re.compile(r"\btomorrow\b", re.I)
+_YEAR_RE = re.compile(r"\b(1[89]\d{2}|20\d{2})\b")
+_QUOTED_RE = re.compile(r"(?:(?<=\s)|^)[\"“'‘]([^\"“”'‘’\n]{1,100}?)[\"”'’](?=[\s.,!;:]|$)")
+_TITLE_CUE_RE = re.compile(r"\b(?:called|titled|named|title(?:\s+is)?|(?:song|track|single)(?:'s|\s+is)|name\s+is)\s*:?\s*$", re.I)
+_GENRE_CUE_RE = re.compile(r"\bgenre\b|\b(?:single|song|track|record|tune|album|ep|banger|beat)\b", re.I)
+_DATE_CUE_RE = re.compile(r"\b(?:drop(?:ping|s)?|releas(?:e|ing|ed)|out|coming|date)\b", re.I)
+_VERSION_CUE_RE = re.compile(r"\b(?:version|edit|mix|cut)\b", re.I)
+_SOLO_RE = re.compile(
+    r"\b(?:i did (?:it )?(?:everything|all(?: of it)?|it all)|"
+    r"(?:it'?s |it was )?(?:just|only|all) me|(?:all )?by myself|"
+    r"i (?:wrote|made|produced|recorded) (?:it|everything)(?: all)?(?: by)? myself)\b(?:\s+myself\b)?", re.I)
+_YES_RE = re.compile(r"^\s*(?:yes|yeah|yep|yup|correct|it is|sure)\b", re.I)
+_NO_RE = re.compile(r"^\s*(?:no|nope|never|not yet)\b", re.I)
+_NEGATION_RE = re.compile(r"\b(?:not|never|don'?t|isn'?t|wasn'?t|won'?t|can'?t|without|instead|but|except|actually)\b|n't\b", re.I)
+_TOKEN_RE = re.compile(r"[\w'&+-]+")
+
+# Words that carry no slot of their own; they don't count against coverage.
+FILLER = frozenset("""
+    i i'm im me my our we it it's its is was be will gonna going to a an the this that new
+    song single track record tune album ep called titled named title name genre by out on
+    dropping drop drops releasing release released coming date and so yes yeah yep ok okay
+    please just version edit mix of for no nope hey hi yo
+""".split()) | {catalog.MAIN_ARTIST.lower()}
+
+# Last question -> field it asks for, for cues dsp_rules.QUESTION_CUES doesn't cover.
+CREDIT_QUESTION = "track.credits"
+QUESTION_CUES = [
+    (re.compile(r"\bwho\b.*\b(?:worked|made|wrote|produced|played|sang|performed)\b|\bcredits?\b", re.I), CREDIT_QUESTION),
+    (re.compile(r"released before", re.I), "track.released_before.status"),
+    (re.compile(r"\blanguage\b|\binstrumental\b.*\blyrics\b", re.I), "track.lyrics.language"),
+    (re.compile(r"\bexplicit\b|\bclean\b", re.I), "track.lyrics.explicit_rating"),
+    (re.compile(r"\bgenre\b", re.I), "release.genre"),
+    (re.compile(r"\basap\b|specific date|release date|when\b.*\breleas", re.I), "release.date"),
+    (re.compile(r"\bversion\b", re.I), "release.version.type"),
+]
+
+LABELS = {
+    "release.title": "Title",
+    "release.genre": "Genre",
+    "release.date": "Release date",
+    "release.version.type": "Version",
+    "release.version.remaster_year": "Original release year",
+    "track.released_before.status": "Released before",
+    "track.released_before.original_year": "Year of original recording",
+    "track.credits.composers": "Composers",
+    "track.lyrics.language": "Lyrics language",
+    "track.lyrics.explicit_rating": "Content rating",
+    "track.lyrics.lyricist": "Lyricist",
+}
+
+
+# --- 3. SLOT MATCHERS ---
+# Each returns slots: {"path", "value", "confidence", "span": (start, end)}
+
+def _slot(path, value, confidence, span):
+    return {"path": path, "value": value, "confidence": confidence, "span": span}
+
+
+def expected_field(question):
+    if not question:
+        return None
+    if path := dsp_rules.field_for_question(question):
+        return path
+    for pattern, path in QUESTION_CUES:
+        if pattern.search(question):
+            return path
+    return None
+
+
+def _cue_near(pattern, text, start, end, window=30):
+    return bool(pattern.search(text[max(0, start - window):start]) or pattern.search(text[end:end + window]))
+
+
+def _titles(text, expected):
+    slots = []
+    for m in _QUOTED_RE.finditer(text):
+        title = m.group(1).strip()
+        if dsp_rules.validate_title(title) is not None:
+            continue  # precheck/LLM explain the rule
+        cued = expected == "release.title" or _TITLE_CUE_RE.search(text[:m.start()])
+        slots.append(_slot("release.title", title, 0.95 if cued else 0.75, m.span()))
+    return slots
+
+
+def _gazetteer_slots(pattern, lookup, path, text, expected, cue):
+    slots = []
+    for m in pattern.finditer(text):
+        if expected == path:
+            confidence = 0.95
+        elif cue is not None and _cue_near(cue, text, *m.span()):
+            confidence = 0.9
+        else:
+            confidence = 0.6
+        slots.append(_slot(path, lookup[m.group(1).lower()], confidence, m.span()))
+    return slots
+
+
+def _next_weekday(name, today):
+    days = (_WEEKDAYS.index(name.lower()) - today.weekday()) % 7 or 7
+    return (today + timedelta(days=days)).isoformat()
+
+
+def _dates(text, expected, today):
+    slots = []
+    sure = 0.95 if expected == "release.date" else None
+    for m in _ASAP_RE.finditer(text):
+        slots.append(_slot("release.date", "ASAP", sure or 0.9, m.span()))
+    for m in _ISO_DATE_RE.finditer(text):
+        try:
+            day = date.fromisoformat(m.group(1))
+        except ValueError:
+            continue
+        if day > today:
+            slots.append(_slot("release.date", day.isoformat(), sure or 0.9, m.span()))
+    for m in _WEEKDAY_RE.finditer(text):
+        confidence = sure or (0.85 if _cue_near(_DATE_CUE_RE, text, *m.span()) else 0.6)
+        slots.append(_slot("release.date", _next_weekday(m.group(1), today), confidence, m.span()))
+    for m in _TOMORROW_RE.finditer(text):
+        confidence = sure or (0.85 if _cue_near(_DATE_CUE_RE, text, *m.span()) else 0.6)
+        slots.append(_slot("release.date", (today + timedelta(days=1)).isoformat(), confidence, m.span()))
+    return slots
+
+
+def _years(text, expected, versions, today):
+    years = list(_YEAR_RE.finditer(text))
+    if len(years) != 1:
+        return []
+    m = years[0]
+    year = int(m.group(1))
+    if expected in ("release.version.remaster_year", "track.released_before.original_year"):
+        path, confidence = expected, 0.95
+    elif any(s["value"] == "Remastered" for s in versions):
+        path, confidence = "release.version.remaster_year", 0.85  # "remastered, originally from 1999"
+    else:
+        return []
+    max_year = today.year if path == "release.version.remaster_year" else today.year - 1
+    if dsp_rules.validate_year(year, max_year) is not None:
+        return []
+    return [_slot(path, year, confidence, m.span())]
+
+
+def _bare_answer(text, expected, question):
+    # Whole reply is the answer to the field just asked for.
+    if expected == "release.title":
+        title = dsp_rules.clean_reply(text)
+        if title and len(title.split()) <= 8 and not dsp_rules.is_conversational(text) and dsp_rules.validate_title(title) is None:
+            return [_slot("release.title", title, 0.9, (0, len(text)))]
+    elif expected in ("track.credits.composers", "track.lyrics.lyricist"):
+        if dsp_rules.is_conversational(text):
+            return []
+        names = dsp_rules.split_names(text)
+        if names and all(dsp_rules.validate_legal_name(n) is None for n in names):
+            return [_slot(expected, names, 0.9, (0, len(text)))]
+    elif expected in normalize.PATH_KINDS:
+        # "chill", "Portugese", "remasterd": the index does exact aliases and typo matching.
+        match = normalize.lookup(normalize.PATH_KINDS[expected], dsp_rules.clean_reply(text))
+        if match["value"] is not None and match["score"] >= normalize.AUTO_SCORE:
+            return [_slot(expected, match["value"], 0.95 if match["exact"] else match["score"], (0, len(text)))]
+    elif expected == "track.released_before.status":
+        if m := _YES_RE.match(text):
+            return [_slot(expected, True, 0.9, m.span())]
+        if m := _NO_RE.match(text):
+            return [_slot(expected, False, 0.9, m.span())]
+    elif expected == "release.version.type" and re.search(r"\boriginal\b", question, re.I):
+        # "Is this the Original version?" -> "yes"
+        if m := _YES_RE.match(text):
+            return [_slot(expected, "Original", 0.9, m.span())]
+    return []
+
+
+def _solo(text, expected):
+    if m := _SOLO_RE.search(text):
+        credits = expected == CREDIT_QUESTION or (expected or "").startswith("track.credits.")
+        return [_slot(CREDIT_QUESTION, MAIN_ARTIST_LEGAL_NAME, 0.95 if credits else 0.8, m.span())]
+    return []
+
+
+def _coverage(text, slots):
+    # Share of words that are either inside a slot or filler.
+    spans = [s["span"] for s in slots]
+    tokens = list(_TOKEN_RE.finditer(text))
+    if not tokens:
+        return 0.0
+    covered = sum(1 for t in tokens if t.group(0).lower() in FILLER or any(a <= t.start() < b for a, b in spans))
+    return covered / len(tokens)
+
+
+# --- 4. TURN ANALYSIS ---
+
+def analyze(question, text, today=None):
+    """Slots, coverage and overall confidence for one user turn."""
+    today = today or date.today()
+    expected = expected_field(question)
+    result = {"expected": expected, "slots": [], "coverage": 0.0, "confidence": 0.0, "intent": None}
+    if not text or not text.strip():
+        return result
+    if "?" in text:
+        result["intent"] = "question"
+        return result
+
+    versions = _gazetteer_slots(_VERSION_RE, _VERSION_LOOKUP, "release.version.type", text, expected, _VERSION_CUE_RE)
+    found = (
+        _solo(text, expected)
+        + _titles(text, expected)
+        + _gazetteer_slots(_GENRE_RE, _GENRE_LOOKUP, "release.genre", text, expected, _GENRE_CUE_RE)
+        + _dates(text, expected, today)
+        + versions
+        + _years(text, expected, versions, today)
+        + _gazetteer_slots(_LANGUAGE_RE, _LANGUAGE_LOOKUP, "track.lyrics.language", text, expected, None)
+        + _gazetteer_slots(_RATING_RE, _RATING_LOOKUP, "track.lyrics.explicit_rating", text, expected, None)
+    )
+    if not found:
+        found = _bare_answer(text, expected, question or "")
+
+    # Best match per field, and per stretch of text ("instrumental" is a language or a
+    # version, not both). Two different confident values for one field is ambiguous.
+    slots = []
+    for slot in sorted(found, key=lambda s: -s["confidence"]):
+        if same := next((s for s in slots if s["path"] == slot["path"]), None):
+            if same["value"] != slot["value"] and slot["confidence"] >= THRESHOLD:
+                same["confidence"] = min(same["confidence"], 0.5)
+        elif not any(slot["span"][0] < s["span"][1] and s["span"][0] < slot["span"][1] for s in slots):
+            slots.append(slot)
+
+    coverage = _coverage(text, slots)
+    confidence = min((s["confidence"] for s in slots), default=0.0)
+    if coverage < MIN_COVERAGE:
+        confidence *= coverage
+    # Negations/corrections flip meaning in ways gazetteers can't see ("not remastered").
+    negations = [m for m in _NEGATION_RE.finditer(text) if not any(a <= m.start() < b for a, b in (s["span"] for s in slots))]
+    if negations:
+        confidence = min(confidence, 0.5)
+
+    result.update(
+        slots=slots, coverage=round(coverage, 3), confidence=round(confidence, 3),
+        intent=("solo_artist" if any(s["path"] == CREDIT_QUESTION for s in slots) else "fill_slots") if slots else None,
+    )
+    return result
+
+
+# --- 5. LOCAL REPLY ---
+
+def _updates(slots):
+    updates = {}
+    for slot in slots:
+        if slot["path"] == CREDIT_QUESTION:
+            name = slot["value"]
+            path_values = [
+                ("track.credits.composers", [name]),
+                ("track.credits.performers", [{"name": name, "role": "Vocals"}]),
+                ("track.credits.production", [{"name": name, "role": "Producer"}]),
+            ]
+        elif slot["path"] == "track.lyrics.language" and slot["value"] == "Instrumental":
+            path_values = [("track.lyrics.language", "Instrumental"), ("track.lyrics.explicit_rating", "Clean"), ("track.lyrics.lyricist", None)]
+        else:
+            path_values = [(slot["path"], slot["value"])]
+        for path, value in path_values:
+            node = updates
+            keys = path.split(".")
+            for key in keys[:-1]:
+                node = node.setdefault(key, {})
+            node[keys[-1]] = value
+    return updates
+
+
+def merge_updates(draft, updates):
+    merged = copy.deepcopy(draft or {})
+    for key, value in updates.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = merge_updates(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+
+def next_question(draft):
+    """Next happy-path question (section 4 of the system prompt) for what's still missing, or None."""
+    get = lambda path: dsp_rules.get_path(draft, path)
+    version = get("release.version.type")
+    if not get("release.title"):
+        return "What is the name of your song?"
+    if not version:
+        return "Is this the Original version, or a special version (like Remix, Live, etc.)?"
+    if version == "Remastered" and not get("release.version.remaster_year"):
+        return f"Since this is **Remastered**, what was the **Year of the Original Release**? ({dsp_rules.MIN_YEAR}-{date.today().year})"
+    if version in ("Remix", "Other"):
+        return None  # rights confirmation / custom text stay with the LLM
+    if not get("release.genre"):
+        return "What is the primary genre?"
+    if not get("release.date"):
+        return "Are you releasing **ASAP** or on a specific date?"
+    if not get("track.credits.composers"):
+        return "Who wrote the song? I need **Legal First and Last Names** for publishing rights."
+    if not get("track.credits.performers") or not get("track.credits.production"):
+        return None  # names + roles are free-form; the LLM asks and parses them
+    if get("track.released_before.status") is None:
+        return "Has this track been released before?"
+    if get("track.released_before.status") and not get("track.released_before.original_year"):
+        return f"What is the **Year of Original Recording**? ({dsp_rules.MIN_YEAR}-{date.today().year - 1})"
+    language = get("track.lyrics.language")
+    if not language:
+        return "What language are the lyrics in? (Or is it **Instrumental**?)"
+    if language != "Instrumental":
+        if not get("track.lyrics.explicit_rating"):
+            return "Is the content **Explicit**, **Clean**, or **Non-Explicit**?"
+        if not get("track.lyrics.lyricist"):
+            return "Who is the Lyricist? (Legal First & Last Name required)"
+    return None
+
+
+def _show(value):
+    if isinstance(value, bool):
+        return "Yes" if value else "No"
+    if isinstance(value, list):
+        return ", ".join(value)
+    return str(value)
+
+
+def fast_reply(question, text, draft, catalog_index=None, threshold=THRESHOLD, today=None):
+    """Answer the turn locally when the parse is confident. Returns a result dict or None to escalate."""
+    if not ENABLED:
+        return None
+    with metrics.span("nlu.route"):
+        result = _fast_reply(question, text, draft, catalog_index, threshold, today)
+    metrics.inc("nlu_turns_total", outcome="answered" if result else "escalated")
+    return result
+
+
+def _fast_reply(question, text, draft, catalog_index, threshold, today):
+    parsed = analyze(question, text, today)
+    if not parsed["slots"] or parsed["confidence"] < threshold:
+        return None
+    updates = _updates(parsed["slots"])
+    merged = merge_updates(draft, updates)
+    if catalog_index is not None and catalog_index.check_draft(merged):
+        return None  # duplicate title / used ISRC: the LLM raises the catalog note
+    follow_up = next_question(merged)
+    if follow_up is None:
+        return None  # nothing simple left to ask; the LLM wraps up
+
+    if parsed["intent"] == "solo_artist":
+        ack = f"Understood. I've set **{MAIN_ARTIST_LEGAL_NAME}** as the Composer, Performer, and Producer."
+    else:
+        ack = "Got it. " + ", ".join(f"{LABELS[s['path']]}: **{_show(s['value'])}**" for s in parsed["slots"]) + "."
+    return {
+        "response": f"{ack}\n\n{follow_up}",
+        "updates": updates,
+        "source": "nlu",
+        "intent": parsed["intent"],
+        "confidence": parsed["confidence"],
+        "slots": [{k: s[k] for k in ("path", "value", "confidence")} for s in parsed["slots"]],
+    }
+
+
+# Schema path -> release_tool/batch column name, for callers that speak the flat tool args.
+_FIELD_FOR_PATH = {}
+for _name, _path in batch.COLUMN_MAP.items():
+    _FIELD_FOR_PATH.setdefault(_path, _name)
+
+
+def to_fields(updates, prefix=""):
+    """Nested updates -> flat release_tool-style args (agent_api functionCall)."""
+    fields = {}
+    for key, value in updates.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            fields.update(to_fields(value, path + "."))
+        elif path in _FIELD_FOR_PATH and value is not None:
+            fields[_FIELD_FOR_PATH[path]] = value
+    return fields
@@ -0,0 +1,344 @@
+import functools
+import re
+import threading
+import unicodedata
+
+import numpy as np
+
+import dsp_rules
+
+# --- FIELD NORMALIZATION (genre / lyrics language / version) ---
+# Free-text values are mapped onto fixed vocabularies:
+#   genre     DSP genre taxonomy (GENRES)
+#   language  ISO 639-1 languages (LANGUAGES + LANGUAGE_CODES), plus "Instrumental"
+#   version   the version enum (dsp_rules.VERSION_TYPES + "Original")
+# Each vocabulary is compiled once into an Index. The Index holds an exact table of
+# folded names and aliases, plus a trigram matrix and padded char codes for fuzzy
+# matching. Exact hits are a dict lookup. Misses are scored in batches with NumPy:
+# trigram overlap picks the candidates, then one vectorized Levenshtein pass over
+# every (value, candidate) pair ranks them. normalize_many() scores a whole column in
+# one call, unique values only.
+#
+# Result: {"input", "value", "score", "exact", "suggestions"}; value is None when nothing
+# scores MIN_SCORE. canonical() only swaps a value in at AUTO_SCORE; validation shows
+# the suggestions for anything below that.
+
+MIN_SCORE = 0.6     # below this there is no suggestion at all
+AUTO_SCORE = 0.8    # at or above this a value is replaced without asking
+TOP_K = 8           # trigram candidates per value that get an edit-distance score
+BATCH = 2048        # values per matrix product (bounds memory on huge columns)
+CACHE_MAX = 50_000  # fuzzy results kept per index
+
+GENRES = {
+    "Alternative": ("alt", "alt rock", "alternative rock", "grunge"),
+    "Afrobeats": ("afrobeat", "afro beats", "afropop", "amapiano"),
+    "Ambient": ("chill", "chillout"),
+    "Blues": (),
+    "Children's Music": ("kids", "childrens", "children"),
+    "Christian & Gospel": ("christian", "gospel", "worship", "ccm"),
+    "Classical": ("orchestral", "opera", "baroque"),
+    "Comedy": ("stand up", "standup"),
+    "Country": ("americana", "bluegrass"),
+    "Dance": ("club", "disco"),
+    "Drum & Bass": ("dnb", "drum and bass", "jungle"),
+    "Electronic": ("edm", "electronica", "house", "techno", "trance", "dubstep", "electro"),
+    "Folk": ("acoustic folk", "indie folk"),
+    "Hip Hop": ("hip-hop", "hiphop", "rap", "trap", "drill", "hip hop/rap"),
+    "Hyperpop": ("hyper pop", "hyper-pop", "digicore"),
+    "Indie": ("indie pop", "indie rock"),
+    "Jazz": ("smooth jazz", "bebop", "swing"),
+    "K-Pop": ("kpop", "k pop", "korean pop"),
+    "Latin": ("reggaeton", "latin pop", "salsa", "bachata", "cumbia", "regional mexican"),
+    "Lo-Fi": ("lofi", "lo fi", "lofi hip hop"),
+    "Metal": ("heavy metal", "metalcore", "death metal"),
+    "New Age": ("meditation", "relaxation"),
+    "Pop": ("pop music",),
+    "Punk": ("pop punk", "punk rock", "hardcore"),
+    "R&B": ("rnb", "r and b", "r n b", "rhythm and blues", "r&b/soul"),
+    "Reggae": ("dancehall", "dub", "ska"),
+    "Rock": ("classic rock", "hard rock"),
+    "Singer/Songwriter": ("singer songwriter", "singer-songwriter"),
+    "Soul": ("neo soul", "funk"),
+    "Soundtrack": ("film score", "score", "ost", "video game"),
+    "Spoken Word": ("poetry", "audiobook"),
+    "World": ("world music", "traditional"),
+}
+
+LANGUAGES = {
+    "Arabic": ("arabi",),
+    "Bengali": ("bangla",),
+    "Bulgarian": (),
+    "Catalan": ("catala", "català"),
+    "Chinese": ("mandarin", "cantonese", "zhongwen"),
+    "Croatian": ("hrvatski",),
+    "Czech": ("cestina",),
+    "Danish": ("dansk",),
+    "Dutch": ("nederlands", "flemish"),
+    "English": ("eng",),
+    "Filipino": ("tagalog",),
+    "Finnish": ("suomi",),
+    "French": ("francais", "français"),
+    "German": ("deutsch",),
+    "Greek": ("ellinika",),
+    "Hebrew": ("ivrit",),
+    "Hindi": (),
+    "Hungarian": ("magyar",),
+    "Indonesian": ("bahasa", "bahasa indonesia"),
+    "Irish": ("gaeilge",),
+    "Italian": ("italiano",),
+    "Japanese": ("nihongo",),
+    "Korean": ("hangul", "hanguk"),
+    "Latin": (),
+    "Malay": ("bahasa melayu",),
+    "Norwegian": ("norsk",),
+    "Persian": ("farsi",),
+    "Polish": ("polski",),
+    "Portuguese": ("portugues", "português", "brazilian portuguese"),
+    "Punjabi": ("panjabi",),
+    "Romanian": ("romana", "română"),
+    "Russian": ("russkiy",),
+    "Serbian": ("srpski",),
+    "Slovak": ("slovencina",),
+    "Spanish": ("espanol", "español", "castellano"),
+    "Swahili": ("kiswahili",),
+    "Swedish": ("svenska",),
+    "Tamil": (),
+    "Telugu": (),
+    "Thai": (),
+    "Turkish": ("turkce", "türkçe"),
+    "Ukrainian": ("ukrainska",),
+    "Urdu": (),
+    "Vietnamese": ("tieng viet",),
+    "Yoruba": (),
+    "Zulu": ("isizulu",),
+    "Instrumental": ("no lyrics", "no vocals", "none"),
+}
+
+# ISO 639-1 / 639-2 codes: exact matches only, never fuzzy ("it" must not become Italian by accident in free text).
+LANGUAGE_CODES = {
+    "ar": "Arabic", "bn": "Bengali", "bg": "Bulgarian", "ca": "Catalan", "zh": "Chinese", "hr": "Croatian",
+    "cs": "Czech", "da": "Danish", "nl": "Dutch", "en": "English", "fil": "Filipino", "tl": "Filipino",
+    "fi": "Finnish", "fr": "French", "de": "German", "el": "Greek", "he": "Hebrew", "hi": "Hindi",
+    "hu": "Hungarian", "id": "Indonesian", "ga": "Irish", "it": "Italian", "ja": "Japanese", "ko": "Korean",
+    "la": "Latin", "ms": "Malay", "nb": "Norwegian", "nn": "Norwegian", "fa": "Persian", "pl": "Polish",
+    "pt": "Portuguese", "pa": "Punjabi", "ro": "Romanian", "ru": "Russian", "sr": "Serbian", "sk": "Slovak",
+    "es": "Spanish", "sw": "Swahili", "sv": "Swedish", "ta": "Tamil", "te": "Telugu", "th": "Thai",
+    "tr": "Turkish", "uk": "Ukrainian", "ur": "Urdu", "vi": "Vietnamese", "yo": "Yoruba", "zu": "Zulu",
+    "spa": "Spanish", "fra": "French", "fre": "French", "deu": "German", "ger": "German", "por": "Portuguese",
+    "ita": "Italian", "jpn": "Japanese", "kor": "Korean", "zho": "Chinese", "chi": "Chinese", "rus": "Russian",
+}
+
+VERSIONS = {v: () for v in ("Original",) + dsp_rules.VERSION_TYPES}
+VERSIONS.update({
+    "Remastered": ("remaster", "remastered version"),
+    "Remix": ("remixed", "rmx"),
+    "Slowed and Reverb": ("slowed + reverb", "slowed & reverb", "slowed reverb"),
+    "Sped Up": ("nightcore", "speed up"),
+    "Acapella": ("a cappella", "acappella", "vocals only"),
+    "Radio Edit": ("clean edit", "short edit"),
+    "Extended": ("extended mix", "extended version"),
+    "Live": ("live version", "live recording"),
+    "Original": ("original mix", "original version", "album version"),
+})
+
+# Draft schema path -> index kind (batch.convert_value / normalize_updates)
+PATH_KINDS = {"release.genre": "genre", "track.lyrics.language": "language", "release.version.type": "version"}
+
+_NON_ALNUM_RE = re.compile(r"[^0-9a-z]+")
+
+
+def fold(value):
+    # "Español " -> "espanol", "Hip-Hop" -> "hip hop", "R&B" -> "r and b"
+    text = unicodedata.normalize("NFKD", str(value)).encode("ascii", "ignore").decode().lower().replace("&", " and ")
+    return _NON_ALNUM_RE.sub(" ", text).strip()
+
+
+def _trigrams(text):
+    padded = f"  {text} "
+    return [padded[i:i + 3] for i in range(len(padded) - 2)]
+
+
+class Index:
+    def __init__(self, table, codes=None):
+        self.exact = {}
+        names = []  # (folded alias, canonical) rows of the fuzzy matrices
+        for canonical, aliases in table.items():
+            for alias in (canonical,) + tuple(aliases):
+                key = fold(alias)
+                for form in dict.fromkeys((key, key.replace(" ", ""))):
+                    if form and form not in self.exact:
+                        self.exact[form] = canonical
+                        names.append((form, canonical))
+        for code, canonical in (codes or {}).items():
+            self.exact.setdefault(code, canonical)
+        self.canonical = set(table)
+        self.names = [n for n, _ in names]
+        self.values = [c for _, c in names]
+
+        # Binary trigram matrix (aliases x vocabulary) and per-alias trigram counts.
+        self.vocab = {}
+        rows, cols = [], []
+        for i, name in enumerate(self.names):
+            for gram in set(_trigrams(name)):
+                rows.append(i)
+                cols.append(self.vocab.setdefault(gram, len(self.vocab)))
+        self.grams = np.zeros((len(self.names), len(self.vocab)), dtype=np.float32)
+        self.grams[rows, cols] = 1.0
+        self.gram_counts = self.grams.sum(axis=1)
+        # Char codes padded with -1 for the vectorized edit distance.
+        self.lengths = np.array([len(n) for n in self.names], dtype=np.int32)
+        self.codes = np.full((len(self.names), int(self.lengths.max())), -1, dtype=np.int32)
+        for i, name in enumerate(self.names):
+            self.codes[i, :len(name)] = [ord(c) for c in name]
+
+        self.cache = {}
+        self.lock = threading.Lock()
+
+    # --- public API ---
+
+    def lookup(self, value):
+        """Best match for one value (exact hits need no NumPy at all)."""
+        key = fold(value)
+        if (hit := self.exact.get(key)) is not None:
+            return {"input": value, "value": hit, "score": 1.0, "exact": True, "suggestions": [hit]}
+        if (cached := self.cache.get(key)) is None:
+            cached = self._fuzzy([key])[0]
+            self._remember({key: cached})
+        return dict(cached, input=value)
+
+    def normalize_many(self, values):
+        """Best match for every value, fuzzy-scoring each distinct miss once in batched matrix calls."""
+        keys = [fold(v) for v in values]
+        misses = list({k for k in keys if k not in self.exact and k not in self.cache})
+        if misses:
+            found = {}
+            for start in range(0, len(misses), BATCH):
+                part = misses[start:start + BATCH]
+                found.update(zip(part, self._fuzzy(part)))
+            self._remember(found)
+        out = []
+        for value, key in zip(values, keys):
+            if (hit := self.exact.get(key)) is not None:
+                out.append({"input": value, "value": hit, "score": 1.0, "exact": True, "suggestions": [hit]})
+            else:
+                out.append(dict(self.cache.get(key) or self._fuzzy([key])[0], input=value))
+        return out
+
+    def suggest(self, value, k=3):
+        """Up to k distinct canonical values that score at least MIN_SCORE, best first."""
+        return self._fuzzy([fold(value)], k=k)[0]["suggestions"]
+
+    # --- scoring ---
+
+    def _remember(self, results):
+        with self.lock:
+            if len(self.cache) + len(results) > CACHE_MAX:
+                self.cache.clear()
+            self.cache.update(results)
+
+    def _fuzzy(self, keys, k=1):
+        n = len(keys)
+        query = np.zeros((n, len(self.vocab)), dtype=np.float32)
+        query_counts = np.zeros(n, dtype=np.float32)
+        for row, key in enumerate(keys):
+            grams = set(_trigrams(key))
+            query_counts[row] = len(grams)
+            cols = [self.vocab[g] for g in grams if g in self.vocab]
+            query[row, cols] = 1.0
+
+        # Dice coefficient on trigram sets, then edit distance for the TOP_K best per value.
+        dice = 2.0 * (query @ self.grams.T) / (query_counts[:, None] + self.gram_counts[None, :])
+        top = min(TOP_K, len(self.names))
+        candidates = np.argpartition(-dice, top - 1, axis=1)[:, :top]
+
+        lengths = np.array([len(key) for key in keys], dtype=np.int32)
+        width = max(1, int(lengths.max()))
+        codes = np.full((n, width), -1, dtype=np.int32)
+        for row, key in enumerate(keys):
+            codes[row, :len(key)] = [ord(c) for c in key]
+
+        flat = candidates.ravel()
+        distance = levenshtein(np.repeat(codes, top, axis=0), np.repeat(lengths, top), self.codes[flat], self.lengths[flat])
+        longest = np.maximum(np.repeat(lengths, top), self.lengths[flat]).clip(min=1)
+        edit = (1.0 - distance / longest).reshape(n, top)
+        score = 0.7 * edit + 0.3 * np.take_along_axis(dice, candidates, axis=1)
+        order = np.argsort(-score, axis=1)
+
+        results = []
+        for row in range(n):
+            suggestions = []
+            for col in order[row]:
+                value, s = self.values[candidates[row, col]], float(score[row, col])
+                if s >= MIN_SCORE and value not in (v for v, _ in suggestions):
+                    suggestions.append((value, round(s, 3)))
+            best = suggestions[0] if suggestions else (None, round(float(score[row, order[row, 0]]), 3))
+            results.append({"value": best[0], "score": best[1], "exact": False, "suggestions": [v for v, _ in suggestions[:k]]})
+        return results
+
+
+def levenshtein(a, a_lengths, b, b_lengths):
+    """
+    Edit distance for N pairs at once. a (N x La) and b (N x Lb) are int char codes padded
+    with -1. One pass per char of a updates all N rows; the insertion chain within a DP row
+    is a running minimum (cur[j] = min over m<=j of x[m] + j - m), so there is no inner loop.
+    """
+    n, width = b.shape
+    steps = np.arange(width + 1, dtype=np.int32)
+    prev = np.broadcast_to(steps, (n, width + 1)).copy()
+    for i in range(a.shape[1]):
+        cost = (b != a[:, i:i + 1]).astype(np.int32)
+        x = np.empty_like(prev)
+        x[:, 0] = i + 1
+        np.minimum(prev[:, 1:] + 1, prev[:, :-1] + cost, out=x[:, 1:])
+        cur = np.minimum.accumulate(x - steps, axis=1) + steps
+        active = (i < a_lengths)[:, None]
+        prev = np.where(active, cur, prev)
+    return prev[np.arange(n), b_lengths]
+
+
+# --- PROCESS-WIDE INDEXES ---
+
+@functools.lru_cache(maxsize=None)
+def get_index(kind):
+    if kind == "genre":
+        return Index(GENRES)
+    if kind == "language":
+        return Index(LANGUAGES, LANGUAGE_CODES)
+    if kind == "version":
+        return Index(VERSIONS)
+    raise ValueError(f"Unknown normalization index: {kind}")
+
+
+def lookup(kind, value):
+    return get_index(kind).lookup(value)
+
+
+def normalize_many(kind, values):
+    return get_index(kind).normalize_many(values)
+
+
+def canonical(kind, value):
+    """Canonical value when the match is confident (AUTO_SCORE), else the input unchanged."""
+    if not isinstance(value, str) or not value.strip():
+        return value
+    match = lookup(kind, value)
+    return match["value"] if match["value"] is not None and match["score"] >= AUTO_SCORE else value
+
+
+def normalize_updates(updates, prefix=""):
+    """Canonicalize genre/language/version inside nested draft updates, in place."""
+    for key, value in (updates or {}).items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            normalize_updates(value, path + ".")
+        elif path in PATH_KINDS:
+            updates[key] = canonical(PATH_KINDS[path], value)
+    return updates
+
+
+def prewarm(kind, values):
+    # Bulk callers score a column's distinct values in one batched call, so the
+    # per-value canonical() calls that follow are all cache hits.
+    values = [v for v in values if isinstance(v, str) and v.strip()]
+    if values:
+        normalize_many(kind, values)
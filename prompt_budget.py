@@ -0,0 +1,113 @@
+import functools
+import json
+import math
+import os
+
+# --- PROMPT BUDGET ---
+# Keeps the input of every call under a token budget:
+#   1. the draft state is injected minified, with nulls and empty fields stripped
+#   2. the newest turns are kept; older ones are dropped and replaced by a short note
+#   3. each build reports how many input tokens it produced
+# Token counts use tiktoken when it is installed, otherwise ~4 chars per token.
+
+DEFAULT_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "8000"))
+SUMMARY_TURNS = 4
+SUMMARY_CHARS = 80
+NOTE_RESERVE = 120  # tokens kept free for the "earlier conversation" note when trimming
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except Exception:
+    _encoding = None
+
+
+def estimate_tokens(text):
+    if not text:
+        return 0
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    return math.ceil(len(text) / 4)
+
+
+def _strip(value):
+    if isinstance(value, dict):
+        out = {k: _strip(v) for k, v in value.items()}
+        return {k: v for k, v in out.items() if v not in (None, {}, [], "")}
+    if isinstance(value, list):
+        return [v for v in (_strip(v) for v in value) if v not in (None, {}, [], "")]
+    return value
+
+
+def compact_state(data):
+    """Minified JSON of the draft with null/empty fields removed (False and 0 are kept)."""
+    return json.dumps(_strip(data or {}), separators=(",", ":"), ensure_ascii=False)
+
+
+def trim_history(messages, budget, text_of):
+    """
+    Keep the newest messages that fit in budget tokens (the last one is always kept).
+    Returns (kept, dropped), both in original order.
+    """
+    used = 0
+    start = len(messages)
+    for i in range(len(messages) - 1, -1, -1):
+        cost = estimate_tokens(text_of(messages[i])) + 4  # + role/formatting overhead
+        if start < len(messages) and used + cost > budget:
+            break
+        used += cost
+        start = i
+    return messages[start:], messages[:start]
+
+
+def summarize_dropped(dropped, text_of, role_of):
+    # Extractive note (no extra LLM call): how much was cut + the last few user lines.
+    if not dropped:
+        return ""
+    user_lines = [text_of(m) for m in dropped if role_of(m) == "user"][-SUMMARY_TURNS:]
+    lines = [f"- {t[:SUMMARY_CHARS]}{'…' if len(t) > SUMMARY_CHARS else ''}" for t in user_lines]
+    return (
+        f"EARLIER CONVERSATION: {len(dropped)} older messages were omitted. "
+        "The CURRENT DRAFT STATE already holds everything collected from them. "
+        "Last things the user said there:\n" + "\n".join(lines)
+    )
+
+
+@functools.lru_cache(maxsize=16)
+def _prefix_tokens(prefix):
+    # The static prefix is the same text every call; count it once.
+    return estimate_tokens(prefix)
+
+
+def build(system_template, messages, state, text_of, role_of, budget=None, prefix=""):
+    """
+    Fill {current_state} in system_template, trim messages to the budget and report token counts.
+    state is the draft dict, or its already-compacted text (draft_state.Draft.compact()).
+    prefix is static instruction text sent separately (system_instruction / provider prompt
+    cache). It isn't returned, but it counts against the budget and is reported as prefix_tokens.
+    Returns (system_text, kept_messages, report).
+    """
+    budget = budget or DEFAULT_BUDGET
+    system_text = system_template.replace("{current_state}", state if isinstance(state, str) else compact_state(state))
+    system_tokens = estimate_tokens(system_text)
+    prefix_tokens = _prefix_tokens(prefix)
+
+    history_budget = max(0, budget - prefix_tokens - system_tokens)
+    kept, dropped = trim_history(messages, history_budget, text_of)
+    if dropped:
+        kept, dropped = trim_history(messages, max(0, history_budget - NOTE_RESERVE), text_of)
+    if note := summarize_dropped(dropped, text_of, role_of):
+        system_text += "\n\n" + note
+        system_tokens = estimate_tokens(system_text)
+
+    history_tokens = sum(estimate_tokens(text_of(m)) + 4 for m in kept)
+    report = {
+        "budget": budget,
+        "prefix_tokens": prefix_tokens,
+        "system_tokens": system_tokens,
+        "history_tokens": history_tokens,
+        "input_tokens": prefix_tokens + system_tokens + history_tokens,
+        "kept_messages": len(kept),
+        "dropped_messages": len(dropped),
+    }
+    return system_text, kept, report
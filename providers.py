@@ -0,0 +1,193 @@
+import atexit
+import hashlib
+import importlib
+import os
+import threading
+import time
+from datetime import timedelta
+
+import prompt_budget
+
+# --- PROVIDER REGISTRY ---
+# One long-lived client per (provider, API key), created on first use and reused by
+# every Streamlit rerun and Flask request in the process. Only the SDK of a provider
+# that is actually used gets imported. Groq and OpenAI share a pooled keep-alive
+# httpx client per key, so TLS handshakes stay off the hot path.
+
+PROVIDERS = {
+    "groq": {"secret": "GROQ_API_KEY", "module": "groq", "model": "llama-3.3-70b-versatile"},
+    "gemini": {"secret": "GEMINI_API_KEY", "module": "google.generativeai", "model": "gemini-1.5-flash"},
+    "openai": {"secret": "OPENAI_API_KEY", "module": "openai", "model": "gpt-4o"},
+}
+# Same priority call_llm has always used.
+PROVIDER_ORDER = ("groq", "gemini", "openai")
+
+HTTP_MAX_CONNECTIONS = int(os.getenv("LLM_HTTP_MAX_CONNECTIONS", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("LLM_HTTP_KEEPALIVE", "120"))
+HTTP_TIMEOUT = float(os.getenv("LLM_HTTP_TIMEOUT", "60"))
+
+# Gemini prefix cache (see gemini_prefix_model)
+PREFIX_CACHE = os.getenv("GEMINI_PREFIX_CACHE", "1") != "0"
+CACHE_TTL = float(os.getenv("GEMINI_CACHE_TTL", "3600"))
+CACHE_MIN_TOKENS = int(os.getenv("GEMINI_CACHE_MIN_TOKENS", "1024"))  # the model's minimum cacheable prefix
+CACHE_REFRESH_AT = 0.2   # extend the TTL once less than this share of it is left
+CACHE_RETRY_AFTER = 600  # seconds before trying again to cache a prefix that was refused
+
+_clients = {}
+_models = {}
+_gemini_key = None
+_prefix_caches = {}  # (key, model, prefix, config) -> {"cache", "model", "expires"} | {"retry_at"}
+_lock = threading.RLock()
+_cache_lock = threading.Lock()
+
+
+def _digest(api_key):
+    return hashlib.sha256(api_key.encode()).hexdigest()[:16]
+
+
+def configured(secrets):
+    """First (provider, api_key) present in secrets (st.secrets, os.environ or any mapping), else None."""
+    for name in PROVIDER_ORDER:
+        secret = PROVIDERS[name]["secret"]
+        if secret in secrets:
+            return name, secrets[secret]
+    return None
+
+
+def configured_all(secrets):
+    """Every (provider, api_key) present in secrets, in PROVIDER_ORDER."""
+    return [(name, secrets[PROVIDERS[name]["secret"]]) for name in PROVIDER_ORDER if PROVIDERS[name]["secret"] in secrets]
+
+
+def _http_client():
+    import httpx
+    return httpx.Client(
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_CONNECTIONS,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+        ),
+        timeout=HTTP_TIMEOUT,
+    )
+
+
+def get_client(name, api_key):
+    """Shared client for groq/openai, or the configured google.generativeai module for gemini."""
+    global _gemini_key
+    key = (name, _digest(api_key))
+    with _lock:
+        if key in _clients:
+            return _clients[key]
+        sdk = importlib.import_module(PROVIDERS[name]["module"])
+        if name == "groq":
+            client = sdk.Groq(api_key=api_key, http_client=_http_client())
+        elif name == "openai":
+            client = sdk.OpenAI(api_key=api_key, http_client=_http_client())
+        else:
+            # genai keeps its key module-wide, so only configure when it changes.
+            if _gemini_key != api_key:
+                sdk.configure(api_key=api_key)
+                _gemini_key = api_key
+            client = sdk
+        _clients[key] = client
+        return client
+
+
+def gemini_model(api_key, model_name=None, **kwargs):
+    """Cached GenerativeModel per key/model/config. kwargs are passed to GenerativeModel once."""
+    model_name = model_name or PROVIDERS["gemini"]["model"]
+    key = (_digest(api_key), model_name, repr(sorted(kwargs.items())))
+    with _lock:
+        if key not in _models:
+            genai = get_client("gemini", api_key)
+            _models[key] = genai.GenerativeModel(model_name, **kwargs)
+        return _models[key]
+
+
+# --- GEMINI PREFIX CACHE ---
+# The static system instruction and tool schema are registered once per (key, model,
+# prefix) as Gemini cached content. Every call then references the cache instead of
+# resending (and paying full price for) the prefix. A call that finds the cache near
+# expiry extends its TTL (GEMINI_CACHE_TTL), and a cache that can't be extended is
+# created again. If explicit caching isn't available (prefix under the model's minimum,
+# refused by the API, GEMINI_PREFIX_CACHE=0), the prefix is set as system_instruction.
+# It stays byte-identical between calls, so Gemini's implicit prefix caching still applies.
+
+def _create_prefix_cache(genai, model_name, system_instruction, tools, kwargs):
+    from google.generativeai import caching
+    cache = caching.CachedContent.create(
+        model=model_name, display_name="distro-agent-prefix", system_instruction=system_instruction,
+        tools=tools, ttl=timedelta(seconds=CACHE_TTL),
+    )
+    tokens = getattr(getattr(cache, "usage_metadata", None), "total_token_count", "?")
+    print(f"🧊 Cached the {model_name} prompt prefix ({tokens} tokens) for {CACHE_TTL:.0f}s.")
+    return {"cache": cache, "model": genai.GenerativeModel.from_cached_content(cached_content=cache, **kwargs),
+            "expires": time.time() + CACHE_TTL}
+
+
+def gemini_prefix_model(api_key, model_name, system_instruction, tools=None, **kwargs):
+    """GenerativeModel whose static prefix (system_instruction + tools) is cached server-side when possible."""
+    model_name = model_name or PROVIDERS["gemini"]["model"]
+    fallback = lambda: gemini_model(api_key, model_name, system_instruction=system_instruction, tools=tools, **kwargs)
+    if not PREFIX_CACHE:
+        return fallback()
+    key = (_digest(api_key), model_name, hashlib.sha256((system_instruction + repr(tools)).encode()).hexdigest()[:16],
+           repr(sorted(kwargs.items())))
+    now = time.time()
+    with _cache_lock:
+        entry = _prefix_caches.get(key)
+        if entry is not None and "retry_at" in entry:
+            if now < entry["retry_at"]:
+                return fallback()
+            entry = None
+        if entry is not None and entry["expires"] - now < CACHE_TTL * CACHE_REFRESH_AT:
+            try:
+                entry["cache"].update(ttl=timedelta(seconds=CACHE_TTL))
+                entry["expires"] = now + CACHE_TTL
+            except Exception as e:
+                print(f"⚠️ Couldn't extend the Gemini prefix cache ({e}); creating a new one.")
+                entry = None
+        if entry is None and prompt_budget.estimate_tokens(system_instruction + repr(tools or "")) < CACHE_MIN_TOKENS:
+            _prefix_caches[key] = {"retry_at": float("inf")}  # too short to cache explicitly
+            return fallback()
+        if entry is None:
+            try:
+                entry = _create_prefix_cache(get_client("gemini", api_key), model_name, system_instruction, tools, kwargs)
+            except Exception as e:
+                print(f"⚠️ Gemini prefix cache unavailable for {model_name} ({e}); sending it as system_instruction.")
+                _prefix_caches[key] = {"retry_at": now + CACHE_RETRY_AFTER}
+                return fallback()
+            _prefix_caches[key] = entry
+        return entry["model"]
+
+
+@atexit.register
+def _drop_prefix_caches():
+    # Cached content is billed per hour of storage; don't leave this process's caches behind.
+    for entry in list(_prefix_caches.values()):
+        if "cache" in entry:
+            try:
+                entry["cache"].delete()
+            except Exception:
+                pass
+
+
+def warm_up(name, api_key, connect=True):
+    """Import the SDK and build the client; with connect=True also open the first pooled connection."""
+    client = get_client(name, api_key)
+    if not connect:
+        return
+    try:
+        if name == "gemini":
+            client.get_model(f"models/{PROVIDERS[name]['model']}")
+        else:
+            client.models.list()
+    except Exception as e:
+        # Warm-up is best effort; the first real call will surface any auth problem.
+        print(f"⚠️ Warm-up for {name} failed: {e}")
+
+
+def warm_up_in_background(name, api_key):
+    thread = threading.Thread(target=warm_up, args=(name, api_key), daemon=True, name=f"warm-up-{name}")
+    thread.start()
+    return thread
@@ -0,0 +1,395 @@
+import asyncio
+import hashlib
+import itertools
+import random
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+
+import metrics
+
+# --- 1. TOKEN BUCKET (one per API key) ---
+# Every request for a key takes a token first. When the provider answers 429 the
+# bucket is paused for the retry hint, so other workers stop sending requests we
+# already know will be rejected.
+
+class RateLimited(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"Rate limited. Retry after {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = float(capacity or max(1, rate_per_minute))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self):
+        """Take a token if one is free. Returns 0, or the seconds to wait before trying again."""
+        with self.lock:
+            now = time.monotonic()
+            if now < self.paused_until:
+                return self.paused_until - now
+            self._refill(now)
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return (1 - self.tokens) / self.rate
+
+    def pause(self, seconds):
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0.0
+
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+def get_bucket(api_key, rate_per_minute):
+    # Keyed by a digest so raw keys never sit in a module-level dict.
+    key = hashlib.sha256((api_key or "").encode()).hexdigest()
+    with _buckets_lock:
+        if key not in _buckets:
+            _buckets[key] = TokenBucket(rate_per_minute)
+        return _buckets[key]
+
+
+# --- 2. BACKOFF ---
+
+_RETRY_IN_RE = re.compile(r"retry(?:_delay)?\s*(?:in|after)?\s*[{:]?\s*(?:seconds:\s*)?([\d.]+)\s*s?", re.I)
+
+def retry_hint(exc):
+    """Best-effort read of the provider's retry hint (Retry-After header or 'retry in Ns' text)."""
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None)
+    if headers:
+        value = headers.get("retry-after") or headers.get("Retry-After")
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            pass
+    if m := _RETRY_IN_RE.search(str(exc)):
+        return float(m.group(1))
+    return None
+
+
+def backoff_delay(attempt, base=1.0, cap=60.0, hint=None):
+    # Full jitter on the exponential step; never shorter than the provider's hint.
+    delay = random.uniform(0, min(cap, base * (2 ** attempt)))
+    if hint is not None:
+        delay = max(delay, hint + random.uniform(0, base))
+    return delay
+
+
+def call_with_retries(fn, bucket=None, retry_on=(), max_attempts=3, max_wait=0.0, provider="llm", sleep=time.sleep):
+    """
+    Run fn() behind the bucket, retrying retry_on errors with jittered backoff.
+    Waits are only slept while the running total stays under max_wait; otherwise
+    RateLimited is raised with the delay so the caller can answer 429 + Retry-After.
+    """
+    waited = 0.0
+    for attempt in range(max_attempts):
+        if bucket is not None:
+            wait = bucket.reserve()
+            while wait > 0:
+                if waited + wait > max_wait:
+                    raise RateLimited(wait)
+                sleep(wait)
+                waited += wait
+                metrics.inc("rate_limit_wait_seconds_total", wait, provider=provider)
+                wait = bucket.reserve()
+        try:
+            return fn()
+        except retry_on as e:
+            hint = retry_hint(e)
+            delay = backoff_delay(attempt, hint=hint)
+            if bucket is not None:
+                bucket.pause(hint if hint is not None else delay)
+            print(f"⚠️ Rate limit hit. Backing off {delay:.1f}s (Attempt {attempt+1}/{max_attempts})")
+            if attempt == max_attempts - 1 or waited + delay > max_wait:
+                raise RateLimited(delay)
+            metrics.inc("llm_retries_total", provider=provider)
+            with metrics.span("llm.backoff", provider=provider):
+                sleep(delay)
+            metrics.inc("llm_backoff_seconds_total", delay, provider=provider)
+            waited += delay
+    raise RateLimited(0.0)
+
+
+async def acall_with_retries(fn, bucket=None, retry_on=(), max_attempts=3, max_wait=0.0, provider="llm"):
+    """Async twin of call_with_retries for the ASGI server: fn() returns an awaitable, waits use asyncio.sleep."""
+    waited = 0.0
+    for attempt in range(max_attempts):
+        if bucket is not None:
+            wait = bucket.reserve()
+            while wait > 0:
+                if waited + wait > max_wait:
+                    raise RateLimited(wait)
+                await asyncio.sleep(wait)
+                waited += wait
+                metrics.inc("rate_limit_wait_seconds_total", wait, provider=provider)
+                wait = bucket.reserve()
+        try:
+            return await fn()
+        except retry_on as e:
+            hint = retry_hint(e)
+            delay = backoff_delay(attempt, hint=hint)
+            if bucket is not None:
+                bucket.pause(hint if hint is not None else delay)
+            print(f"⚠️ Rate limit hit. Backing off {delay:.1f}s (Attempt {attempt+1}/{max_attempts})")
+            if attempt == max_attempts - 1 or waited + delay > max_wait:
+                raise RateLimited(delay)
+            metrics.inc("llm_retries_total", provider=provider)
+            with metrics.span("llm.backoff", provider=provider):
+                await asyncio.sleep(delay)
+            metrics.inc("llm_backoff_seconds_total", delay, provider=provider)
+            waited += delay
+    raise RateLimited(0.0)
+
+
+# --- 3. ASYNC JOBS (202 Accepted + poll) ---
+# Long waits run on a small background pool instead of inside the request worker.
+
+class JobQueue:
+    def __init__(self, workers=4, max_jobs=1000, ttl=600):
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="chat-job")
+        self.jobs = OrderedDict()
+        self.max_jobs = max_jobs
+        self.ttl = ttl
+        self.lock = threading.Lock()
+
+    def _expire(self):
+        now = time.time()
+        while self.jobs:
+            job_id, job = next(iter(self.jobs.items()))
+            if len(self.jobs) <= self.max_jobs and now - job["created"] < self.ttl:
+                break
+            self.jobs.popitem(last=False)
+
+    def submit(self, fn):
+        job_id = uuid.uuid4().hex
+        job = {"id": job_id, "status": "pending", "created": time.time(), "result": None, "error": None, "done": threading.Event()}
+        with self.lock:
+            self._expire()
+            self.jobs[job_id] = job
+
+        def run():
+            try:
+                job["result"] = fn()
+                job["status"] = "done"
+            except Exception as e:
+                job["error"] = str(e)
+                job["status"] = "error"
+            finally:
+                job["done"].set()
+
+        self.pool.submit(run)
+        return job_id
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def wait(self, job_id, timeout):
+        job = self.get(job_id)
+        if job is not None:
+            job["done"].wait(timeout)
+        return job
+
+
+def job_view(job):
+    return {k: job[k] for k in ("id", "status", "result", "error")}
+
+
+# --- 4. ADMISSION CONTROL ---
+# Provider calls pass one admission layer. At most `limit` are in flight overall and
+# `per_user` per user; the rest wait in a bounded queue ordered by priority, then arrival.
+# (agent_api ranks by draft completeness, so users mid-submission go before new
+# conversations.) When the queue is full, the lowest-priority waiter is shed, or the new
+# request if it ranks lowest. Shed and timed-out requests get Overloaded, which is a
+# RateLimited, so callers already answer 429 + Retry-After. Retry-After is estimated
+# from the queue length and the recent service time. Answers that never reach a provider
+# (payout gate, local rules, NLU, cache) don't come through here.
+
+class Overloaded(RateLimited):
+    pass
+
+
+class _Waiter:
+    __slots__ = ("user", "priority", "seq", "wake", "granted", "shed")
+
+    def __init__(self, user, priority, seq, wake):
+        self.user = user
+        self.priority = priority
+        self.seq = seq
+        self.wake = wake
+        self.granted = False
+        self.shed = False
+
+
+class Admission:
+    def __init__(self, limit=8, per_user=1, max_queue=64, name="gemini"):
+        self.limit = limit
+        self.per_user = per_user
+        self.max_queue = max_queue
+        self.name = name
+        self.running = 0
+        self.running_by_user = {}
+        self.waiting = []
+        self.seq = itertools.count()
+        self.service_time = 1.0  # moving average of seconds per admitted call
+        self.lock = threading.Lock()
+        self.counters = {"admitted": 0, "queued": 0, "shed": 0, "timeouts": 0}
+
+    # --- bookkeeping (lock held) ---
+
+    def _can_run(self, user):
+        return self.running < self.limit and (user is None or self.running_by_user.get(user, 0) < self.per_user)
+
+    def _start(self, user):
+        self.running += 1
+        if user is not None:
+            self.running_by_user[user] = self.running_by_user.get(user, 0) + 1
+        self.counters["admitted"] += 1
+
+    def _retry_after(self):
+        return max(1.0, (len(self.waiting) / self.limit + 1) * self.service_time)
+
+    def _publish(self):
+        metrics.gauge("admission_queue_depth", len(self.waiting), provider=self.name)
+        metrics.gauge("admission_in_flight", self.running, provider=self.name)
+
+    def _overloaded(self, outcome):
+        self.counters["shed" if outcome == "shed" else "timeouts"] += 1
+        metrics.inc("admission_total", provider=self.name, outcome=outcome)
+        return Overloaded(self._retry_after())
+
+    def _enqueue(self, user, priority, wake):
+        """None if admitted right away, else the queued _Waiter. Raises Overloaded if shed."""
+        with self.lock:
+            # Waiters are granted as soon as a slot frees, so anyone still queued is blocked
+            # by a limit; a request that fits the limits now never overtakes a runnable one.
+            if self._can_run(user):
+                self._start(user)
+                metrics.inc("admission_total", provider=self.name, outcome="admitted")
+                self._publish()
+                return None
+            if len(self.waiting) >= self.max_queue:
+                lowest = min(self.waiting, key=lambda w: (w.priority, -w.seq))
+                if lowest.priority >= priority:
+                    raise self._overloaded("shed")
+                self.waiting.remove(lowest)
+                lowest.shed = True
+                lowest.wake()
+            waiter = _Waiter(user, priority, next(self.seq), wake)
+            self.waiting.append(waiter)
+            self.counters["queued"] += 1
+            metrics.inc("admission_total", provider=self.name, outcome="queued")
+            self._publish()
+            return waiter
+
+    def _dispatch(self):
+        for waiter in sorted(self.waiting, key=lambda w: (-w.priority, w.seq)):
+            if self.running >= self.limit:
+                break
+            if self._can_run(waiter.user):
+                self.waiting.remove(waiter)
+                self._start(waiter.user)
+                waiter.granted = True
+                waiter.wake()
+
+    def _settle(self, waiter):
+        # After the wait ended (woken or timed out): admitted, or Overloaded.
+        with self.lock:
+            if waiter.granted:
+                return
+            if waiter.shed:
+                error = self._overloaded("shed")
+            else:
+                self.waiting.remove(waiter)
+                error = self._overloaded("timeout")
+            self._publish()
+        raise error
+
+    def _abandon(self, waiter):
+        # The caller went away while queued (cancelled task).
+        with self.lock:
+            if waiter.granted:
+                waiter.granted = False
+                self._release(waiter.user, None)
+            elif waiter in self.waiting:
+                self.waiting.remove(waiter)
+            self._publish()
+
+    def _release(self, user, seconds):
+        self.running -= 1
+        if user is not None:
+            left = self.running_by_user.pop(user) - 1
+            if left:
+                self.running_by_user[user] = left
+        if seconds is not None:
+            self.service_time = 0.8 * self.service_time + 0.2 * seconds
+        self._dispatch()
+
+    def release(self, user, seconds=None):
+        with self.lock:
+            self._release(user, seconds)
+            self._publish()
+
+    # --- callers ---
+
+    @contextmanager
+    def slot(self, user=None, priority=0.0, timeout=10.0):
+        """Hold a provider slot for the block; waits up to timeout seconds in the queue."""
+        enqueued = time.monotonic()
+        admitted = threading.Event()
+        if (waiter := self._enqueue(user, priority, admitted.set)) is not None:
+            admitted.wait(timeout)
+            self._settle(waiter)
+        started = time.monotonic()
+        metrics.observe("admission_wait_seconds", started - enqueued, provider=self.name)
+        try:
+            yield
+        finally:
+            self.release(user, time.monotonic() - started)
+
+    @asynccontextmanager
+    async def aslot(self, user=None, priority=0.0, timeout=10.0):
+        """slot() for the event loop; a cancelled waiter leaves the queue (or hands its slot back)."""
+        loop = asyncio.get_running_loop()
+        admitted = loop.create_future()
+        def wake():
+            loop.call_soon_threadsafe(lambda: admitted.done() or admitted.set_result(None))
+        enqueued = time.monotonic()
+        if (waiter := self._enqueue(user, priority, wake)) is not None:
+            try:
+                await asyncio.wait_for(admitted, timeout)
+            except asyncio.TimeoutError:
+                pass
+            except asyncio.CancelledError:
+                self._abandon(waiter)
+                raise
+            self._settle(waiter)
+        started = time.monotonic()
+        metrics.observe("admission_wait_seconds", started - enqueued, provider=self.name)
+        try:
+            yield
+        finally:
+            self.release(user, time.monotonic() - started)
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters, in_flight=self.running, queued_now=len(self.waiting),
+                        service_time=round(self.service_time, 3), retry_after=round(self._retry_after(), 1))
@@ -0,0 +1,210 @@
+import contextvars
+import json
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import rate_limit
+
+# --- MULTI-PROVIDER ROUTER ---
+# Every configured provider/model is a Provider whose call(final_prompt, messages, on_chunk)
+# returns the normalized {"response", "updates"} dict. The router:
+#   * keeps rolling latency (p50/p95) and error-rate stats per provider
+#   * sends each request to the fastest healthy provider (untried ones first)
+#   * optionally hedges: if the first one hasn't answered after hedge_after seconds,
+#     the next best is started too and the first success wins
+#   * fails over to the next provider on errors; 429s also put the provider on cooldown
+# FakeProvider gives the same interface with no network, for local testing and benchmarks.
+
+WINDOW = 100
+MAX_ERROR_RATE = 0.5
+ERROR_COOLDOWN = 30.0
+
+
+class AllProvidersFailed(Exception):
+    pass
+
+
+class Provider:
+    def __init__(self, name, model, call):
+        self.name = name
+        self.model = model
+        self.call = call
+
+    @property
+    def key(self):
+        return f"{self.name}:{self.model}"
+
+
+class ProviderStats:
+    def __init__(self):
+        self.latencies = deque(maxlen=WINDOW)
+        self.outcomes = deque(maxlen=WINDOW)  # True = error
+        self.cooldown_until = 0.0
+        self.lock = threading.Lock()
+
+    def record(self, latency, error):
+        with self.lock:
+            if not error:
+                self.latencies.append(latency)
+            self.outcomes.append(error)
+
+    def percentile(self, q):
+        with self.lock:
+            values = sorted(self.latencies)
+        if not values:
+            return None
+        return values[min(len(values) - 1, int(q * len(values)))]
+
+    def error_rate(self):
+        with self.lock:
+            return sum(self.outcomes) / len(self.outcomes) if self.outcomes else 0.0
+
+    def healthy(self, now):
+        return now >= self.cooldown_until
+
+    def cool_down(self, seconds, reset=False):
+        with self.lock:
+            self.cooldown_until = max(self.cooldown_until, time.monotonic() + seconds)
+            if reset:
+                # Start the error window fresh so the provider gets a clean probe afterwards.
+                self.outcomes.clear()
+
+    def snapshot(self):
+        return {
+            "p50": self.percentile(0.5),
+            "p95": self.percentile(0.95),
+            "error_rate": round(self.error_rate(), 3),
+            "samples": len(self.outcomes),
+            "cooldown": max(0.0, round(self.cooldown_until - time.monotonic(), 1)),
+        }
+
+
+def is_rate_limit(exc):
+    if getattr(exc, "status_code", None) == 429 or getattr(exc, "code", None) == 429:
+        return True
+    return type(exc).__name__ in ("RateLimitError", "ResourceExhausted", "RateLimited")
+
+
+class ProviderRouter:
+    def __init__(self, providers, hedge_after=None, max_workers=8):
+        self.providers = list(providers)
+        self.hedge_after = hedge_after  # seconds, "auto" (primary p95) or None (off)
+        self.stats = {p.key: ProviderStats() for p in self.providers}
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm-router")
+
+    def ranked(self):
+        now = time.monotonic()
+        healthy = [p for p in self.providers if self.stats[p.key].healthy(now)]
+        # When everything is cooling down, still try the least-bad option instead of failing outright.
+        candidates = healthy or sorted(self.providers, key=lambda p: self.stats[p.key].cooldown_until)
+        return sorted(candidates, key=lambda p: self.stats[p.key].percentile(0.5) or 0.0)
+
+    def _run(self, provider, final_prompt, messages, on_chunk):
+        start = time.monotonic()
+        try:
+            result = provider.call(final_prompt, messages, on_chunk)
+        except Exception as e:
+            stats = self.stats[provider.key]
+            stats.record(time.monotonic() - start, True)
+            if is_rate_limit(e):
+                stats.cool_down(getattr(e, "retry_after", None) or rate_limit.retry_hint(e) or ERROR_COOLDOWN)
+            elif len(stats.outcomes) >= 5 and stats.error_rate() >= MAX_ERROR_RATE:
+                stats.cool_down(ERROR_COOLDOWN, reset=True)
+            print(f"⚠️ {provider.key} failed: {e}")
+            raise
+        self.stats[provider.key].record(time.monotonic() - start, False)
+        return result
+
+    def _submit(self, provider, final_prompt, messages, on_chunk):
+        # Carry the caller's context so metrics.collect() still sees spans from pool threads.
+        return self.pool.submit(contextvars.copy_context().run, self._run, provider, final_prompt, messages, on_chunk)
+
+    def _hedge_delay(self, provider):
+        if self.hedge_after == "auto":
+            return self.stats[provider.key].percentile(0.95)
+        return self.hedge_after
+
+    def call(self, final_prompt, messages, on_chunk=None):
+        order = self.ranked()
+        if not order:
+            raise AllProvidersFailed("No providers configured.")
+        last_error = None
+
+        # Streams can't be hedged (two streams would interleave), only failed over, and only
+        # before the first chunk: the caller's streamer already holds the partial text.
+        if on_chunk is not None or self.hedge_after is None or len(order) < 2:
+            emitted = []
+            def forward(piece):
+                emitted.append(True)
+                on_chunk(piece)
+            for provider in order:
+                try:
+                    return self._run(provider, final_prompt, messages, forward if on_chunk is not None else None)
+                except Exception as e:
+                    last_error = e
+                    if emitted:
+                        break
+            raise AllProvidersFailed(str(last_error)) from last_error
+
+        pending = {}
+        queue = list(order)
+        first = queue.pop(0)
+        pending[self._submit(first, final_prompt, messages, None)] = first
+        delay = self._hedge_delay(first)
+
+        while pending:
+            done, _ = wait(pending, timeout=delay if queue else None, return_when=FIRST_COMPLETED)
+            if not done:
+                # Too slow: hedge with the next best provider, keep waiting on both.
+                hedge = queue.pop(0)
+                pending[self._submit(hedge, final_prompt, messages, None)] = hedge
+                delay = self._hedge_delay(hedge)
+                continue
+            for future in done:
+                pending.pop(future)
+                try:
+                    return future.result()
+                except Exception as e:
+                    last_error = e
+            if not pending and queue:
+                # Everything in flight failed: fail over to the next one.
+                nxt = queue.pop(0)
+                pending[self._submit(nxt, final_prompt, messages, None)] = nxt
+        raise AllProvidersFailed(str(last_error)) from last_error
+
+    def snapshot(self):
+        return {key: stats.snapshot() for key, stats in self.stats.items()}
+
+
+class FakeProvider:
+    """
+    Local stand-in for a provider: latency (seconds, or (low, high) range), error and
+    429 injection rates, and a canned or computed reply.
+    """
+
+    def __init__(self, name="fake", model="fake-1", latency=0.05, error_rate=0.0, rate_limit_rate=0.0, reply=None):
+        self.name = name
+        self.model = model
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.reply = reply or (lambda prompt, messages: {"response": f"[{name}] Got it: {messages[-1]['content']}", "updates": {}})
+
+    def __call__(self, final_prompt, messages, on_chunk=None):
+        low, high = self.latency if isinstance(self.latency, tuple) else (self.latency, self.latency)
+        time.sleep(random.uniform(low, high))
+        roll = random.random()
+        if roll < self.rate_limit_rate:
+            raise rate_limit.RateLimited(1.0)
+        if roll < self.rate_limit_rate + self.error_rate:
+            raise RuntimeError(f"{self.name}: injected error")
+        result = self.reply(final_prompt, messages)
+        if on_chunk is not None:
+            on_chunk(json.dumps(result))
+        return result
+
+    def as_provider(self):
+        return Provider(self.name, self.model, self)
@@ -0,0 +1,180 @@
+import copy
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+# --- SERVER-SIDE CONVERSATION SESSIONS ---
+# Holds history + draft per session id so clients only send the new message.
+# Memory is bounded three ways: max sessions (LRU), max bytes held (LRU) and TTL.
+# With a directory configured, sessions are also written to disk as JSON so an
+# evicted or restarted session can be loaded back on the next turn.
+# With a draft_store.DraftStore instead (SESSION_DB), writes go through its write-behind
+# queue, so a turn never waits on disk. Those drafts are durable: the TTL only drops
+# them from memory, and they can be resumed by id until deleted.
+
+class SessionStore:
+    def __init__(self, max_sessions=10000, max_bytes=64 * 1024 * 1024, ttl=3600, directory=None, drafts=None):
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.directory = directory
+        self.drafts = drafts
+        self.sessions = OrderedDict()
+        self.bytes_held = 0
+        self.lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "created": 0, "evictions": 0, "expirations": 0, "disk_loads": 0}
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    # --- disk backend ---
+
+    def _path(self, session_id):
+        # Session ids are generated hex strings; anything else never touches the filesystem.
+        if not self.directory or not session_id.isalnum():
+            return None
+        return os.path.join(self.directory, f"{session_id}.json")
+
+    def _write(self, session):
+        if self.drafts:
+            self.drafts.save(session["id"], session["draft"], session["history"],
+                             session["draft_version"], session["draft_log"])
+        elif path := self._path(session["id"]):
+            tmp = path + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump(session, f)
+            os.replace(tmp, path)
+
+    def _read(self, session_id):
+        if self.drafts:
+            saved = self.drafts.load(session_id)
+            if saved is None:
+                return None
+            return {"id": session_id, "history": saved["transcript"], "draft": saved["draft"],
+                    "draft_version": saved["version"], "draft_log": saved["log"], "updated": saved["updated"]}
+        path = self._path(session_id)
+        if not path or not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    def _delete(self, session_id):
+        if self.drafts:
+            self.drafts.delete(session_id)
+            return
+        path = self._path(session_id)
+        if path and os.path.exists(path):
+            os.remove(path)
+
+    # --- memory ---
+
+    @staticmethod
+    def _size(session):
+        return len(json.dumps(session, separators=(",", ":")))
+
+    def _drop(self, session_id):
+        session = self.sessions.pop(session_id)
+        self.bytes_held -= session.pop("_size", 0)
+        return session
+
+    def _expire(self, session_id):
+        self._drop(session_id)
+        if not self.drafts:
+            self._delete(session_id)
+        self.counters["expirations"] += 1
+
+    def _evict(self):
+        now = time.time()
+        # Expired sessions first (oldest at the front), then plain LRU until under both caps.
+        while self.sessions:
+            session_id, session = next(iter(self.sessions.items()))
+            if now - session["updated"] > self.ttl:
+                self._expire(session_id)
+            elif len(self.sessions) > self.max_sessions or self.bytes_held > self.max_bytes:
+                self._drop(session_id)
+                self.counters["evictions"] += 1
+            else:
+                break
+
+    def _put(self, session):
+        if session["id"] in self.sessions:
+            self._drop(session["id"])
+        session["_size"] = self._size(session)
+        self.sessions[session["id"]] = session
+        self.bytes_held += session["_size"]
+        self._evict()
+
+    # --- public API ---
+
+    def create(self, history=None, draft=None):
+        session = {"id": uuid.uuid4().hex, "history": history or [], "draft": draft or {}, "updated": time.time()}
+        with self.lock:
+            self._put(session)
+            self.counters["created"] += 1
+        self._write(self._public(session))
+        return self._public(session)
+
+    def get(self, session_id):
+        if not session_id:
+            return None
+        with self.lock:
+            session = self.sessions.get(session_id)
+            if session is not None and time.time() - session["updated"] > self.ttl:
+                self._expire(session_id)
+                session = None
+            if session is not None:
+                self.sessions.move_to_end(session_id)
+                self.counters["hits"] += 1
+                return self._public(session)
+        session = self._read(session_id)
+        if session is not None and self.drafts:
+            session["updated"] = time.time()  # durable draft: resuming counts as fresh for the memory TTL
+        if session is None or time.time() - session["updated"] > self.ttl:
+            with self.lock:
+                self.counters["misses"] += 1
+            return None
+        with self.lock:
+            self._put(session)
+            self.counters["disk_loads"] += 1
+        return self._public(session)
+
+    def save(self, session):
+        session = dict(session, updated=time.time())
+        with self.lock:
+            self._put(session)
+        self._write(self._public(session))
+        return self._public(session)
+
+    def delete(self, session_id):
+        with self.lock:
+            if session_id in self.sessions:
+                self._drop(session_id)
+        self._delete(session_id)
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters, sessions=len(self.sessions), bytes_held=self.bytes_held)
+
+    @staticmethod
+    def _public(session):
+        # Copy without bookkeeping. The draft is nested and patched in place by draft_state,
+        # so it is deep-copied; draft_version/draft_log travel with it.
+        return {"id": session["id"], "history": list(session["history"]), "draft": copy.deepcopy(session["draft"]),
+                "draft_version": session.get("draft_version", 0), "draft_log": list(session.get("draft_log", ())),
+                "updated": session["updated"]}
+
+
+def store_from_env():
+    drafts = None
+    if db_path := os.getenv("SESSION_DB"):
+        import draft_store
+        drafts = draft_store.get_store(db_path)
+    return SessionStore(
+        max_sessions=int(os.getenv("SESSION_MAX", "10000")),
+        max_bytes=int(os.getenv("SESSION_MAX_BYTES", str(64 * 1024 * 1024))),
+        ttl=float(os.getenv("SESSION_TTL", "3600")),
+        directory=os.getenv("SESSION_DIR") or None,
+        drafts=drafts,
+    )
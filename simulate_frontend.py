@@ -9,26 +9,27 @@ context = {
     "hasPayoutMethod": False 
 }
 
-history = []
+# The server keeps the conversation; we only send the new message + session id.
+session_id = None
 
 while True:
     user_input = input("\nYou: ")
     
     payload = {
         "message": user_input,
-        "history": history,
+        "sessionId": session_id,
         "userContext": context
     }
     
     response = requests.post(url, json=payload).json()
     
     # Print AI Response
+    if 'error' in response:
+        print(f"❌ Error: {response['error']}")
+        continue
+    session_id = response.get('sessionId', session_id)
     print(f"🤖 AI: {response['text']}")
     
     # Check if AI updated the form
     if response.get('functionCall'):
-        print(f"📝 FORM UPDATE: {json.dumps(response['functionCall']['args'], indent=2)}")
-
-    # Update history
-    history.append({"role": "user", "text": user_input})
-    history.append({"role": "model", "text": response['text']})
\ No newline at end of file
+        print(f"📝 FORM UPDATE: {json.dumps(response['functionCall']['args'], indent=2)}")
\ No newline at end of file
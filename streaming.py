@@ -0,0 +1,77 @@
+import json
+import re
+
+# --- STREAMING HELPERS ---
+# Providers stream the JSON reply ({"response": "...", "updates": {...}}) a few
+# characters at a time. JsonFieldStreamer pulls the text of one string field out of
+# that stream as it arrives, so the UI can render it before the JSON is complete.
+# The full text is still parsed with json.loads once the stream ends.
+
+_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+
+class JsonFieldStreamer:
+    def __init__(self, field="response"):
+        self.key_re = re.compile(r'"' + re.escape(field) + r'"\s*:\s*"')
+        self.buffer = ""
+        self.pos = None   # index in buffer where the string value starts, once found
+        self.done = False
+
+    def feed(self, chunk):
+        """Add raw JSON text; returns the newly decoded part of the field (may be '')."""
+        self.buffer += chunk
+        if self.done:
+            return ""
+        if self.pos is None:
+            m = self.key_re.search(self.buffer)
+            if not m:
+                return ""
+            self.pos = m.end()
+        out = []
+        i = self.pos
+        while i < len(self.buffer):
+            c = self.buffer[i]
+            if c == '"':
+                self.done = True
+                i += 1
+                break
+            if c == "\\":
+                if i + 1 >= len(self.buffer):
+                    break  # wait for the rest of the escape
+                e = self.buffer[i + 1]
+                if e == "u":
+                    if i + 6 > len(self.buffer):
+                        break
+                    code = int(self.buffer[i + 2:i + 6], 16)
+                    if 0xD800 <= code < 0xDC00:
+                        # Surrogate pair (emoji): wait for the low half and combine.
+                        if i + 12 > len(self.buffer):
+                            break
+                        low = int(self.buffer[i + 8:i + 12], 16)
+                        code = 0x10000 + ((code - 0xD800) << 10) + (low - 0xDC00)
+                        i += 6
+                    out.append(chr(code))
+                    i += 6
+                    continue
+                out.append(_ESCAPES.get(e, e))
+                i += 2
+                continue
+            out.append(c)
+            i += 1
+        self.pos = i
+        return "".join(out)
+
+
+def collect(stream, get_text, on_chunk):
+    # Drain a provider stream, forwarding each text piece, and return the joined text.
+    parts = []
+    for chunk in stream:
+        piece = get_text(chunk)
+        if piece:
+            parts.append(piece)
+            on_chunk(piece)
+    return "".join(parts)
+
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
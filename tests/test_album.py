@@ -0,0 +1,22 @@
+import album
+
+
+def album_draft(*tracks):
+    return {"release": {"title": "Nights", "genre": "Pop", "type": "EP"},
+            "track": {"credits": {"composers": ["Ana Popescu"]}},
+            "tracks": [{"title": title, **override} for title, override in tracks]}
+
+
+def test_questions_reached_only_through_an_override_are_asked_once_as_shared():
+    draft = album_draft(("One", {}), ("Two", {}), ("Three", {"lyrics": {"language": "English"}}))
+    issues = {path: tracks for path, _, tracks in album.validate(draft)}
+    assert issues["track.lyrics.language"] is None
+    assert issues["track.lyrics.explicit_rating"] is None
+    assert issues["track.lyrics.lyricist"] is None
+
+
+def test_an_issue_in_an_overridden_field_is_asked_for_that_track():
+    draft = album_draft(("One", {}), ("Two", {"lyrics": {"language": "Klingonese"}}))
+    issues = [(path, tracks) for path, _, tracks in album.validate(draft)]
+    assert ("track.lyrics.language", [2]) in issues
+    assert ("track.lyrics.language", None) in issues
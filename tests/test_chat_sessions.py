@@ -0,0 +1,44 @@
+import os
+import threading
+
+import pytest
+
+pytest.importorskip("flask")
+pytest.importorskip("google.api_core")
+os.environ.setdefault("GEMINI_API_KEY", "offline-test")
+os.environ["LLM_WARM_UP"] = "0"
+
+import agent_api  # noqa: E402
+import fake_llm  # noqa: E402
+
+FIRST_TURN = {"message": "hi", "userContext": {"artistName": "xboggdan"}, "noCache": True}
+
+
+def post_together(headers):
+    # Two first turns in flight at the same time, so a shared flight would merge them.
+    results = []
+
+    def post():
+        res = agent_api.app.test_client().post("/chat", json=FIRST_TURN, headers=headers)
+        results.append((res.status_code, res.get_json()))
+
+    threads = [threading.Thread(target=post) for _ in range(2)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+
+def test_anonymous_first_turns_get_their_own_sessions(monkeypatch):
+    monkeypatch.setattr(agent_api, "model", fake_llm.FakeGeminiModel(latency=0.3))
+    (status_a, a), (status_b, b) = post_together({})
+    assert status_a == status_b == 200
+    assert a["sessionId"] != b["sessionId"]
+
+
+def test_first_turn_retry_with_idempotency_key_shares_the_session(monkeypatch):
+    monkeypatch.setattr(agent_api, "model", fake_llm.FakeGeminiModel(latency=0.3))
+    (status_a, a), (status_b, b) = post_together({"Idempotency-Key": "first-turn-retry"})
+    assert status_a == status_b == 200
+    assert a["sessionId"] == b["sessionId"]
@@ -0,0 +1,24 @@
+import pytest
+
+import draft_state
+
+
+def test_bad_op_leaves_the_draft_unchanged():
+    data = {"release": {"title": "Neon"}, "track": {"credits": {"composers": ["A"]}}}
+    draft = draft_state.Draft(data)
+    with pytest.raises(draft_state.InvalidPatch):
+        draft.apply([{"op": "replace", "path": "release.title", "value": "Old Song"},
+                     {"op": "add", "path": "release.genre.-", "value": "Pop"},
+                     {"op": "add", "path": "track.credits.composers.-", "value": "B"}])
+    assert draft.data is data
+    assert data == {"release": {"title": "Neon"}, "track": {"credits": {"composers": ["A"]}}}
+    assert draft.version == 0 and not draft.log
+
+
+def test_good_ops_are_applied_in_place():
+    data = {"release": {"title": "Neon"}, "track": {"credits": {"composers": []}}}
+    draft = draft_state.Draft(data)
+    assert draft.apply([{"op": "replace", "path": "release.title", "value": "Old Song"},
+                        {"op": "add", "path": "track.credits.composers.-", "value": "A"}]) == 1
+    assert draft.data is data
+    assert data == {"release": {"title": "Old Song"}, "track": {"credits": {"composers": ["A"]}}}
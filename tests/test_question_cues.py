@@ -0,0 +1,16 @@
+from datetime import date
+
+import dsp_rules
+import nlu
+
+REMASTER_QUESTION = f"Since this is **Remastered**, what was the **Year of the Original Release**? ({dsp_rules.MIN_YEAR}-{date.today().year})"
+
+
+def test_remaster_year_question_is_not_a_production_question():
+    assert dsp_rules.field_for_question(REMASTER_QUESTION) == "release.version.remaster_year"
+    assert nlu.expected_field(REMASTER_QUESTION) == "release.version.remaster_year"
+
+
+def test_production_question_still_matches():
+    assert dsp_rules.field_for_question("Who mixed and mastered the track?") == "track.credits.production"
+    assert dsp_rules.field_for_question("Who produced it?") == "track.credits.production"